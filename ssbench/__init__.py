@@ -11,3 +11,14 @@ CREATE_OBJECT = 'upload_object'
 READ_OBJECT = 'get_object'
 UPDATE_OBJECT = 'update_object'
 DELETE_OBJECT = 'delete_object'
+# (Creates many objects at once; only used to initialize the cluster)
+EXTRACT_ARCHIVE = 'extract_archive'
+
+# Result keys for how many of a job's connections were reused, newly opened,
+# and opened to replace a broken one
+CONNECTION_COUNTS = ('conn_hits', 'conn_misses', 'conn_reconnects')
+
+# Result keys for how long each phase of a job's (last) request took:
+# connecting and the TLS handshake (only if it needed a new connection),
+# sending the request, waiting for the response, and reading its body
+PHASES = ('connect_time', 'tls_time', 'send_time', 'wait_time', 'body_time')
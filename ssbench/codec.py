@@ -0,0 +1,158 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+Compact wire encoding for the job and result records passed between the
+master and workers (and saved in results files).
+
+A message is a msgpack array of [CODEC_VERSION, records].  Each record is
+itself an array: a bitmask of which of RECORD_FIELDS are present, followed by
+the values of those fields in order, followed by a dict of any other keys (if
+the EXTRAS bit is set in the mask).  Operation types, size names, container
+names, and the usual "<size name>_<6-digit index>" object names are sent as
+small ints (indexes into tables both ends share via the session) when they
+can be, and as strings otherwise.
+
+Plain dict records, and messages which are a bare list of dict records (as
+older versions of ssbench sent and saved), pass through decoding unchanged.
+"""
+
+import msgpack
+
+import ssbench
+
+
+CODEC_VERSION = 1
+
+# (May only be appended to, like RECORD_FIELDS)
+OP_TYPES = (ssbench.CREATE_OBJECT, ssbench.READ_OBJECT,
+            ssbench.UPDATE_OBJECT, ssbench.DELETE_OBJECT,
+            ssbench.EXTRACT_ARCHIVE)
+
+# Order matters (and may only be appended to): a field's position is its bit
+# in a record's mask.
+RECORD_FIELDS = (
+    # jobs
+    'type', 'size_str', 'container', 'name', 'size', 'scheduled_at',
+    'head_first', 'noop',
+    # results
+    'worker_id', 'completed_at', 'first_byte_latency', 'last_byte_latency',
+    'trans_id', 'retries', 'corrected_first_byte_latency',
+    'corrected_last_byte_latency', 'exception', 'traceback',
+    'conn_hits', 'conn_misses', 'conn_reconnects', 'storage_url',
+    'connect_time', 'tls_time', 'send_time', 'wait_time', 'body_time',
+    'sampled', 'summarized',
+)
+_FIELD_BITS = dict((field, 1 << i) for i, field in enumerate(RECORD_FIELDS))
+EXTRAS = 1 << len(RECORD_FIELDS)
+
+
+def object_index(size_str, name):
+    """
+    Object names generated by Scenario look like "small_000042".
+
+    :returns: The index in such a name (e.g. 42), or None if the name isn't
+              like that
+    """
+    prefix, _, index = name.rpartition('_')
+    if prefix == size_str and index.isdigit():
+        index = int(index)
+        if '%s_%06d' % (size_str, index) == name:
+            return index
+    return None
+
+
+class Codec(object):
+    def __init__(self, size_names=(), containers=()):
+        """
+        :size_names: The scenario's size names, in order
+        :containers: The scenario's container names, in order
+        """
+        self.size_names = list(size_names)
+        self.size_indexes = dict(
+            (name, i) for i, name in enumerate(self.size_names))
+        self.containers = list(containers)
+        self.container_indexes = dict(
+            (name, i) for i, name in enumerate(self.containers))
+        self.op_indexes = dict((op, i) for i, op in enumerate(OP_TYPES))
+
+    def encode(self, records):
+        """
+        :records: A list of job or result dicts
+        :returns: The packed message (a string)
+        """
+        return msgpack.dumps([CODEC_VERSION,
+                              [self.encode_record(r) for r in records]])
+
+    def decode(self, raw):
+        """
+        :raw: A packed message, as from encode()
+        :returns: A list of job or result dicts
+        """
+        return self.decode_message(msgpack.loads(raw, use_list=False))
+
+    def decode_message(self, message):
+        """
+        Like decode(), but for an already-unpacked message (e.g. from a
+        msgpack.Unpacker over a results file).
+        """
+        if not message or isinstance(message[0], dict):
+            return list(message)  # legacy list of dicts
+        version, records = message
+        if version != CODEC_VERSION:
+            raise ValueError('Unsupported message version %r' % (version,))
+        return [self.decode_record(r) for r in records]
+
+    def encode_record(self, record):
+        if not isinstance(record, dict) or record.get('type') not in \
+                self.op_indexes:
+            return record  # control messages, etc. go as-is
+        interned = dict(record, type=self.op_indexes[record['type']])
+        size_str = record.get('size_str')
+        if size_str in self.size_indexes:
+            interned['size_str'] = self.size_indexes[size_str]
+            if 'name' in record:
+                interned['name'] = self._intern_name(size_str, record['name'])
+        if record.get('container') in self.container_indexes:
+            interned['container'] = \
+                self.container_indexes[record['container']]
+        mask = 0
+        values = []
+        for field in RECORD_FIELDS:
+            if field in interned:
+                mask |= _FIELD_BITS[field]
+                values.append(interned.pop(field))
+        if interned:  # anything left over isn't one of RECORD_FIELDS
+            mask |= EXTRAS
+            values.append(interned)
+        values.insert(0, mask)
+        return values
+
+    def decode_record(self, encoded):
+        if isinstance(encoded, dict):
+            return encoded
+        mask = encoded[0]
+        record = {}
+        i = 1
+        for field in RECORD_FIELDS:
+            if mask & _FIELD_BITS[field]:
+                record[field] = encoded[i]
+                i += 1
+        if mask & EXTRAS:
+            record.update(encoded[i])
+        record['type'] = OP_TYPES[record['type']]
+        size_str = record.get('size_str')
+        if isinstance(size_str, (int, long)):
+            size_str = record['size_str'] = self.size_names[size_str]
+        container = record.get('container')
+        if isinstance(container, (int, long)):
+            record['container'] = self.containers[container]
+        name = record.get('name')
+        if isinstance(name, (int, long)):
+            record['name'] = '%s_%06d' % (size_str, name)
+        return record
+
+    def _intern_name(self, size_str, name):
+        index = object_index(size_str, name)
+        return name if index is None else index
@@ -0,0 +1,454 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+The parts of a worker which don't depend on how it does its I/O: the session
+the master sends, what gets uploaded, and the shape of job results.  Each
+worker engine (ssbench.worker.Worker, on gevent, and
+ssbench.poll_worker.PollWorker, on a plain poll loop) builds on Engine.
+Running several worker processes at once is also the same for every engine.
+
+Nothing here may monkey-patch anything, or import a module which does.
+"""
+
+import os
+import time
+import signal
+import logging
+import traceback
+import multiprocessing
+
+import ssbench
+from ssbench.codec import Codec
+from ssbench.histogram import Histogram
+from ssbench.importer import random
+from ssbench.util import add_dicts, correct_latencies, payload, payload_pool
+from ssbench.util import payload_md5, payload_pool_md5
+from ssbench.util import PAYLOAD_POOL_OFFSETS
+import ssbench.swift_client as client
+
+
+DEFAULT_BLOCK_SIZE = 2 ** 16  # 65536
+
+# A worker exits with this status when the master tells it to
+SUICIDE_EXIT_STATUS = 88
+# Seconds to wait before restarting a worker process which died
+RESTART_DELAY = 1
+
+# How a worker picks which of several storage URLs (proxies) each request
+# goes to; see UrlSelector
+URL_POLICIES = ('random', 'round-robin', 'least-outstanding', 'p2c-ewma')
+
+
+class UrlSelector(object):
+    """
+    Picks a storage URL for each request, per one of URL_POLICIES:
+
+    random: any of them, at random
+    round-robin: each in turn
+    least-outstanding: the one with the fewest of our requests in flight
+    p2c-ewma: the better of two picked at random, by their (exponentially
+              weighted moving) average latency times one more than their
+              requests in flight; a slow proxy gets less of the load, but
+              never none of it
+
+    Callers say when each request starts and finishes (with its latency).
+    """
+    # Weight of each new latency in a URL's moving average
+    EWMA_WEIGHT = 0.2
+
+    def __init__(self, policy='random'):
+        if policy not in URL_POLICIES:
+            raise ValueError('Unknown storage URL policy %r' % (policy,))
+        self.policy = policy
+        self.in_flight = {}  # storage_url -> requests in flight
+        self.latency = {}  # storage_url -> moving average latency
+        self.turn = 0
+
+    def choose(self, storage_urls):
+        if len(storage_urls) == 1:
+            return storage_urls[0]
+        if self.policy == 'round-robin':
+            self.turn += 1
+            return storage_urls[self.turn % len(storage_urls)]
+        if self.policy == 'least-outstanding':
+            # (Ties are broken at random, so idle URLs share the load)
+            return min(storage_urls, key=lambda url: (
+                self.in_flight.get(url, 0), random.random()))
+        if self.policy == 'p2c-ewma':
+            return min(random.sample(storage_urls, 2), key=self._cost)
+        return random.choice(storage_urls)
+
+    def _cost(self, url):
+        # A URL we have no latency for yet costs nothing, so gets tried
+        return self.latency.get(url, 0.0) * (self.in_flight.get(url, 0) + 1)
+
+    def started(self, url):
+        self.in_flight[url] = self.in_flight.get(url, 0) + 1
+
+    def finished(self, url, latency):
+        # (The request may have started before a new session replaced us)
+        self.in_flight[url] = max(self.in_flight.get(url, 0) - 1, 0)
+        average = self.latency.get(url)
+        if average is None:
+            self.latency[url] = latency
+        else:
+            self.latency[url] = average + \
+                self.EWMA_WEIGHT * (latency - average)
+
+
+class ResultSummary(object):
+    """
+    What a worker's results over an interval add up to, per operation, size,
+    and storage URL: counts, and a Histogram of each kind of latency, which
+    the reporter merges just as it would the results themselves.  A worker
+    with a session's "summary_interval" set sends these (as SUMMARY records)
+    in place of most of its results.
+    """
+    LATENCIES = ('first_byte_latency', 'last_byte_latency',
+                 'corrected_first_byte_latency',
+                 'corrected_last_byte_latency') + ssbench.PHASES
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.entries = {}  # (type, size_str, storage_url) -> entry dict
+        self.completions = {}  # second -> successful results completed in it
+
+    def add(self, result):
+        key = (result.get('type'), result.get('size_str'),
+               result.get('storage_url'))
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {
+                'req_count': 0, 'errors': 0, 'retries': 0, 'latencies': {}}
+        entry['retries'] += int(result.get('retries', 0))
+        for count_key in ssbench.CONNECTION_COUNTS:
+            if result.get(count_key):
+                entry[count_key] = entry.get(count_key, 0) + \
+                    result[count_key]
+        completed_at = result['completed_at']
+        entry['stop'] = max(entry.get('stop', completed_at), completed_at)
+        if 'exception' in result:
+            entry['errors'] += 1
+            if result.get('verify_failed'):
+                entry['verify_errors'] = entry.get('verify_errors', 0) + 1
+            return
+        entry['req_count'] += 1
+        start = completed_at - result['last_byte_latency']
+        entry['start'] = min(entry.get('start', start), start)
+        second = int(completed_at)
+        self.completions[second] = self.completions.get(second, 0) + 1
+        for latency_type in self.LATENCIES:
+            # (Like the reporter, ignoring missing and zero latencies)
+            if result.get(latency_type):
+                histogram = entry['latencies'].get(latency_type)
+                if histogram is None:
+                    histogram = entry['latencies'][latency_type] = \
+                        Histogram()
+                histogram.record(result[latency_type])
+
+    def record(self, worker_id, flushed=False):
+        """
+        :returns: The summary as a SUMMARY record, ready to encode
+        """
+        entries = []
+        for (op_type, size_str, storage_url), entry in \
+                self.entries.iteritems():
+            entry = dict(entry, latencies=dict(
+                (latency_type, histogram.encode()) for latency_type, histogram
+                in entry['latencies'].iteritems()))
+            entries.append([op_type, size_str, storage_url, entry])
+        record = {'type': 'SUMMARY', 'worker_id': worker_id,
+                  'completions': self.completions, 'entries': entries}
+        if flushed:
+            record['flushed'] = True
+        return record
+
+
+class Engine(object):
+    """
+    A worker engine subclass provides worker_id, concurrency, work_dealer and
+    results_push, and queue_result(result), which queues up a job's result
+    (or a SUMMARY) for sending to the master.
+    """
+    # Re-send our HELLO after going this many seconds without any work, so a
+    # (re)started master learns about us.
+    HELLO_INTERVAL = 1
+    summary = None
+
+    def hello(self):
+        """
+        :returns: The HELLO message which tells the master we're here and
+                  how many jobs it may have in flight on us at once; the
+                  master only sends us work against those slots.
+        """
+        return {
+            'type': 'HELLO',
+            'worker_id': self.worker_id,
+            'concurrency': self.concurrency,
+        }
+
+    def start_session(self, session):
+        """
+        Takes on the settings shared by all jobs of a run (auth_kwargs,
+        timeouts, block_size, etc.), as sent by the master.
+        """
+        self.session = session
+        self.url_selector = UrlSelector(session.get('url_policy', 'random'))
+        self.summary = None
+        if session.get('summary_interval'):
+            self.summary = ResultSummary(time.time())
+        self.codec = Codec(session.get('size_names', ()),
+                           session.get('containers', ()))
+        # Build any payload pools now, not during a job
+        for spec in set(session.get('payload_by_size', {}).itervalues()):
+            payload_pool(spec)
+
+    def suicide(self):
+        logging.info('Got SUICIDE; closing sockets and exiting.')
+        self.work_dealer.close()
+        self.results_push.close()
+        os._exit(SUICIDE_EXIT_STATUS)
+
+    def put_results(self, *args, **kwargs):
+        """
+        Put work result into stats queue.  Given *args and **kwargs are
+        combined per add_dicts().  This worker's "ID" and the time of
+        completion are included in the results, as are latencies corrected
+        for any time the job spent queued (see correct_latencies()).
+
+        :*args: An optional list of dicts (to be combined via add_dicts())
+        :**kwargs: An optional set of key/value pairs (to be combined via
+                   add_dicts())
+        :returns: (nothing)
+        """
+        result = correct_latencies(add_dicts(
+            *args, completed_at=time.time(), worker_id=self.worker_id,
+            **kwargs))
+        if self.summary is None:
+            self.queue_result(result)
+        else:
+            self._summarize(result)
+
+    def _summarize(self, result):
+        """
+        Adds a result to our summary, sending it (as a SUMMARY record) every
+        "summary_interval" seconds (and when the master asks for it at the
+        end of a run; see flush_summary()).  Only a sample of the results
+        themselves are sent (all failures, any slower than
+        "raw_tail_latency", and a "raw_sample_rate" fraction of the rest),
+        marked "sampled"; the master still needs to hear about the rest (to
+        count the jobs done, and to know what objects were created), so gets
+        just their type and worker_id (and the object names of creates),
+        marked "summarized".
+        """
+        self.summary.add(result)
+        if self._keep_raw(result):
+            result['sampled'] = True
+        else:
+            result = dict(
+                (key, result[key]) for key in (
+                    ('type', 'worker_id', 'size_str', 'container', 'name',
+                     'objects') if result.get('type') in (
+                         ssbench.CREATE_OBJECT, ssbench.EXTRACT_ARCHIVE)
+                    else ('type', 'worker_id'))
+                if key in result)
+            result['summarized'] = True
+        now = time.time()
+        if now - self.summary.started_at >= self.session['summary_interval']:
+            self.queue_result(self.summary.record(self.worker_id))
+            self.summary = ResultSummary(now)
+        self.queue_result(result)
+
+    def flush_summary(self):
+        """
+        Sends our summary so far, marked "flushed" (even if we have none, so
+        the master, which asks for it once a run's results are all in, knows
+        we're done).
+        """
+        summary = self.summary or ResultSummary(time.time())
+        self.queue_result(summary.record(self.worker_id, flushed=True))
+        if self.summary is not None:
+            self.summary = ResultSummary(time.time())
+
+    def _keep_raw(self, result):
+        if 'exception' in result:
+            return True
+        tail = self.session.get('raw_tail_latency')
+        if tail is not None and \
+                result.get('last_byte_latency', 0) >= tail:
+            return True
+        return random.random() < self.session.get('raw_sample_rate', 0.0)
+
+    def put_exception_results(self, job_data, e):
+        # last arg is assumed as the # of retries
+        extra = {}
+        if getattr(e, 'storage_url', None):
+            extra['storage_url'] = e.storage_url
+        if isinstance(e, client.VerificationError):
+            # Wrong data is worse than a failed request; count it separately
+            extra['verify_failed'] = True
+        self.put_results(job_data,
+                         exception=repr(e),
+                         retries=getattr(e, 'retries', 0),
+                         traceback=traceback.format_exc(), **extra)
+
+    def _put_results_from_response(self, object_info, resp_headers):
+        # Strip a key the job had that results don't need:
+        object_info.pop('head_first', None)
+        self.put_results(
+            object_info,
+            dict((key, resp_headers[key])
+                 for key in ssbench.CONNECTION_COUNTS + ('storage_url',)
+                 if resp_headers.get(key)),
+            dict((key, resp_headers[key]) for key in ssbench.PHASES
+                 if key in resp_headers),
+            first_byte_latency=resp_headers.get(
+                'x-swiftstack-first-byte-latency', None),
+            last_byte_latency=resp_headers.get(
+                'x-swiftstack-last-byte-latency', None),
+            trans_id=resp_headers.get('x-trans-id', None),
+            retries=resp_headers.get('retries', 0))
+
+    def handle_noop(self, object_info):
+        self.put_results(
+            object_info,
+            first_byte_latency=0.0,
+            last_byte_latency=0.0,
+            trans_id=None,
+            retries=0)
+    handle_PING = handle_noop
+
+    def _block_size(self):
+        return self.session.get('block_size') or DEFAULT_BLOCK_SIZE
+
+    def _contents(self, size_str, letter='A'):
+        """
+        :returns: A tuple of (contents, offset) for put_object(): for a
+                  "constant" payload, a block of the letter, and otherwise,
+                  the payload's pool, from a random one of
+                  PAYLOAD_POOL_OFFSETS evenly spaced places in it (so few
+                  objects share data, but their MD5s can still be cached)
+        """
+        spec = self.session.get('payload_by_size', {}).get(size_str)
+        if spec is None:
+            return payload(letter, self._block_size()), 0
+        pool = payload_pool(spec)
+        stride = len(pool) // PAYLOAD_POOL_OFFSETS
+        return pool, stride * random.randrange(PAYLOAD_POOL_OFFSETS)
+
+    def _upload_headers(self, object_info, letter, offset):
+        """
+        :returns: The extra headers for uploading an object (whose size has
+                  been made an int) from the given letter or payload pool
+                  offset (see _contents())
+        """
+        send_headers = {}
+        if self.session.get('delete_after'):
+            send_headers.update(
+                {'x-delete-after': self.session['delete_after']})
+        if self.session.get('verify'):
+            # Have the cluster check what it got against what we sent.  A
+            # constant payload's MD5 only depends on its size, but a pool's
+            # depends on where in the pool the object starts.
+            spec = self.session.get('payload_by_size', {}).get(
+                object_info.get('size_str'))
+            if spec is not None:
+                send_headers['etag'] = payload_pool_md5(
+                    spec, object_info['size'], offset)
+            else:
+                send_headers['etag'] = payload_md5(letter,
+                                                   object_info['size'])
+        return send_headers
+
+    def _archive_members(self, archive_info):
+        return [(name, int(size)) + self._contents(size_str)
+                for size_str, name, size in archive_info['objects']]
+
+    def _put_archive_results(self, archive_info, headers):
+        # Sends back those of archive_info's "objects", [size_str, name,
+        # size] each, which the extract-archive actually created
+        failed = client.archive_failures(headers.pop('extract_result'))
+        if failed:
+            logging.warning('%d of %d objects in an archive for %s failed',
+                            len(failed), len(archive_info['objects']),
+                            archive_info['container'])
+            archive_info['objects'] = [obj for obj in archive_info['objects']
+                                       if obj[1] not in failed]
+        self._put_results_from_response(archive_info, headers)
+
+
+def process_count(value):
+    """
+    Parses an ssbench-worker --processes value: a positive integer, or
+    "auto" for one process per CPU.
+    """
+    if value == 'auto':
+        return multiprocessing.cpu_count()
+    count = int(value)
+    if count < 1:
+        raise ValueError('process count must be >= 1, not %d' % count)
+    return count
+
+
+def child_worker_id(worker_id, processes, index):
+    """
+    :returns: The worker ID for the index-th of a worker's processes; a
+              worker with ID W and N processes gives them IDs W * N through
+              W * N + N - 1, so workers with the same N never collide.
+    """
+    return worker_id * processes + index
+
+
+def run_worker_processes(processes, run_worker, fork=os.fork):
+    """
+    Forks processes children, each of which calls run_worker(index), and
+    restarts any which die, except those told to exit by the master (or
+    which exit cleanly).  Returns once every child has exited for good.
+    Anything built before this is called (like payload pools, which are
+    shared mmaps) is shared by all of the children.
+
+    :fork: The fork() to use (gevent's, for gevent workers)
+    """
+    children = {}  # pid -> index
+
+    def spawn(index):
+        pid = fork()
+        if pid == 0:
+            # Otherwise every child would make the same "random" choices
+            # (payload offsets, storage URLs, samples) as every other one
+            random.seed()
+            status = 0
+            try:
+                run_worker(index)
+            except BaseException:
+                logging.exception('Worker process %d died', index)
+                status = 1
+            os._exit(status)
+        children[pid] = index
+
+    def terminate(signum, _frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        os._exit(128 + signum)
+
+    for index in xrange(processes):
+        spawn(index)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    while children:
+        pid, status = os.wait()
+        index = children.pop(pid, None)
+        if index is None:
+            continue
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) in (
+                0, SUICIDE_EXIT_STATUS):
+            continue
+        logging.warning('Worker process %d (pid %d) died with status %d; '
+                        'restarting it', index, pid, status)
+        time.sleep(RESTART_DELAY)
+        spawn(index)
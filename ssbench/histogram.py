@@ -0,0 +1,138 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+Mergeable latency histograms, for workers to summarize their results with
+instead of sending the master every one of them.
+
+Like an HDR histogram, a Histogram's buckets are log-linear: values (in
+seconds) are counted in whole microseconds, exactly below SUB_BUCKETS of
+them, and above that, in SUB_BUCKETS / 2 equal buckets per power of two.
+So any value a Histogram gives back (a percentile, say) is within about
+0.8% of a value it was given, however many it was given, while the count,
+mean, standard deviation, min, and max are exact.  Histograms from any
+number of workers merge by just adding up their buckets.
+"""
+
+import math
+
+
+# Seconds per count
+UNIT = 1e-6
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+
+def bucket_index(value):
+    """
+    :returns: The index of the bucket counting the given value (in seconds)
+    """
+    units = int(value / UNIT)
+    shift = units.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return units
+    return shift * HALF_SUB_BUCKETS + (units >> shift)
+
+
+def bucket_bounds(index):
+    """
+    :returns: A tuple of the lowest value (in seconds) counted by the given
+              bucket, and the lowest one counted by the next
+    """
+    shift = max(index // HALF_SUB_BUCKETS - 1, 0)
+    units = index - shift * HALF_SUB_BUCKETS
+    return (units << shift) * UNIT, ((units + 1) << shift) * UNIT
+
+
+class Histogram(object):
+    def __init__(self, values=()):
+        self.counts = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.min = None
+        self.max = None
+        for value in values:
+            self.record(value)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        for index, count in other.counts.iteritems():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def stdev(self):
+        """
+        :returns: The uncorrected standard deviation, as from
+                  ssbench.util.uncorrected_stdev()
+        """
+        if not self.count:
+            return None
+        mean = self.mean()
+        return math.sqrt(max(self.total_squares / self.count - mean * mean,
+                             0.0))
+
+    def percentile(self, nth_pctile):
+        """
+        :returns: About the smallest value which at least nth_pctile percent
+                  of the values were no greater than (the middle of its
+                  bucket, but never beyond the min or max)
+        """
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(self.count * nth_pctile / 100.0)), 1)
+        if rank >= self.count:
+            return self.max
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        low, high = bucket_bounds(index)
+        return min(max((low + high) / 2.0, self.min), self.max)
+
+    def median(self):
+        return self.percentile(50)
+
+    def encode(self):
+        """
+        :returns: The histogram as a list, for msgpack
+        """
+        return [self.count, self.total, self.total_squares, self.min,
+                self.max, self.counts]
+
+    @classmethod
+    def decode(cls, encoded):
+        histogram = cls()
+        (histogram.count, histogram.total, histogram.total_squares,
+         histogram.min, histogram.max, counts) = encoded
+        histogram.counts = dict(counts)
+        return histogram
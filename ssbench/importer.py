@@ -4,8 +4,8 @@
 
 # Handle any/all wacky imports here
 
-try:
-    from random import SystemRandom
-    random = SystemRandom()
-except ImportError:
-    import random  # noqa
+# A fast, non-cryptographic generator (seeded once from the OS) for incidental
+# choices like which storage URL to use.  Scenarios make their own seeded
+# generators so their job streams can be reproduced.
+from random import Random
+random = Random()
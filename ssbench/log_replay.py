@@ -0,0 +1,173 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+Benchmark jobs taken from a Swift proxy-server access log.
+
+Each successful object GET, PUT, or DELETE in the log becomes a READ, CREATE,
+or DELETE job, in the scenario size category which best fits the request's
+byte count.  Created objects get fresh names (as in Scenario.bench_jobs()),
+and reads and deletes are pointed at existing objects of the right size by
+the run state, so the log's own account, container, and object names don't
+need to exist in the cluster under test.  A PUT can't be told apart from an
+overwrite in the log, so every PUT is replayed as a CREATE.
+
+The log is read a line at a time (and may be gzipped), so logs of any size
+can be replayed.
+"""
+
+import time
+import urllib
+import calendar
+from gzip import GzipFile
+
+import ssbench
+
+
+LOG_DATE_FORMAT = '%d/%b/%Y/%H/%M/%S'
+
+METHOD_TYPES = {
+    'GET': ssbench.READ_OBJECT,
+    'PUT': ssbench.CREATE_OBJECT,
+    'DELETE': ssbench.DELETE_OBJECT,
+}
+
+
+def parse_log_line(line):
+    """
+    Parses one proxy-server access log line (with or without a syslog
+    prefix).  Fields are, in order: client_ip, remote_addr, datetime,
+    method, path, protocol, status, referer, user_agent, auth_token,
+    bytes_recvd, bytes_sent, client_etag, trans_id, headers, request_time,
+    source, log_info, and (in newer Swift) start_time, end_time, and
+    policy_index.
+
+    :returns: A tuple of (timestamp, method, object path, status,
+              bytes_recvd, bytes_sent) for an object request made by a
+              client, or None for any other line
+    """
+    prefix_end = line.find('proxy-server: ')
+    if prefix_end >= 0:
+        line = line[prefix_end + len('proxy-server: '):]
+    fields = line.split()
+    if len(fields) < 17 or fields[16] != '-':
+        return None  # garbage, or a subrequest (e.g. from middleware)
+    path = urllib.unquote(fields[4]).split('?', 1)[0]
+    if len(path.split('/', 4)) < 5 or path.endswith('/'):
+        return None  # an account or container request
+    try:
+        if len(fields) > 18 and fields[18] != '-':
+            timestamp = float(fields[18])
+        else:
+            timestamp = calendar.timegm(time.strptime(
+                urllib.unquote(fields[2]), LOG_DATE_FORMAT))
+        return (timestamp, fields[3], path, int(fields[6]),
+                0 if fields[10] == '-' else int(fields[10]),
+                0 if fields[11] == '-' else int(fields[11]))
+    except ValueError:
+        return None
+
+
+class LogReplay(object):
+    def __init__(self, log_path, scenario, speed=1.0):
+        """
+        :log_path: Path to a proxy-server access log (gzipped if it ends in
+                   .gz)
+        :scenario: The Scenario whose sizes and containers the jobs use
+        :speed: Send jobs at the log's timing, sped up by this factor, or, if
+                None, as fast as the run allows
+        """
+        self.log_path = log_path
+        self.scenario = scenario
+        self.speed = speed
+        if speed is not None and speed <= 0:
+            raise ValueError('speed must be > 0')
+        self._size_ranges = [
+            (size_str, size_data['size_min'], size_data['size_max'])
+            for size_str, size_data in scenario.sizes_by_name.iteritems()]
+        # Sizes the scenario starts out with objects of
+        self._initial_sizes = scenario.bench_size_thresholds.keys()
+
+    @property
+    def timed(self):
+        """
+        True if bench_jobs() yields (offset, job) tuples for a scheduled
+        (open-loop) Master.do_a_run().
+        """
+        return self.speed is not None
+
+    def size_str_for(self, byte_count):
+        """
+        :returns: The first size category whose range holds byte_count, or
+                  else the one whose range is nearest to it
+        """
+        best, best_distance = None, None
+        for size_str, size_min, size_max in self._size_ranges:
+            distance = max(size_min - byte_count, byte_count - size_max, 0)
+            if distance == 0:
+                return size_str
+            if best is None or distance < best_distance:
+                best, best_distance = size_str, distance
+        return best
+
+    def requests(self):
+        """
+        Generator for the successful object GETs, PUTs, and DELETEs in the
+        log, as tuples from parse_log_line().
+        """
+        if self.log_path.endswith('.gz'):
+            log_file = GzipFile(self.log_path, 'rb')
+        else:
+            log_file = open(self.log_path, 'rb')
+        with log_file:
+            for line in log_file:
+                request = parse_log_line(line)
+                if request and request[1] in METHOD_TYPES and \
+                        200 <= request[3] < 300:
+                    yield request
+
+    def bench_jobs(self, run_seconds=None, first_index=None):
+        """
+        Generator for the benchmark jobs (for use with the run state's
+        fill_in_job()).  If the replay is timed, each is yielded as an
+        (offset, job) tuple, where the offset is from the first request in
+        the log, divided by the speed.
+
+        :run_seconds: If set, stop after about this many seconds of the run
+                      (or, if timed, of the sped-up log)
+        :first_index: Name created objects starting from at least this index
+        """
+        index = max(max(
+            self.scenario._scenario_data['initial_files'].itervalues()) + 1,
+            first_index)
+        started = time.time()
+        first_timestamp = None
+        for timestamp, method, _, _, bytes_recvd, bytes_sent in \
+                self.requests():
+            job_type = METHOD_TYPES[method]
+            if job_type == ssbench.CREATE_OBJECT:
+                job = self.scenario.create_job(
+                    self.size_str_for(bytes_recvd), index)
+                job['size'] = bytes_recvd
+                index += 1
+            elif job_type == ssbench.READ_OBJECT:
+                job = self.scenario.job(self.size_str_for(bytes_sent),
+                                        type=job_type)
+            else:
+                # The log doesn't say how big a deleted object was
+                job = self.scenario.job(
+                    self.scenario.random.choice(self._initial_sizes),
+                    type=job_type)
+
+            if self.timed:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                offset = (timestamp - first_timestamp) / self.speed
+                if run_seconds and offset >= run_seconds:
+                    break
+                yield offset, job
+            else:
+                if run_seconds and time.time() - started >= run_seconds:
+                    break
+                yield job
@@ -12,13 +12,15 @@ gevent.monkey.patch_time()
 import os
 import re
 import sys
+import math
 import time
-import signal
 import logging
+import itertools
 import msgpack
 import zmq.green as zmq
 
 import ssbench
+from ssbench.codec import Codec
 from ssbench.importer import random
 import ssbench.swift_client as client
 from ssbench.run_state import RunState
@@ -38,37 +40,180 @@ def _container_creator(storage_urls, token, container, policy=None):
                              headers=put_headers, http_conn=http_conn)
 
 
-def _container_deleter(concurrency, storage_urls, token, container_info):
+# Names per bulk-delete request (Swift's default max_deletes_per_request),
+# and per page of a container listing
+BULK_DELETE_MAX = 10000
+
+
+def _listing_pages(storage_url, token, container, http_conn,
+                   page_size=BULK_DELETE_MAX):
+    # Generator for the pages of a container's listing
+    marker = None
+    while True:
+        _, obj_list = client.get_container(
+            storage_url, token, container, marker=marker, limit=page_size,
+            http_conn=http_conn)
+        if not obj_list:
+            return
+        yield obj_list
+        marker = obj_list[-1]['name']
+
+
+def _container_lister(storage_urls, token, container, existing):
+    # Adds the names of the objects in the container to existing[container],
+    # a page of the listing at a time
+    names = existing[container] = set()
+    storage_url = random.choice(storage_urls)
+    http_conn = client.http_connection(storage_url)
+    for obj_list in _listing_pages(storage_url, token, container, http_conn):
+        names.update(o['name'] for o in obj_list)
+
+
+def _missing_object_jobs(jobs, existing, handle_existing):
+    # Passes on the jobs, except "head_first" ones for objects which are
+    # already in existing; those are handed to handle_existing instead.
+    for job in jobs:
+        if job.pop('head_first', False) and \
+                job['name'] in existing.get(job['container'], ()):
+            handle_existing(job)
+        else:
+            yield job
+
+
+def _archive_jobs(jobs, objects_per_archive):
+    # Gathers CREATE jobs into EXTRACT_ARCHIVE jobs for up to
+    # objects_per_archive objects in one container; other jobs pass through.
+    objects_by_container = {}
+    for job in jobs:
+        if job['type'] != ssbench.CREATE_OBJECT:
+            yield job
+            continue
+        objects = objects_by_container.setdefault(job['container'], [])
+        objects.append([job['size_str'], job['name'], job['size']])
+        if len(objects) >= objects_per_archive:
+            yield {'type': ssbench.EXTRACT_ARCHIVE,
+                   'container': job['container'],
+                   'objects': objects_by_container.pop(job['container'])}
+    for container in sorted(objects_by_container):
+        yield {'type': ssbench.EXTRACT_ARCHIVE, 'container': container,
+               'objects': objects_by_container[container]}
+
+
+class _ObjectDeleter(object):
+    """
+    Deletes objects with Swift's bulk-delete middleware, a batch of up to
+    BULK_DELETE_MAX names per request, or, if the cluster doesn't have it,
+    with a DELETE per object, and keeps count of how that goes.
+    """
+
+    def __init__(self, storage_urls, token, concurrency):
+        self.storage_urls = storage_urls
+        self.token = token
+        self.pool = gevent.pool.Pool(concurrency)
+        # Every DELETE of a single object, from all of the batches at once
+        self.object_pool = gevent.pool.Pool(concurrency)
+        self.bulk = True
+        self.deleted = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def delete(self, container, names):
+        """
+        Starts deleting some of a container's objects.
+
+        :returns: The greenlet doing it
+        """
+        return self.pool.spawn(self._delete, container, names)
+
+    def delete_objects(self, object_infos):
+        """
+        Deletes objects given as (container, name) tuples, and waits for
+        them all to be gone.
+        """
+        batches = {}
+        for container, name in object_infos:
+            batch = batches.setdefault(container, [])
+            batch.append(name)
+            if len(batch) >= BULK_DELETE_MAX:
+                self.delete(container, batches.pop(container))
+        for container, names in batches.iteritems():
+            self.delete(container, names)
+        self.pool.join()
+
+    def report(self):
+        delta_t = max(time.time() - self.started, 1e-6)
+        logging.info('Deleted %d objects (%d failed) in %.1fs, %.1f objs/s, '
+                     'with %s', self.deleted, self.failed, delta_t,
+                     self.deleted / delta_t, 'bulk-delete' if self.bulk
+                     else 'a DELETE per object')
+
+    def _delete(self, container, names):
+        storage_url = random.choice(self.storage_urls)
+        if self.bulk:
+            try:
+                result = client.bulk_delete(storage_url, self.token,
+                                            container, names)
+            except client.ClientException as error:
+                # (A 2xx means the cluster has no bulk middleware)
+                if error.http_status and (error.http_status < 300 or
+                                          error.http_status in (404, 405,
+                                                                501)):
+                    if self.bulk:
+                        logging.warning('Bulk delete unavailable (%s); '
+                                        'deleting objects one at a time',
+                                        error)
+                    self.bulk = False
+                else:
+                    logging.warning('Bulk delete failed (%s); deleting '
+                                    'those %d objects one at a time', error,
+                                    len(names))
+            else:
+                # Objects already gone count as deleted
+                deleted = result['Number Deleted'] + \
+                    result.get('Number Not Found', 0)
+                self.deleted += deleted
+                self.failed += len(names) - deleted
+                return
+
+        gevent.joinall([
+            self.object_pool.spawn(self._delete_object, container, name)
+            for name in names])
+
+    def _delete_object(self, container, name):
+        try:
+            client.delete_object(random.choice(self.storage_urls), self.token,
+                                 container, name)
+        except client.ClientException as error:
+            if error.http_status != 404:
+                self.failed += 1
+                return
+        self.deleted += 1
+
+
+def _container_deleter(deleter, storage_urls, token, container_info):
     container_name = container_info['name']
     logging.info('deleting %r (%d objs)', container_name,
                  container_info['count'])
     storage_url = random.choice(storage_urls)
     http_conn = client.http_connection(storage_url)
-    _, obj_list = client.get_container(
-        random.choice(storage_urls), token, container_name,
-        http_conn=http_conn)
-
-    pool = gevent.pool.Pool(concurrency)
-    for obj_name in [o['name'] for o in obj_list]:
-        pool.spawn(client.delete_object, random.choice(storage_urls), token,
-                   container_name, obj_name)
-    pool.join()
+    # Delete each page of the listing while getting the next one
+    gevent.joinall([
+        deleter.delete(container_name, [o['name'] for o in obj_list])
+        for obj_list in _listing_pages(storage_url, token, container_name,
+                                       http_conn)])
 
     client.delete_container(
         random.choice(storage_urls), token, container_name,
         http_conn=http_conn)
 
 
-def _gen_cleanup_job(object_info):
-    return {
-        'type': ssbench.DELETE_OBJECT,
-        'container': object_info[0],
-        'name': object_info[1],
-    }
-
-
 class Master(object):
     DELETER_RE = '^%s_\d+_%s$'
+    # In an open-loop run, jobs sent later than this many seconds after their
+    # scheduled time are counted as late.
+    LATE_SEND_SECS = 0.01
+    # Seconds to wait at the end of a run for workers' last summaries
+    FLUSH_TIMEOUT = 10
 
     def __init__(self, zmq_bind_ip=None, zmq_work_port=None,
                  zmq_results_port=11300, quiet=False, connect_timeout=None,
@@ -78,32 +223,69 @@ class Master(object):
             results_endpoint = 'tcp://%s:%d' % (zmq_bind_ip, zmq_results_port)
             ipv6 = is_ipv6(zmq_bind_ip)
             self.context = zmq.Context()
-            self.work_push = self.context.socket(zmq.PUSH)
-            self.work_push.ipv6 = ipv6
-            self.work_push.bind(work_endpoint)
+            self.work_router = self.context.socket(zmq.ROUTER)
+            self.work_router.ipv6 = ipv6
+            # Raise instead of silently dropping work sent to a worker
+            # which has gone away
+            self.work_router.router_mandatory = 1
+            self.work_router.bind(work_endpoint)
             self.results_pull = self.context.socket(zmq.PULL)
             self.results_pull.ipv6 = ipv6
             self.results_pull.bind(results_endpoint)
+            self.poller = zmq.Poller()
+            self.poller.register(self.work_router, zmq.POLLIN)
+            self.poller.register(self.results_pull, zmq.POLLIN)
+        # Workers we've heard a HELLO from, keyed by ROUTER identity; each
+        # value is a dict with the worker_id, the worker's concurrency, the
+        # number of jobs we've sent it which haven't come back yet, and the
+        # ID of the last session we sent it.
+        self.workers = {}
+        self.worker_idents = {}  # worker_id -> ROUTER identity
+        # Settings shared by all jobs of a run (auth, timeouts, etc.); each
+        # worker is sent the current session once, ahead of its first jobs.
+        self.session = None
+        self.session_id = 0
+        # Encodes jobs and decodes results; rebuilt with each session's size
+        # and container names.
+        self.codec = Codec()
+        # IDs of workers whose flushed summary we've gotten (see
+        # _flush_summaries())
+        self.flushed = set()
         self.connect_timeout = connect_timeout
         self.network_timeout = network_timeout
         self.quiet = quiet
 
     def process_results_to(self, results_raw, processor, label='',
                            run_results=None):
-        results = msgpack.loads(results_raw, use_list=False)
+        results = self.codec.decode(results_raw)
         result_count = 0
+        summarized = False
         for result in results:
+            if result.get('type') == 'SUMMARY':
+                # Just for the results file; it doesn't finish any job
+                if result.get('flushed'):
+                    self.flushed.add(result['worker_id'])
+                continue
             result_count += 1
+            self._job_done(result.get('worker_id'))
+            if result.get('summarized'):
+                # Only here to say the job's done (and, for a create, what
+                # it created); its stats are in a SUMMARY
+                summarized = True
+                processor(result)
+                continue
             logging.debug(
                 'RESULT: %13s %s/%-17s %s/%s %s',
-                result['type'], result['container'], result['name'],
+                result['type'], result['container'], result.get('name', ''),
                 '%7.4f' % result.get('first_byte_latency')
                 if result.get('first_byte_latency', None) else ' (none)',
                 '%7.4f' % result.get('last_byte_latency')
                 if result.get('last_byte_latency', None) else '(none) ',
                 result.get('trans_id', ''))
             if label and not self.quiet:
-                if 'exception' in result:
+                if result.get('verify_failed'):
+                    sys.stderr.write('V')
+                elif 'exception' in result:
                     sys.stderr.write('X')
                 elif result.get('first_byte_latency', None) is not None:
                     if result['first_byte_latency'] < 1:
@@ -127,17 +309,46 @@ class Master(object):
             processor(result)
 
         if run_results:
-            run_results.process_raw_results(results_raw)
+            if summarized:
+                # Keep the results file down to the summaries and samples
+                results = [result for result in results
+                           if not result.get('summarized')]
+                if results:
+                    run_results.process_raw_results(
+                        self.codec.encode(results))
+            else:
+                run_results.process_raw_results(results_raw)
 
         return result_count
 
     def do_a_run(self, concurrency, job_generator, result_processor,
                  auth_kwargs, mapper_fn=None, label='', noop=False,
-                 batch_size=1, run_results=None):
+                 batch_size=1, run_results=None, scheduled=False,
+                 max_outstanding=None, session=None):
+        """
+        Sends jobs from job_generator to the workers and feeds the results to
+        result_processor.
+
+        By default, the run is closed-loop: a job is only sent when fewer than
+        `concurrency` jobs are in flight.  If `scheduled` is True, the run is
+        open-loop: job_generator must yield (offset, job) tuples, where offset
+        is the number of seconds after the start of the run at which the job
+        should be sent, and each job is sent at its time regardless of how
+        many jobs are in flight, up to `max_outstanding` (which defaults to
+        `concurrency`).
+
+        The auth_kwargs, this Master's timeouts, and any other settings in
+        the `session` dict are sent once to each worker rather than with
+        every job.
+
+        :returns: For a scheduled run, a dict with counts of "sent", "late",
+                  and "dropped" jobs; otherwise None
+        """
 
         if label and not self.quiet:
             print >>sys.stderr, label + """
   X    work job raised an exception
+  V    work job got back the wrong object data (with --verify)
   .  <  1s first-byte-latency
   o  <  3s first-byte-latency
   O  < 10s first-byte-latency
@@ -161,79 +372,341 @@ class Master(object):
                         return None
             else:
                 work_job = raw_job
-            work_job['auth_kwargs'] = auth_kwargs
-            work_job['connect_timeout'] = self.connect_timeout
-            work_job['network_timeout'] = self.network_timeout
             return work_job
 
-        active = 0
-        for raw_job in job_generator:
-            work_job = _job_decorator(raw_job)
-            if not work_job:
-                continue
-
-            send_q = [work_job]
-
-            logging.debug('active: %d\tconcurrency: %d', active, concurrency)
-            if active >= concurrency:
-                result_jobs_raw = self.results_pull.recv()
-                result_count = self.process_results_to(
-                    result_jobs_raw, result_processor, label=label,
-                    run_results=run_results)
-                active -= result_count
+        self._start_session(dict(session or {}, auth_kwargs=auth_kwargs,
+                                 connect_timeout=self.connect_timeout,
+                                 network_timeout=self.network_timeout))
 
-            while len(send_q) < min(batch_size, concurrency - active):
-                try:
-                    work_job = _job_decorator(job_generator.next())
-                    if not work_job:
-                        continue
-                    send_q.append(work_job)
-                except StopIteration:
-                    break
+        def _process_results():
+            result_jobs_raw = self.results_pull.recv()
+            return self.process_results_to(
+                result_jobs_raw, result_processor, label=label,
+                run_results=run_results)
 
-            self.work_push.send(msgpack.dumps(send_q))
-            active += len(send_q)
-            # NOTE: we'll never exit this loop with unsent contents in send_q
+        stats = None
+        if scheduled:
+            if max_outstanding is None:
+                max_outstanding = concurrency
+            active, stats = self._send_on_schedule(
+                job_generator, _job_decorator, _process_results,
+                max_outstanding, batch_size)
+        else:
+            active = 0
+            for raw_job in job_generator:
+                work_job = _job_decorator(raw_job)
+                if not work_job:
+                    continue
+
+                send_q = [work_job]
+
+                logging.debug('active: %d\tconcurrency: %d', active,
+                              concurrency)
+                ident, free = self._free_worker()
+                while active >= concurrency or not free:
+                    active -= self._wait_for_workers(_process_results)
+                    ident, free = self._free_worker()
+
+                while len(send_q) < min(batch_size, concurrency - active,
+                                        free):
+                    try:
+                        work_job = _job_decorator(job_generator.next())
+                        if not work_job:
+                            continue
+                        send_q.append(work_job)
+                    except StopIteration:
+                        break
+
+                # In a closed-loop run, a job is intended to start as soon as
+                # it's sent.
+                sent_at = time.time()
+                for work_job in send_q:
+                    work_job['scheduled_at'] = sent_at
+                while not self._send_jobs(ident, send_q):
+                    # That worker went away; try another one.
+                    ident, free = self._free_worker()
+                    while not free:
+                        active -= self._wait_for_workers(_process_results)
+                        ident, free = self._free_worker()
+                active += len(send_q)
+                # NOTE: we'll never exit this loop with unsent contents in
+                # send_q
 
         # Drain the results
         logging.debug('All jobs sent; awaiting results...')
         while active > 0:
             logging.debug('Draining results: active = %d', active)
-            result_jobs_raw = self.results_pull.recv()
-            result_count = self.process_results_to(
-                result_jobs_raw, result_processor, label=label,
-                run_results=run_results)
-            active -= result_count
+            active -= self._wait_for_workers(_process_results)
+        if self.session.get('summary_interval'):
+            self._flush_summaries(_process_results)
         if label and not self.quiet:
             sys.stderr.write('\n')
             sys.stderr.flush()
 
+        if stats is not None:
+            log_fn = logging.warning if stats['dropped'] else logging.info
+            log_fn('Open-loop run: %d jobs sent, %d late (> %dms behind '
+                   'schedule), %d dropped (%d outstanding max)',
+                   stats['sent'], stats['late'],
+                   int(self.LATE_SEND_SECS * 1000), stats['dropped'],
+                   max_outstanding)
+        return stats
+
+    def _send_on_schedule(self, timed_jobs, job_decorator, process_results,
+                          max_outstanding, batch_size):
+        """
+        Open-loop half of do_a_run(): sends each job at its scheduled time and
+        processes results while waiting for the next one to come due.
+
+        A job which comes due while max_outstanding jobs are in flight, or
+        while no worker has a free slot, is dropped (before being decorated,
+        so no object is taken out of the run state for it).  A job sent more
+        than LATE_SEND_SECS after its scheduled time is counted as late.  Jobs
+        which are due at the same time are sent together in batches of up to
+        batch_size.
+
+        :returns: A tuple of (count of jobs still in flight, stats dict)
+        """
+
+        stats = {'sent': 0, 'late': 0, 'dropped': 0}
+        active = 0
+        send_q = []
+        send_ident = None
+        start_time = time.time()
+        for offset, raw_job in timed_jobs:
+            due_at = start_time + offset
+            now = time.time()
+            if now < due_at:
+                # We're ahead of schedule; get the queue out the door, then
+                # process results until it's time to send this job.
+                if send_q:
+                    active += self._send_reserved(send_ident, send_q, stats)
+                    send_q = []
+                while now < due_at:
+                    wait_ms = int(math.ceil((due_at - now) * 1000))
+                    active -= self._wait_for_workers(process_results,
+                                                     wait_ms) or 0
+                    now = time.time()
+            elif now - due_at > self.LATE_SEND_SECS:
+                stats['late'] += 1
+
+            # Pick up any results which have already arrived
+            result_count = self._wait_for_workers(process_results, 0)
+            while result_count is not None:
+                active -= result_count
+                result_count = self._wait_for_workers(process_results, 0)
+
+            ident, free = self._free_worker()
+            if active + len(send_q) >= max_outstanding or not free:
+                stats['dropped'] += 1
+                continue
+
+            work_job = job_decorator(raw_job)
+            if not work_job:
+                continue
+            # Latency corrected for coordinated omission is measured from
+            # here, not from whenever we actually got the job out.
+            work_job['scheduled_at'] = due_at
+            if send_q and ident != send_ident:
+                active += self._send_reserved(send_ident, send_q, stats)
+                send_q = []
+            send_ident = ident
+            # Reserve the worker's slot now so the next _free_worker() call
+            # accounts for this job.
+            self.workers[ident]['in_flight'] += 1
+            send_q.append(work_job)
+            stats['sent'] += 1
+            if len(send_q) >= batch_size:
+                active += self._send_reserved(send_ident, send_q, stats)
+                send_q = []
+
+        if send_q:
+            active += self._send_reserved(send_ident, send_q, stats)
+
+        return active, stats
+
+    def _send_reserved(self, ident, jobs, stats):
+        """
+        Sends jobs whose slots have already been reserved on the given worker.
+        If the worker has gone away, the jobs are counted as dropped instead
+        of sent.
+
+        :returns: The number of jobs sent
+        """
+        if self._send_jobs(ident, jobs, reserved=True):
+            return len(jobs)
+        stats['sent'] -= len(jobs)
+        stats['dropped'] += len(jobs)
+        return 0
+
+    def _handle_worker_message(self):
+        """
+        Receives one message from a worker on the work ROUTER socket.
+
+        Workers send a HELLO (with their worker_id and concurrency) when they
+        start and whenever they go a while without receiving any work; the
+        concurrency is how many jobs we may have in flight on that worker.
+
+        A worker process which is restarted says HELLO under a new identity;
+        the jobs we had in flight on its old one will never finish.
+
+        :returns: The number of jobs lost that way
+        """
+        ident, message_raw = self.work_router.recv_multipart()
+        message = msgpack.loads(message_raw)
+        if message.get('type') != 'HELLO':
+            logging.warning('Unexpected message from worker %r: %r', ident,
+                            message)
+            return 0
+        lost = 0
+        worker = self.workers.get(ident)
+        if worker is None:
+            old_worker = self.workers.pop(
+                self.worker_idents.get(message['worker_id']), None)
+            if old_worker is not None:
+                lost = old_worker['in_flight']
+                logging.warning('Worker id=%d restarted; %d job(s) in flight '
+                                'on it were lost', message['worker_id'], lost)
+            logging.debug('Worker id=%d joined (concurrency %d)',
+                          message['worker_id'], message['concurrency'])
+            worker = self.workers[ident] = {
+                'worker_id': message['worker_id'],
+                'in_flight': 0,
+                'session_id': None,
+            }
+            self.worker_idents[message['worker_id']] = ident
+        worker['concurrency'] = message['concurrency']
+        return lost
+
+    def _wait_for_workers(self, process_results, timeout=None):
+        """
+        Waits up to timeout milliseconds (forever if None) for any message
+        from the workers, handling HELLOs and passing results to
+        process_results.
+
+        :returns: The number of results processed plus the number of jobs
+                  lost to restarted workers (either way, jobs no longer in
+                  flight), or None if nothing arrived
+        """
+        socks = dict(self.poller.poll(timeout))
+        if not socks:
+            return None
+        done = 0
+        if socks.get(self.work_router) == zmq.POLLIN:
+            done += self._handle_worker_message()
+        if socks.get(self.results_pull) == zmq.POLLIN:
+            done += process_results()
+        return done
+
+    def _flush_summaries(self, process_results):
+        """
+        Asks every worker in the run for its last (partial) summary of its
+        results, and waits up to FLUSH_TIMEOUT seconds for them all.
+        """
+        self.flushed = set()
+        waiting = set()
+        for ident, worker in self.workers.items():
+            if worker.get('session_id') != self.session_id:
+                continue  # (never got any of this run's jobs)
+            try:
+                self.work_router.send_multipart([ident, self.codec.encode(
+                    [{'type': 'FLUSH'}])])
+            except zmq.ZMQError:
+                continue
+            waiting.add(worker['worker_id'])
+        give_up_at = time.time() + self.FLUSH_TIMEOUT
+        while not waiting <= self.flushed:
+            wait_ms = int((give_up_at - time.time()) * 1000)
+            if wait_ms <= 0:
+                logging.warning('No summary of the last results from '
+                                'worker(s) %s', ', '.join(
+                                    map(str, sorted(waiting - self.flushed))))
+                break
+            self._wait_for_workers(process_results, wait_ms)
+
+    def _start_session(self, session):
+        if session != self.session:
+            self.session = session
+            self.session_id += 1
+            self.codec = Codec(session.get('size_names', ()),
+                               session.get('containers', ()))
+
+    def _free_worker(self):
+        """
+        Picks the worker with the most free slots (its concurrency less the
+        jobs we have in flight on it), so faster workers, which return their
+        slots sooner, get proportionally more work.
+
+        :returns: A tuple of (worker ROUTER identity, free slot count); the
+                  identity is None and the count 0 if no worker has a free
+                  slot.
+        """
+        best_ident, best_free = None, 0
+        for ident, worker in self.workers.iteritems():
+            free = worker['concurrency'] - worker['in_flight']
+            if free > best_free:
+                best_ident, best_free = ident, free
+        return best_ident, best_free
+
+    def _send_jobs(self, ident, jobs, reserved=False):
+        """
+        Sends a batch of jobs to one worker, charging them against its free
+        slots (unless they were already reserved).  If the worker hasn't seen
+        the current session yet, it goes out first, in its own message, so
+        the worker can decode the jobs with the session's codec.  If the
+        worker has gone away, it is forgotten.
+
+        :returns: True if the jobs were sent, False otherwise
+        """
+        worker = self.workers[ident]
+        try:
+            if worker.get('session_id') != self.session_id:
+                self.work_router.send_multipart([ident, self.codec.encode(
+                    [{'type': 'SESSION', 'session': self.session}])])
+            self.work_router.send_multipart([ident, self.codec.encode(jobs)])
+        except zmq.ZMQError as e:
+            worker = self.workers.pop(ident)
+            self.worker_idents.pop(worker['worker_id'], None)
+            logging.warning('Lost worker id=%d (%s); forgetting it',
+                            worker['worker_id'], e)
+            return False
+        worker['session_id'] = self.session_id
+        if not reserved:
+            worker['in_flight'] += len(jobs)
+        return True
+
+    def _job_done(self, worker_id):
+        worker = self.workers.get(self.worker_idents.get(worker_id))
+        if worker and worker['in_flight'] > 0:
+            worker['in_flight'] -= 1
+
     def kill_workers(self, timeout=5):
         """
-        Send a suicide message to all workers, with some kind of timeout.
+        Send a suicide message to every worker we hear from, until no new
+        worker has been heard from for timeout seconds.
         """
         logging.info('Killing workers, taking up to %d seconds.', int(timeout))
-        poller = zmq.Poller()
-        poller.register(self.results_pull, zmq.POLLIN)
-
+        suicide = self.codec.encode([{'type': 'SUICIDE'}])
+        idents = set(self.workers.keys())
         while True:
-            # Seems to get stuck gevent-blocking in the work_push.send() after
-            # all the workers have died.  Also, gevent.Timeout() doesn't seem
-            # to work here?!
-            signal.alarm(int(timeout))
-            self.work_push.send(msgpack.dumps([{'type': 'PING'}]))
-            socks = dict(poller.poll(timeout * 1500))
-            if self.results_pull in socks \
-                    and socks[self.results_pull] == zmq.POLLIN:
-                result_packed = self.results_pull.recv()
-                result = msgpack.loads(result_packed, use_list=False)
-                logging.info('Heard from worker id=%d; sending SUICIDE',
-                             result[0]['worker_id'])
-                self.work_push.send(msgpack.dumps([{'type': 'SUICIDE'}]))
-                gevent.sleep(0.1)
-            else:
+            for ident in idents:
+                try:
+                    self.work_router.send_multipart([ident, suicide])
+                except zmq.ZMQError:
+                    pass  # already gone
+            idents = set()
+            socks = dict(self.poller.poll(timeout * 1000))
+            if not socks:
                 break
-            signal.alarm(0)
+            if socks.get(self.work_router) == zmq.POLLIN:
+                ident, message_raw = self.work_router.recv_multipart()
+                message = msgpack.loads(message_raw)
+                logging.info('Heard from worker id=%d; sending SUICIDE',
+                             message.get('worker_id', -1))
+                idents.add(ident)
+            if socks.get(self.results_pull) == zmq.POLLIN:
+                self.results_pull.recv()  # stale results; don't care
+            gevent.sleep(0.1)
 
     def cleanup_containers(self, auth_kwargs, container_base, concurrency,
                            policy):
@@ -245,23 +718,23 @@ class Master(object):
         our_container_re = re.compile(self.DELETER_RE % (container_base, policy))
 
         start_time = time.time()
-        obj_count = 0
         container_count = 0
+        deleter = _ObjectDeleter(storage_urls, token, concurrency)
         pool = gevent.pool.Pool(concurrency)
         for container_info in container_list:
             # e.g. {'count': 41, 'bytes': 496485, 'name': 'doc'}
             if our_container_re.match(container_info['name']):
-                pool.spawn(_container_deleter, concurrency, storage_urls,
+                pool.spawn(_container_deleter, deleter, storage_urls,
                            token, container_info)
                 container_count += 1
-                obj_count += container_info['count']
             else:
                 logging.debug('Ignoring non-ssbench container %r',
                               container_info['name'])
         pool.join()
         delta_t = time.time() - start_time
+        deleter.report()
         logging.info('Deleted %.1f containers/s, %.1f objs/s',
-                     container_count / delta_t, obj_count / delta_t)
+                     container_count / delta_t, deleter.deleted / delta_t)
 
     def _authenticate(self, auth_kwargs):
         """
@@ -286,7 +759,11 @@ class Master(object):
         return [storage_url], token
 
     def run_scenario(self, scenario, auth_kwargs, run_results, noop=False,
-                     with_profiling=False, keep_objects=False, batch_size=1):
+                     with_profiling=False, keep_objects=False, batch_size=1,
+                     trace=None, replay=None, inventory_path=None,
+                     populate_only=False, archive_objects=0, verify=False,
+                     url_policy='random', summary_interval=None,
+                     raw_sample_rate=0.0, raw_tail_latency=None):
         """
         Runs a CRUD scenario, given cluster parameters and a Scenario object.
 
@@ -298,12 +775,49 @@ class Master(object):
         :param with_profiing: Profile the run?
         :param keep_objects: Keep uploaded objects instead of deleting them?
         :param batch_size: Send this many bench jobs per packet to workers
+        :param trace: Trace to take the initial and bench jobs from, instead
+                      of generating them from the scenario
+        :param replay: LogReplay to take the bench jobs (and, if it's timed,
+                       their schedule) from, instead of the scenario or trace
+        :param inventory_path: File to load the cluster's objects from
+                               (instead of initializing the cluster) if it
+                               exists, and to save them to after the run
+        :param populate_only: Just initialize the cluster (and save the
+                              inventory); don't run the benchmark
+        :param archive_objects: If set, initialize the cluster with tar
+                                archives of up to this many objects each,
+                                uploaded to Swift's extract-archive
+        :param verify: Have workers send the MD5 of each object they upload,
+                       and check the contents of each object they download
+        :param url_policy: How workers pick a storage URL for each request,
+                           if there are several (see UrlSelector)
+        :param summary_interval: If set, have workers send a summary of
+                                 their results (see ResultSummary) this
+                                 often, in seconds, instead of all of the
+                                 results themselves
+        :param raw_sample_rate: With summary_interval, the fraction of
+                                successful results to send (and save) as
+                                well
+        :param raw_tail_latency: With summary_interval, also send (and save)
+                                 every result with a last-byte latency of at
+                                 least this many seconds
         :param returns: Collected result records from workers
         """
 
-        run_state = RunState()
-
-        logging.info(u'Starting scenario run for "%s"', scenario.name)
+        run_state = RunState(scenario.popularity_by_size, seed=scenario.seed,
+                             containers=scenario.containers)
+        session = scenario.session_settings()
+        if verify:
+            session['verify'] = True
+        if url_policy != 'random':
+            session['url_policy'] = url_policy
+        if summary_interval:
+            session.update(summary_interval=summary_interval,
+                           raw_sample_rate=raw_sample_rate,
+                           raw_tail_latency=raw_tail_latency)
+
+        logging.info(u'Starting scenario run for "%s" (seed %d)',
+                     scenario.name, scenario.seed)
 
         raise_file_descriptor_limit()
 
@@ -328,14 +842,46 @@ class Master(object):
                            container, policy=scenario.policy)
             pool.join()
 
-        # Enqueue initialization jobs
-        if not noop:
+        # Enqueue initialization jobs (unless a previous run left us a list
+        # of what's in the cluster)
+        if not noop and inventory_path and os.path.exists(inventory_path):
+            run_state.load(inventory_path)
+            logging.info('Loaded %d objects from inventory %s; skipping '
+                         'initialization', sum(map(
+                             len, run_state.objs_by_size.itervalues())),
+                         inventory_path)
+        elif not noop:
             logging.info('Initializing cluster with stock data (up to %d '
                          'concurrent workers)', scenario.user_count)
 
-            self.do_a_run(scenario.user_count, scenario.initial_jobs(),
+            # One listing of each container tells us which initial objects
+            # are already there, so they don't need a HEAD each
+            existing = {}
+            pool = gevent.pool.Pool(scenario.container_concurrency)
+            for container in scenario.containers:
+                pool.spawn(_container_lister, storage_urls, c_token,
+                           container, existing)
+            pool.join()
+            logging.info('Found %d existing objects in %d containers',
+                         sum(map(len, existing.itervalues())),
+                         len(existing))
+
+            initial_jobs = _missing_object_jobs(
+                (trace or scenario).initial_jobs(), existing,
+                run_state.handle_initialization_result)
+            if archive_objects:
+                logging.info('Uploading initial objects in archives of up '
+                             'to %d', archive_objects)
+                initial_jobs = _archive_jobs(initial_jobs, archive_objects)
+            self.do_a_run(scenario.user_count, initial_jobs,
                           run_state.handle_initialization_result, auth_kwargs,
-                          batch_size=batch_size)
+                          batch_size=batch_size, session=session)
+
+        if populate_only:
+            if inventory_path and not noop:
+                run_state.save(inventory_path)
+                logging.info('Saved inventory to %s', inventory_path)
+            return
 
         logging.info('Starting benchmark run (up to %d concurrent '
                      'workers)', scenario.user_count)
@@ -346,11 +892,34 @@ class Master(object):
             import cProfile
             prof = cProfile.Profile()
             prof.enable()
-        self.do_a_run(scenario.user_count, scenario.bench_jobs(),
+        scheduled = bool(scenario.rate)
+        if replay:
+            logging.info('Replaying requests from log %s (%s)',
+                         replay.log_path, '%gx speed' % replay.speed
+                         if replay.timed else 'as fast as possible')
+            bench_jobs = replay.bench_jobs(
+                run_seconds=scenario.run_seconds,
+                first_index=run_state.next_object_index())
+            scheduled = replay.timed
+        elif trace:
+            logging.info('Replaying jobs from trace %s', trace.trace_path)
+            bench_jobs = trace.bench_jobs(run_seconds=scenario.run_seconds)
+        else:
+            bench_jobs = scenario.bench_jobs(
+                first_index=run_state.next_object_index())
+        if scenario.rate and not replay:
+            logging.info('Offering %.1f ops/s with %s arrivals (up to %d '
+                         'outstanding)', scenario.rate, scenario.arrival,
+                         scenario.max_outstanding)
+            bench_jobs = itertools.izip(scenario.arrival_offsets(),
+                                        bench_jobs)
+        self.do_a_run(scenario.user_count, bench_jobs,
                       run_state.handle_run_result, auth_kwargs,
                       mapper_fn=run_state.fill_in_job,
                       label='Benchmark Run:', noop=noop, batch_size=batch_size,
-                      run_results=run_results)
+                      run_results=run_results, scheduled=scheduled,
+                      max_outstanding=scenario.max_outstanding,
+                      session=session)
         if with_profiling:
             prof.disable()
             prof_output_path = '/tmp/do_a_run.%d.prof' % os.getpid()
@@ -359,10 +928,16 @@ class Master(object):
 
         if not noop and not keep_objects:
             logging.info('Deleting population objects from cluster')
-            self.do_a_run(scenario.user_count,
-                          run_state.cleanup_object_infos(),
-                          lambda *_: None,
-                          auth_kwargs, mapper_fn=_gen_cleanup_job,
-                          batch_size=batch_size)
+            storage_urls, c_token = self._authenticate(auth_kwargs)
+            deleter = _ObjectDeleter(storage_urls, c_token,
+                                     scenario.user_count)
+            deleter.delete_objects(
+                (container, name) for container, name, _ in
+                run_state.cleanup_object_infos())
+            deleter.report()
         elif keep_objects:
             logging.info('NOT deleting any objects due to -k/--keep-objects')
+
+        if inventory_path and not noop:
+            run_state.save(inventory_path)
+            logging.info('Saved inventory to %s', inventory_path)
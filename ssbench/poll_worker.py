@@ -0,0 +1,685 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+A worker engine whose jobs don't run on gevent.  One loop polls the master's
+ZeroMQ sockets and the benchmark's own non-blocking HTTP connections together
+(with a plain zmq.Poller), and each job's requests are driven from there, a
+step at a time, as their sockets become ready.  There's no monkey-patching,
+no greenlet per job, and no zmq.green; the jobs and results are the same as
+for ssbench.worker.Worker.
+
+Responses are parsed with geventhttpclient's (C) parser, fed whatever
+arrives on the socket.  gevent is still imported (through swift_client and
+geventhttpclient), though, and authenticating (client.get_auth()) still goes
+through swift_client's gevent-based connections.
+"""
+
+import os
+import ssl
+import time
+import errno
+import select
+import socket
+import hashlib
+import logging
+from urlparse import urlparse
+
+import msgpack
+import zmq
+from geventhttpclient.response import HTTPResponse
+from geventhttpclient._parser import HTTPParseError
+
+from ssbench.codec import Codec
+from ssbench.engine import Engine, UrlSelector
+from ssbench.util import tar_archive, token_key, is_ipv6
+from ssbench.util import raise_file_descriptor_limit, monotonic
+import ssbench.swift_client as client
+
+
+RECV_SIZE = 2 ** 16
+
+# Errors which just mean a non-blocking socket isn't ready
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+
+class _Response(HTTPResponse):
+    """
+    A response, parsed as its bytes are fed in.  The body is thrown away
+    (after going through the md5, if there is one) unless keep_body is set
+    or the request failed.
+    """
+    def __init__(self, method, md5=None, keep_body=False):
+        super(_Response, self).__init__(method=method)
+        self.md5 = md5
+        self.keep_body = keep_body
+        self.body_length = 0
+        self.first_byte_at = None
+        self.headers_at = None  # (a monotonic() time)
+
+    def _on_headers_complete(self):
+        self.first_byte_at = time.time()
+        self.headers_at = monotonic()
+        return super(_Response, self)._on_headers_complete()
+
+    def _on_body(self, buf):
+        self.body_length += len(buf)
+        if self.md5:
+            self.md5.update(buf)
+        if self.keep_body or not 200 <= self.get_code() < 300:
+            self._body_buffer += buf
+
+    def getheader(self, name, default=None):
+        return self.get(name, default)
+
+    @property
+    def body(self):
+        return str(self._body_buffer)
+
+
+class _Call(object):
+    """
+    A job's HTTP request, which is retried (like
+    Worker.ignoring_http_responses() does) on socket errors and on responses
+    with any of the given statuses.
+
+    :body: If given, a callable returning an iterator of the request body's
+           pieces (which is called again for each try)
+    :succeeded: Called with the (lowercased) response headers, decorated as
+                by swift_client, and the _Response
+    :failed: Called, from an exception handler, with the exception, once the
+             request has failed for good; by default, the job gets an
+             exception result
+    """
+    def __init__(self, job, method, statuses, path, headers=None, body=None,
+                 verify=False, keep_body=False, succeeded=None, failed=None):
+        self.job = job
+        self.method = method
+        if 401 not in statuses:
+            statuses += (401,)
+        self.statuses = statuses
+        self.path = path
+        self.headers = headers or {}
+        self.body = body
+        self.verify = verify
+        self.keep_body = keep_body
+        self.succeeded = succeeded
+        self.failed = failed
+        self.tries = 0
+        self.token_key = None
+        self.token = None
+        self.url = None  # the storage URL of the latest try
+        self.counts = {}  # of connections reused, opened and reopened
+
+
+class _Connection(object):
+    def __init__(self, key, sock, connecting=False):
+        self.key = key  # (scheme, netloc)
+        self.sock = sock
+        self.connecting = connecting
+        self.handshaking = False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def is_stale(self):
+        """
+        :returns: True if this idle connection can't be reused: its socket is
+                  readable (so the server hung up, or sent something we never
+                  asked for), as for ssbench.worker.ConnectionPool
+        """
+        try:
+            return bool(select.select([self.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+
+class _Exchange(object):
+    """
+    One try of a _Call: its request and response, on one connection.
+    """
+    def __init__(self, call, conn, parsed, head, body, response, timeout):
+        self.call = call
+        self.conn = conn
+        self.parsed = parsed
+        self.pieces = iter([head])
+        self.body = body
+        self.current = None
+        self.sending = True
+        self.response = response
+        self.timeout = timeout
+        self.started = time.time()
+        self.deadline = self.started + timeout
+        # When the current phase (see ssbench.PHASES) started, per monotonic()
+        self.phase_start = monotonic()
+        self.phases = {}
+
+    def end_phase(self, phase):
+        now = monotonic()
+        self.phases[phase] = now - self.phase_start
+        self.phase_start = now
+
+    def next_piece(self):
+        piece = next(self.pieces, None)
+        if piece is None and self.body is not None:
+            self.pieces, self.body = self.body(), None
+            piece = next(self.pieces, None)
+        return piece
+
+
+class PollWorker(Engine):
+    def __init__(self, zmq_host, zmq_work_port, zmq_results_port, worker_id,
+                 max_retries, profile_count=0, concurrency=256, batch_size=1):
+        work_endpoint = 'tcp://%s:%d' % (zmq_host, zmq_work_port)
+        results_endpoint = 'tcp://%s:%d' % (zmq_host, zmq_results_port)
+        ipv6 = is_ipv6(zmq_host)
+        self.worker_id = worker_id
+        self.max_retries = max_retries
+        self.profile_count = profile_count
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+        raise_file_descriptor_limit()
+
+        self.session = {}
+        self.url_selector = UrlSelector()
+        self.codec = Codec()
+        self.token_data = {}  # token key -> (storage_urls, token)
+        self.parsed_urls = {}  # storage_url -> urlparse() result
+        self.addresses = {}  # (host, port) -> getaddrinfo() result
+        self.idle = {}  # (scheme, netloc) -> [_Connection, ...]
+        self.lost = 0  # broken connections not yet replaced
+        self.exchanges = {}  # fd -> _Exchange
+        self.results = []
+        self.results_since = None
+
+        self.context = zmq.Context()
+        self.work_dealer = self.context.socket(zmq.DEALER)
+        self.work_dealer.ipv6 = ipv6
+        self.work_dealer.identity = 'ssbench-worker-%d-%d' % (worker_id,
+                                                              os.getpid())
+        self.work_dealer.connect(work_endpoint)
+        self.results_push = self.context.socket(zmq.PUSH)
+        self.results_push.ipv6 = ipv6
+        self.results_push.connect(results_endpoint)
+        self.poller = zmq.Poller()
+        self.poller.register(self.work_dealer, zmq.POLLIN)
+
+    def send_hello(self):
+        self.work_dealer.send(msgpack.dumps(self.hello()))
+        self.heard_at = time.time()
+
+    def go(self):
+        logging.debug('Worker %s starting (poll engine)...', self.worker_id)
+        self.send_hello()
+        if self.profile_count:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        gotten = 0
+        while True:
+            for sock, event in self.poller.poll(self._poll_timeout()):
+                if sock is self.work_dealer:
+                    gotten += self._recv_jobs()
+                elif sock in self.exchanges:
+                    self._step(self.exchanges[sock], event)
+            self._expire()
+            self._flush_results()
+            if time.time() - self.heard_at >= self.HELLO_INTERVAL:
+                self.send_hello()
+            if self.profile_count and gotten >= self.profile_count:
+                prof.disable()
+                prof_output_path = '/tmp/worker_go.%d.prof' % os.getpid()
+                prof.dump_stats(prof_output_path)
+                logging.info('PROFILED worker go() to %s', prof_output_path)
+                self.profile_count = None
+
+    def _poll_timeout(self):
+        # (milliseconds)
+        wake_at = self.heard_at + self.HELLO_INTERVAL
+        if self.results:
+            wake_at = min(wake_at, self.results_since + 1)
+        for exchange in self.exchanges.itervalues():
+            wake_at = min(wake_at, exchange.deadline)
+        return max(int((wake_at - time.time()) * 1000), 0)
+
+    def _recv_jobs(self):
+        """
+        Starts every job the master has sent us so far.
+
+        :returns: The number of jobs started
+        """
+        started = 0
+        while True:
+            try:
+                jobs = self.work_dealer.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return started
+            self.heard_at = time.time()
+            for job_datum in self.codec.decode(jobs):
+                if job_datum['type'] == 'SESSION':
+                    self.start_session(job_datum['session'])
+                elif job_datum['type'] == 'SUICIDE':
+                    self.suicide()
+                elif job_datum['type'] == 'FLUSH':
+                    self.flush_summary()
+                else:
+                    self.handle_job(job_datum)
+                    started += 1
+
+    def handle_job(self, job_data):
+        if job_data.get('noop', False):
+            handler = self.handle_noop
+        else:
+            handler = getattr(self, 'handle_%s' % job_data['type'], None)
+        try:
+            if not handler:
+                raise NameError("Unknown job type %r" % job_data['type'])
+            handler(job_data)
+        except Exception as e:
+            self.put_exception_results(job_data, e)
+
+    def queue_result(self, result):
+        if not self.results:
+            self.results_since = time.time()
+        self.results.append(result)
+
+    def _flush_results(self):
+        # Like Worker._result_writer(), wait up to a second to fill a batch
+        if self.results and (len(self.results) >= self.batch_size or
+                             time.time() - self.results_since >= 1):
+            self.results_push.send(self.codec.encode(self.results))
+            self.results = []
+
+    def _object_path(self, object_info):
+        path = '/' + client.quote(object_info['container'])
+        if object_info.get('name'):
+            path += '/' + client.quote(object_info['name'])
+        return path
+
+    def handle_upload_object(self, object_info, letter='A'):
+        if object_info.get('head_first'):
+            # Only upload if it's not already present
+            def not_present(error):
+                if isinstance(error, client.ClientException):
+                    self._upload(object_info, letter)
+                else:
+                    self.put_exception_results(object_info, error)
+
+            self._start(_Call(
+                object_info, 'HEAD', (503,), self._object_path(object_info),
+                succeeded=lambda headers, _: self._put_results_from_response(
+                    object_info, headers),
+                failed=not_present))
+        else:
+            self._upload(object_info, letter)
+
+    def _upload(self, object_info, letter):
+        object_info['size'] = int(object_info['size'])
+        contents, offset = self._contents(object_info.get('size_str'),
+                                          letter)
+        headers = self._upload_headers(object_info, letter, offset)
+        headers['Content-Length'] = str(object_info['size'])
+        block_size = self._block_size()
+
+        def body():
+            # As in swift_client.put_object(); buffers don't copy the bytes
+            left, at = object_info['size'], offset
+            while left > 0:
+                length = min(block_size, left, len(contents) - at)
+                yield buffer(contents, at, length)
+                left -= length
+                at = (at + length) % len(contents)
+
+        self._start(_Call(
+            object_info, 'PUT', (503,), self._object_path(object_info),
+            headers=headers, body=body,
+            succeeded=lambda headers, _: self._put_results_from_response(
+                object_info, headers)))
+
+    # By the time a job gets to the worker, an object create and update look
+    # the same: it's just a PUT.  We use a different letter for the contents
+    # for testability.
+    def handle_update_object(self, object_info):
+        return self.handle_upload_object(object_info, letter='B')
+
+    def handle_extract_archive(self, archive_info):
+        # Creates archive_info's "objects", [size_str, name, size] each, with
+        # one tar archive
+        members = self._archive_members(archive_info)
+        length, _ = tar_archive(members)
+
+        def succeeded(headers, response):
+            result = client._extract_result(response.body)
+            if result is None:
+                # Without the middleware, this was just a container PUT
+                raise client.ClientException(
+                    'Extract archive not supported',
+                    http_status=response.get_code(),
+                    http_response_content=response.body)
+            headers['extract_result'] = result
+            self._put_archive_results(archive_info, headers)
+
+        self._start(_Call(
+            archive_info, 'PUT', (503,),
+            self._object_path(archive_info) + '?extract-archive=tar',
+            headers={'Content-Length': str(length),
+                     'Accept': 'application/json'},
+            body=lambda: tar_archive(members)[1], keep_body=True,
+            succeeded=succeeded))
+
+    def handle_delete_object(self, object_info):
+        self._start(_Call(
+            object_info, 'DELETE', (404, 503), self._object_path(object_info),
+            succeeded=lambda headers, _: self._put_results_from_response(
+                object_info, headers)))
+
+    def handle_get_object(self, object_info):
+        self._start(_Call(
+            object_info, 'GET', (404, 503), self._object_path(object_info),
+            verify=bool(self.session.get('verify')),
+            succeeded=lambda headers, _: self._put_results_from_response(
+                object_info, headers)))
+
+    def _auth(self, call):
+        """
+        :returns: A storage URL and token for the call, authenticating (and
+                  blocking the loop while we do) if necessary
+        """
+        auth_kwargs = self.session.get('auth_kwargs')
+        if auth_kwargs is None:
+            raise ValueError('Got benchmark job without a session with '
+                             '"auth_kwargs"!')
+        if auth_kwargs.get('token', None):
+            return self.url_selector.choose(auth_kwargs['storage_urls']), \
+                auth_kwargs['token']
+        call.token_key = token_key(auth_kwargs)
+        if call.token_key not in self.token_data:
+            logging.debug('Authenticating with %r', auth_kwargs)
+            storage_url, token = client.get_auth(**auth_kwargs)
+            self.token_data[call.token_key] = (
+                auth_kwargs.get('storage_urls', None) or [storage_url], token)
+        storage_urls, token = self.token_data[call.token_key]
+        return self.url_selector.choose(storage_urls), token
+
+    def _count(self, call, key):
+        call.counts[key] = call.counts.get(key, 0) + 1
+
+    def _connection(self, parsed, call):
+        key = (parsed.scheme, parsed.netloc)
+        idle = self.idle.get(key)
+        while idle:
+            conn = idle.pop()
+            if not conn.is_stale():
+                self._count(call, 'conn_hits')
+                return conn
+            conn.close()
+            self.lost += 1
+        if parsed.scheme not in ('http', 'https'):
+            raise client.ClientException(
+                'Cannot handle protocol scheme %s for url %s' %
+                (parsed.scheme, parsed.geturl()))
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        address = self.addresses.get((parsed.hostname, port))
+        if address is None:
+            address = self.addresses[parsed.hostname, port] = \
+                socket.getaddrinfo(parsed.hostname, port, 0,
+                                   socket.SOCK_STREAM)[0]
+        family, socktype, proto, _, sockaddr = address
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = sock.connect_ex(sockaddr)
+        if err and err not in WOULD_BLOCK:
+            sock.close()
+            raise socket.error(err, os.strerror(err))
+        if self.lost:
+            self.lost -= 1
+            self._count(call, 'conn_reconnects')
+        else:
+            self._count(call, 'conn_misses')
+        return _Connection(key, sock, connecting=True)
+
+    def _start(self, call):
+        """
+        Starts a try of the call.
+        """
+        try:
+            call.url, call.token = self._auth(call)
+            parsed = self.parsed_urls.get(call.url)
+            if parsed is None:
+                parsed = self.parsed_urls[call.url] = urlparse(
+                    client.encode_utf8(call.url))
+        except Exception as e:
+            self._fail(call, e)
+            return
+        try:
+            conn = self._connection(parsed, call)
+        except Exception as e:
+            self._try_failed(call, e)
+            return
+        headers = dict(call.headers, Host=parsed.netloc)
+        headers['X-Auth-Token'] = call.token
+        if call.method in ('PUT', 'DELETE') and call.body is None:
+            headers['Content-Length'] = '0'
+        head = '%s %s%s HTTP/1.1\r\n%s\r\n' % (
+            call.method, parsed.path.rstrip('/'), call.path,
+            ''.join('%s: %s\r\n' % (k, v) for k, v in headers.iteritems()))
+        response = _Response(call.method,
+                             md5=hashlib.md5() if call.verify else None,
+                             keep_body=call.keep_body)
+        if conn.connecting:
+            timeout = self.session.get('connect_timeout',
+                                       client.DEFAULT_CONNECT_TIMEOUT)
+        else:
+            timeout = self.session.get('network_timeout',
+                                       client.DEFAULT_NETWORK_TIMEOUT)
+        exchange = _Exchange(call, conn, parsed, head, call.body, response,
+                             timeout)
+        self.exchanges[conn.sock.fileno()] = exchange
+        self.url_selector.started(call.url)
+        self.poller.register(conn.sock.fileno(), zmq.POLLOUT)
+
+    def _step(self, exchange, event):
+        """
+        Moves the exchange along as far as its socket allows.
+        """
+        conn = exchange.conn
+        try:
+            if conn.connecting:
+                err = conn.sock.getsockopt(socket.SOL_SOCKET,
+                                           socket.SO_ERROR)
+                if err:
+                    raise socket.error(err, os.strerror(err))
+                conn.connecting = False
+                exchange.end_phase('connect_time')
+                exchange.timeout = self.session.get(
+                    'network_timeout', client.DEFAULT_NETWORK_TIMEOUT)
+                if exchange.parsed.scheme == 'https':
+                    fd = conn.sock.fileno()
+                    conn.sock = ssl.wrap_socket(conn.sock,
+                                                do_handshake_on_connect=False)
+                    assert conn.sock.fileno() == fd
+                    conn.handshaking = True
+            if conn.handshaking:
+                try:
+                    conn.sock.do_handshake()
+                except ssl.SSLWantReadError:
+                    return self._want(exchange, zmq.POLLIN)
+                except ssl.SSLWantWriteError:
+                    return self._want(exchange, zmq.POLLOUT)
+                conn.handshaking = False
+                exchange.end_phase('tls_time')
+            if exchange.sending:
+                if not self._send(exchange):
+                    return self._want(exchange, zmq.POLLOUT)
+                exchange.sending = False
+                exchange.end_phase('send_time')
+                return self._want(exchange, zmq.POLLIN)
+            if self._receive(exchange):
+                self._done(exchange)
+        except (socket.error, HTTPParseError) as e:
+            self._forget(exchange)
+            conn.close()
+            self.lost += 1
+            self._try_failed(exchange.call, e)
+
+    def _want(self, exchange, event):
+        exchange.deadline = time.time() + exchange.timeout
+        self.poller.register(exchange.conn.sock.fileno(), event)
+
+    def _send(self, exchange):
+        """
+        :returns: True if the whole request has been sent
+        """
+        sock = exchange.conn.sock
+        while True:
+            if exchange.current is None:
+                exchange.current = exchange.next_piece()
+                if exchange.current is None:
+                    return True
+            try:
+                sent = sock.send(exchange.current)
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                return False
+            except socket.error as e:
+                if e.errno in WOULD_BLOCK:
+                    return False
+                raise
+            if sent < len(exchange.current):
+                exchange.current = buffer(exchange.current, sent)
+            else:
+                exchange.current = None
+
+    def _receive(self, exchange):
+        """
+        :returns: True if the whole response has been received
+        """
+        sock, response = exchange.conn.sock, exchange.response
+        while not response.message_complete:
+            try:
+                data = sock.recv(RECV_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except socket.error as e:
+                if e.errno in WOULD_BLOCK:
+                    break
+                raise
+            if not data:
+                raise socket.error(errno.ECONNRESET,
+                                   'connection closed before the end of '
+                                   'the response')
+            response.feed(data)
+        if response.message_complete:
+            return True
+        self._want(exchange, zmq.POLLIN)
+        return False
+
+    def _forget(self, exchange):
+        # The exchange is over, one way or another
+        fd = exchange.conn.sock.fileno()
+        if self.exchanges.pop(fd, None):
+            self.url_selector.finished(exchange.call.url,
+                                       time.time() - exchange.started)
+        try:
+            self.poller.unregister(fd)
+        except KeyError:
+            pass
+
+    def _expire(self):
+        now = time.time()
+        for exchange in [exchange for exchange in self.exchanges.values()
+                         if exchange.deadline <= now]:
+            self._forget(exchange)
+            exchange.conn.close()
+            self.lost += 1
+            try:
+                raise socket.timeout('timed out')
+            except socket.timeout as e:
+                self._try_failed(exchange.call, e)
+
+    def _done(self, exchange):
+        """
+        Hands a complete response to its call.
+        """
+        self._forget(exchange)
+        call, response = exchange.call, exchange.response
+        if response.should_keep_alive():
+            self.idle.setdefault(exchange.conn.key, []).append(exchange.conn)
+        else:
+            exchange.conn.close()
+        now = time.time()
+        headers = dict((header.lower(), value)
+                       for header, value in response.items())
+        headers['x-swiftstack-last-byte-latency'] = now - exchange.started
+        headers.update(exchange.phases,
+                       wait_time=response.headers_at - exchange.phase_start,
+                       body_time=monotonic() - response.headers_at)
+        if call.method == 'GET':
+            headers['x-swiftstack-first-byte-latency'] = \
+                response.first_byte_at - exchange.started
+        parsed = exchange.parsed
+        try:
+            status = response.get_code()
+            if status < 200 or status >= 300:
+                raise client.ClientException(
+                    'Object %s failed' % call.method,
+                    http_scheme=parsed.scheme, http_host=parsed.hostname,
+                    http_port=parsed.port, http_path=call.path,
+                    http_status=status, http_reason=response.status_message,
+                    http_response_content=response.body)
+            if call.verify:
+                problem = client._verification_problem(
+                    response, response.body_length,
+                    response.md5.hexdigest())
+                if problem:
+                    raise client.VerificationError(
+                        'Object GET verification failed (%s)' % problem,
+                        http_scheme=parsed.scheme, http_host=parsed.hostname,
+                        http_port=parsed.port, http_path=call.path,
+                        http_status=status,
+                        http_reason=response.status_message)
+            if call.tries != 0:
+                logging.info('%r succeeded after %d tries', call.job,
+                             call.tries)
+            headers['retries'] = call.tries
+            headers['storage_url'] = call.url
+            headers.update(call.counts)
+            call.succeeded(headers, response)
+        except client.ClientException as e:
+            if e.http_status == 401 and call.token_key and \
+                    call.token_key in self.token_data and \
+                    self.token_data[call.token_key][1] == call.token:
+                logging.debug('Deleting token %s', call.token)
+                del self.token_data[call.token_key]
+            self._try_failed(call, e)
+        except Exception as e:
+            self.put_exception_results(call.job, e)
+
+    def _try_failed(self, call, error):
+        """
+        Retries the call, if it may be, or else fails it.  Must be called
+        from the handler of the error.
+        """
+        call.tries += 1
+        if isinstance(error, client.ClientException):
+            retriable = error.http_status in call.statuses
+        else:
+            retriable = isinstance(error, (socket.error, HTTPParseError))
+        if retriable and call.tries <= self.max_retries:
+            logging.debug("Retrying an error: %r", error)
+            self._start(call)
+            return
+        error.retries = call.tries - 1
+        error.storage_url = call.url
+        self._fail(call, error)
+
+    def _fail(self, call, error):
+        if call.failed:
+            call.failed(error)
+        else:
+            self.put_exception_results(call.job, error)
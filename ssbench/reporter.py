@@ -12,6 +12,7 @@ from mako.template import Template
 
 import ssbench
 import ssbench.util
+from ssbench.histogram import Histogram
 from ssbench.ordered_dict import OrderedDict
 
 
@@ -46,6 +47,9 @@ class Reporter(object):
 ${scenario.name}  (generated with ssbench version ${scenario.version})
 Worker count: ${'%3d' % agg_stats['worker_count']}   Concurrency: ${'%3d' % scenario.user_count}  Ran ${start_time} to ${stop_time} (${'%.0f' % round(duration)}s)
 Object expiration (X-Delete-After): ${scenario.delete_after} (sec)
+% if scenario.rate:
+Open-loop target rate: ${'%.1f' % scenario.rate} ops/s  (${scenario.arrival} arrivals; up to ${scenario.max_outstanding} outstanding)
+% endif
 
 %% Ops    C   R   U   D       Size Range       Size Name
 % for size_datum in size_data:
@@ -58,19 +62,46 @@ ${size_datum['pct_total_ops']}   % ${size_datum['crud_pcts']}      ${size_datum[
 % if stats['req_count']:
 ${label}
        Count: ${'%5d' % stats['req_count']} (${'%5d' % stats['errors']} error; ${'%5d' % stats['retries']} retries: ${'%5.2f' % stats['retry_rate']}%)  Average requests per second: ${'%5.1f' % stats['avg_req_per_sec']}
+% if stats.get('verify_errors'):
+       Verification failures: ${'%5d' % stats['verify_errors']}  (counted among the errors; the cluster sent back the wrong data)
+% endif
+% if stats.get('conn_misses') or stats.get('conn_hits'):
+       Connections: ${'%5d' % stats['conn_hits']} reused; ${'%5d' % stats['conn_misses']} opened; ${'%5d' % stats['conn_reconnects']} reopened
+% endif
                             min       max      avg      std_dev  ${'%02d' % nth_pctile}%-ile  ${'%15s' % ''}  Worst latency TX ID
        First-byte latency: ${stats['first_byte_latency']['min']} - ${stats['first_byte_latency']['max']}  ${stats['first_byte_latency']['avg']}  (${stats['first_byte_latency']['std_dev']})  ${stats['first_byte_latency']['pctile']}  (all obj sizes)  ${stats['worst_first_byte_latency'][1] if 'worst_first_byte_latency' in stats else ''}
        Last-byte  latency: ${stats['last_byte_latency']['min']} - ${stats['last_byte_latency']['max']}  ${stats['last_byte_latency']['avg']}  (${stats['last_byte_latency']['std_dev']})  ${stats['last_byte_latency']['pctile']}  (all obj sizes)  ${stats['worst_last_byte_latency'][1] if 'worst_last_byte_latency' in stats else ''}
+% if 'corrected_last_byte_latency' in stats:
+     Corrected first-byte: ${stats['corrected_first_byte_latency']['min']} - ${stats['corrected_first_byte_latency']['max']}  ${stats['corrected_first_byte_latency']['avg']}  (${stats['corrected_first_byte_latency']['std_dev']})  ${stats['corrected_first_byte_latency']['pctile']}  (all obj sizes)
+     Corrected  last-byte: ${stats['corrected_last_byte_latency']['min']} - ${stats['corrected_last_byte_latency']['max']}  ${stats['corrected_last_byte_latency']['avg']}  (${stats['corrected_last_byte_latency']['std_dev']})  ${stats['corrected_last_byte_latency']['pctile']}  (all obj sizes)
+% endif
+% if 'wait_time' in stats:
+       Phases, avg/${'%02d' % nth_pctile}%-ile: ${phase_summary(stats)}  (all obj sizes)
+% endif
 % for size_str, per_size_stats in sstats.iteritems():
 % if per_size_stats:
        First-byte latency: ${per_size_stats['first_byte_latency']['min']} - ${per_size_stats['first_byte_latency']['max']}  ${per_size_stats['first_byte_latency']['avg']}  (${per_size_stats['first_byte_latency']['std_dev']})  ${per_size_stats['first_byte_latency']['pctile']}  ${'(%8s objs)' % size_str}  ${per_size_stats['worst_first_byte_latency'][1] if 'worst_first_byte_latency' in per_size_stats else ''}
        Last-byte  latency: ${per_size_stats['last_byte_latency']['min']} - ${per_size_stats['last_byte_latency']['max']}  ${per_size_stats['last_byte_latency']['avg']}  (${per_size_stats['last_byte_latency']['std_dev']})  ${per_size_stats['last_byte_latency']['pctile']}  ${'(%8s objs)' % size_str}  ${per_size_stats['worst_last_byte_latency'][1] if 'worst_last_byte_latency' in per_size_stats else ''}
+% if 'corrected_last_byte_latency' in per_size_stats:
+     Corrected first-byte: ${per_size_stats['corrected_first_byte_latency']['min']} - ${per_size_stats['corrected_first_byte_latency']['max']}  ${per_size_stats['corrected_first_byte_latency']['avg']}  (${per_size_stats['corrected_first_byte_latency']['std_dev']})  ${per_size_stats['corrected_first_byte_latency']['pctile']}  ${'(%8s objs)' % size_str}
+     Corrected  last-byte: ${per_size_stats['corrected_last_byte_latency']['min']} - ${per_size_stats['corrected_last_byte_latency']['max']}  ${per_size_stats['corrected_last_byte_latency']['avg']}  (${per_size_stats['corrected_last_byte_latency']['std_dev']})  ${per_size_stats['corrected_last_byte_latency']['pctile']}  ${'(%8s objs)' % size_str}
+% endif
+% if 'wait_time' in per_size_stats:
+       Phases, avg/${'%02d' % nth_pctile}%-ile: ${phase_summary(per_size_stats)}  ${'(%8s objs)' % size_str}
+% endif
 % endif
 % endfor
 
 % endif
 % endfor
 Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs_per_worker_stats['max']} (avg: ${jobs_per_worker_stats['avg']}; stddev: ${jobs_per_worker_stats['std_dev']})
+% if len(url_stats) > 1:
+
+Per storage URL:  Count  Errors  Last-byte latency: avg  ${'%02d' % nth_pctile}%-ile
+% for url, url_stat in url_stats:
+               ${'%8d' % url_stat['req_count']}  ${'%6d' % url_stat['errors']}  ${'%22s' % (url_stat['last_byte_latency']['avg'] if url_stat['req_count'] else '')}  ${'%7s' % (url_stat['last_byte_latency']['pctile'] if url_stat['req_count'] else '')}  ${url}
+% endfor
+% endif
 """
 
     def generate_default_report(self, output_csv=False):
@@ -105,6 +136,8 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
             'duration': stats['time_series']['stop']
             - stats['time_series']['start_time'],
             'jobs_per_worker_stats': stats['jobs_per_worker_stats'],
+            'url_stats': sorted(stats['url_stats'].items()),
+            'phase_summary': self._phase_summary,
             'weighted_c': 0.0,
             'weighted_r': 0.0,
             'weighted_u': 0.0,
@@ -152,6 +185,9 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                 'duration': tmpl_vars['duration'],
                 'delete_after': str(self.scenario.delete_after),
             }
+            if self.scenario.rate:
+                self._add_csv_kv(csv_fields, csv_data, 'target_rate',
+                                 self.scenario.rate)
             for label, stats, sstats in tmpl_vars['stat_list']:
                 label_lc = label.lower()
                 if stats.get('req_count', 0):
@@ -160,6 +196,15 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                     self._add_csv_kv(csv_fields, csv_data,
                                      '%s_errors' % label_lc,
                                      stats['errors'])
+                    if stats.get('verify_errors'):
+                        self._add_csv_kv(csv_fields, csv_data,
+                                         '%s_verify_errors' % label_lc,
+                                         stats['verify_errors'])
+                    if stats.get('conn_misses') or stats.get('conn_hits'):
+                        for key in ssbench.CONNECTION_COUNTS:
+                            self._add_csv_kv(csv_fields, csv_data,
+                                             '%s_%s' % (label_lc, key),
+                                             stats[key])
                     self._add_csv_kv(csv_fields, csv_data,
                                      '%s_retries' % label_lc,
                                      stats['retries'])
@@ -210,6 +255,19 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
             self._add_csv_kv(
                 csv_fields, csv_data, key_base + 'worst_txid',
                 stats[worst_key][1] if worst_key in stats else '')
+        if 'corrected_last_byte_latency' in stats:
+            for latency_type in ('first', 'last'):
+                latency_stats = stats[
+                    'corrected_%s_byte_latency' % latency_type]
+                key_base = '%s_corrected_%s_%s_' % (
+                    label.lower(), latency_type, size_str)
+                for stat_name in ('min', 'max', 'avg', 'std_dev'):
+                    self._add_csv_kv(csv_fields, csv_data,
+                                     key_base + stat_name,
+                                     latency_stats[stat_name])
+                self._add_csv_kv(csv_fields, csv_data,
+                                 key_base + '%d_pctile' % nth_pctile,
+                                 latency_stats['pctile'])
 
     def _format_bytes(self, byte_count):
         units = [' B', 'kB', 'MB', 'GB']
@@ -241,10 +299,26 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                     'req_count': 1,
                     'retries': 0,
                     'errors' : 0,
+                    'verify_errors': 0, # only if any results failed --verify
+                    # Only if the workers counted their connections:
+                    'conn_hits': 0,
+                    'conn_misses': 0,
+                    'conn_reconnects': 0,
                     'avg_req_per_sec': 1.1, # req_count / (stop - start)?
                     'retry_rate': 0.0,
                     'first_byte_latency': SERIES_STATS,
                     'last_byte_latency': SERIES_STATS,
+                    # Only if results were stamped with their intended start:
+                    'corrected_first_byte_latency': SERIES_STATS,
+                    'corrected_last_byte_latency': SERIES_STATS,
+                    # Only if results timed their requests' phases (and, for
+                    # connect_time and tls_time, any made new connections);
+                    # likewise for op_stats and size_stats:
+                    'connect_time': SERIES_STATS,
+                    'tls_time': SERIES_STATS,
+                    'send_time': SERIES_STATS,
+                    'wait_time': SERIES_STATS,
+                    'body_time': SERIES_STATS,
                 },
                 'worker_stats': {
                     1: {  # keys are worker_ids
@@ -260,6 +334,16 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                     },
                     # ...
                 },
+                'url_stats': {
+                    'http://proxy1/v1/AUTH_a': {  # keys are storage URLs
+                        'req_count': 1,
+                        'errors': 0,
+                        'first_byte_latency': SERIES_STATS,
+                        'last_byte_latency': SERIES_STATS,
+                        # ...
+                    },
+                    # ... (only for results which say which URL they used)
+                },
                 'op_stats': {
                     CREATE_OBJECT: { # keys are CRUD constants: CREATE_OBJECT, READ_OBJECT, etc.
                         'req_count': 1, # num requests of this CRUD type
@@ -341,12 +425,29 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
             nth_pctile=nth_pctile,
             agg_stats=agg_stats,
             worker_stats={},
+            url_stats={},
             op_stats=op_stats,
             size_stats=OrderedDict.fromkeys(
                 self.scenario.sizes_by_name.keys()))
         for results in self.unpacker:
             skipped = 0
             for result in results:
+                if result.get('type') == 'SUMMARY':
+                    # A worker's results for a while, in aggregate
+                    self._add_summary_to(stats, result)
+                    completions = result['completions']
+                    if completions and min(completions) < \
+                            completion_time_min:
+                        completion_time_min = min(completions)
+                        start_time = min(entry['start'] for _, _, _, entry
+                                         in result['entries']
+                                         if 'start' in entry)
+                    completion_time_max = max(
+                        [completion_time_max] + list(completions))
+                    for second, count in completions.iteritems():
+                        req_completion_seconds[second] = \
+                            count + req_completion_seconds.get(second, 0)
+                    continue
                 try:
                     res_completed_at = result['completed_at']
                     res_completion_time = int(res_completed_at)
@@ -359,9 +460,15 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                     skipped += 1
                     continue
 
-                try:
-                    res_exception = result['exception']
-                except KeyError:
+                if result.get('sampled'):
+                    # Already counted in a SUMMARY; only here for details
+                    if 'exception' in result:
+                        self._log_exception(result)
+                    else:
+                        self._add_sample_to(stats, result)
+                    continue
+
+                if 'exception' not in result:
                     try:
                         res_last_byte_latency = result['last_byte_latency']
                     except KeyError:
@@ -380,16 +487,7 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                         1 + req_completion_seconds.get(res_completion_time, 0)
                     result['start'] = res_completed_at - res_last_byte_latency
                 else:
-                    # report log exceptions
-                    logging.warn('calculate_scenario_stats: exception from '
-                                 'worker %d: %s',
-                                 res_worker_id, res_exception)
-                    try:
-                        res_traceback = result['traceback']
-                    except KeyError:
-                        logging.warn('traceback missing')
-                    else:
-                        logging.info(res_traceback)
+                    self._log_exception(result)
 
                 # Stats per-worker
                 if res_worker_id not in stats['worker_stats']:
@@ -397,6 +495,11 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                 self._add_result_to(stats['worker_stats'][res_worker_id],
                                     result)
 
+                # Stats per-storage-URL
+                if result.get('storage_url'):
+                    self._add_result_to(stats['url_stats'].setdefault(
+                        result['storage_url'], {'req_count': 0}), result)
+
                 # Stats per-file-size
                 try:
                     val = stats['size_stats'][res_size_str]
@@ -444,6 +547,13 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
         logging.debug('Jobs per worker stats:\n' +
                       pformat(stats['jobs_per_worker_stats']))
 
+        for url_stats in stats['url_stats'].itervalues():
+            if url_stats['req_count']:
+                self._compute_req_per_sec(url_stats)
+                self._compute_retry_rate(url_stats)
+                self._compute_latency_stats(url_stats, nth_pctile,
+                                            format_numbers)
+
         for op_stats_dict in op_stats.itervalues():
             if op_stats_dict['req_count']:
                 self._compute_req_per_sec(op_stats_dict)
@@ -477,16 +587,95 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
 
         return stats
 
+    def _log_exception(self, result):
+        # report log exceptions
+        logging.warn('calculate_scenario_stats: exception from '
+                     'worker %d: %s',
+                     result['worker_id'], result['exception'])
+        try:
+            res_traceback = result['traceback']
+        except KeyError:
+            logging.warn('traceback missing')
+        else:
+            logging.info(res_traceback)
+
+    def _add_summary_to(self, stats, summary):
+        worker_stats = stats['worker_stats'].setdefault(
+            summary['worker_id'], {})
+        for res_type, res_size_str, storage_url, entry in \
+                summary['entries']:
+            latencies = dict(
+                (latency_type, Histogram.decode(encoded))
+                for latency_type, encoded in entry['latencies'].iteritems())
+            stat_dicts = [worker_stats, stats['agg_stats']]
+            if storage_url:
+                stat_dicts.append(stats['url_stats'].setdefault(
+                    storage_url, {'req_count': 0}))
+            if not stats['size_stats'].get(res_size_str):
+                stats['size_stats'][res_size_str] = {}
+            stat_dicts.append(stats['size_stats'][res_size_str])
+            type_stats = stats['op_stats'][res_type]
+            if not type_stats['size_stats'].get(res_size_str):
+                type_stats['size_stats'][res_size_str] = {}
+            stat_dicts.extend([type_stats,
+                               type_stats['size_stats'][res_size_str]])
+            for stat_dict in stat_dicts:
+                self._add_entry_to(stat_dict, entry, latencies)
+
+    def _add_entry_to(self, stat_dict, entry, latencies):
+        # Like _add_result_to(), for a SUMMARY's entry
+        if 'start' in entry:
+            stat_dict['start'] = min(stat_dict.get('start', entry['start']),
+                                     entry['start'])
+        stat_dict['stop'] = max(stat_dict.get('stop', entry['stop']),
+                                entry['stop'])
+        stat_dict['retries'] = stat_dict.get('retries', 0) + entry['retries']
+        if any(key in entry for key in ssbench.CONNECTION_COUNTS):
+            for key in ssbench.CONNECTION_COUNTS:
+                stat_dict[key] = stat_dict.get(key, 0) + entry.get(key, 0)
+        stat_dict['req_count'] = \
+            stat_dict.get('req_count', 0) + entry['req_count']
+        stat_dict['errors'] = stat_dict.get('errors', 0) + entry['errors']
+        if entry.get('verify_errors'):
+            stat_dict['verify_errors'] = \
+                stat_dict.get('verify_errors', 0) + entry['verify_errors']
+        for latency_type, histogram in latencies.iteritems():
+            stat_dict.setdefault(latency_type, Histogram()).merge(histogram)
+
+    def _add_sample_to(self, stats, result):
+        # The slowest requests' transaction IDs can only come from samples
+        type_stats = stats['op_stats'][result['type']]
+        for stat_dict in (stats['agg_stats'], type_stats,
+                          type_stats['size_stats'].get(result['size_str']),
+                          stats['size_stats'].get(result['size_str'])):
+            if stat_dict is not None:
+                self._rec_worst(stat_dict, result)
+
     def _compute_latency_stats(self, stat_dict, nth_pctile, format_numbers):
         try:
             for latency_type in ('first_byte_latency', 'last_byte_latency'):
                 stat_dict[latency_type] = self._series_stats(
                     stat_dict.get(latency_type, []), nth_pctile,
                     format_numbers)
+            # Only present for results from jobs which were stamped with
+            # their intended start time
+            for latency_type in ('corrected_first_byte_latency',
+                                 'corrected_last_byte_latency') + \
+                    ssbench.PHASES:
+                if latency_type in stat_dict:
+                    stat_dict[latency_type] = self._series_stats(
+                        stat_dict[latency_type], nth_pctile, format_numbers)
         except KeyError:
             logging.exception('stat_dict: %r', stat_dict)
             raise
 
+    def _phase_summary(self, stat_dict):
+        # e.g. "connect  0.002/  0.004  send  0.001/  0.001  ..."
+        return '  '.join(
+            '%s %s/%s' % (phase[:-len('_time')],
+                          stat_dict[phase]['avg'], stat_dict[phase]['pctile'])
+            for phase in ssbench.PHASES if phase in stat_dict)
+
     def _compute_req_per_sec(self, stat_dict):
         try:
             sd_start = stat_dict['start']
@@ -529,45 +718,66 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                 stat_dict['stop'] = result['completed_at']
         stat_dict['retries'] = \
             stat_dict.get('retries', 0) + int(result['retries'])
+        if any(key in result for key in ssbench.CONNECTION_COUNTS):
+            for key in ssbench.CONNECTION_COUNTS:
+                stat_dict[key] = stat_dict.get(key, 0) + result.get(key, 0)
         if 'exception' not in result:
             stat_dict['req_count'] = stat_dict.get('req_count', 0) + 1
             self._rec_latency(stat_dict, result)
         else:
             stat_dict['errors'] += 1
+            if result.get('verify_failed'):
+                stat_dict['verify_errors'] = \
+                    stat_dict.get('verify_errors', 0) + 1
 
     def _series_stats(self, sequence, nth_pctile, format_numbers):
-        sequence = filter(None, sequence)
-        if not sequence:
-            # No data available
-            return dict(min=' N/A  ', max='  N/A  ', avg='  N/A  ',
-                        pctile='  N/A  ', std_dev='  N/A  ', median='  N/A  ')
-        sequence.sort()
-        try:
-            minval = min(sequence)
-            maxval = max(sequence)
-            mean = ssbench.util.mean(sequence)
-        except ZeroDivisionError:
-            # Handle the case of a single-element sequence (population standard
-            # deviation divides by N-1)
-            minval = sequence[0]
-            maxval = sequence[0]
-            mean = sequence[0]
+        if isinstance(sequence, Histogram):
+            # (From worker SUMMARY records)
+            if not sequence:
+                return self._series_stats([], nth_pctile, format_numbers)
+            minval = sequence.min
+            maxval = sequence.max
+            mean = sequence.mean()
+            pctile = sequence.percentile(nth_pctile)
+            std_dev = sequence.stdev()
+            median = sequence.median()
+        else:
+            sequence = filter(None, sequence)
+            if not sequence:
+                # No data available
+                return dict(min=' N/A  ', max='  N/A  ', avg='  N/A  ',
+                            pctile='  N/A  ', std_dev='  N/A  ',
+                            median='  N/A  ')
+            sequence.sort()
+            try:
+                minval = min(sequence)
+                maxval = max(sequence)
+                mean = ssbench.util.mean(sequence)
+            except ZeroDivisionError:
+                # Handle the case of a single-element sequence (population
+                # standard deviation divides by N-1)
+                minval = sequence[0]
+                maxval = sequence[0]
+                mean = sequence[0]
+            pctile = self.pctile(sequence, nth_pctile)
+            std_dev = ssbench.util.uncorrected_stdev(sequence)
+            median = ssbench.util.median(sequence)
         if format_numbers:
             return dict(
                 min='%6.3f' % minval,
                 max='%7.3f' % maxval,
                 avg='%7.3f' % mean,
-                pctile='%7.3f' % self.pctile(sequence, nth_pctile),
-                std_dev='%7.3f' % ssbench.util.uncorrected_stdev(sequence),
-                median='%7.3f' % ssbench.util.median(sequence))
+                pctile='%7.3f' % pctile,
+                std_dev='%7.3f' % std_dev,
+                median='%7.3f' % median)
         else:
             return dict(
                 min=round(minval, 6),
                 max=round(maxval, 6),
                 avg=round(mean, 6),
-                pctile=round(self.pctile(sequence, nth_pctile), 6),
-                std_dev=round(ssbench.util.uncorrected_stdev(sequence), 6),
-                median=round(ssbench.util.median(sequence), 6))
+                pctile=round(pctile, 6),
+                std_dev=round(std_dev, 6),
+                median=round(median, 6))
 
     def pctile(self, sequence, nth_pctile):
         seq_len = len(sequence)
@@ -585,6 +795,15 @@ Distribution of requests per worker-ID: ${jobs_per_worker_stats['min']} - ${jobs
                 stats_dict[latency_type].append(result[latency_type])
             else:
                 stats_dict[latency_type] = [result[latency_type]]
+        self._rec_worst(stats_dict, result)
+        for latency_type in ('corrected_first_byte_latency',
+                             'corrected_last_byte_latency') + ssbench.PHASES:
+            if latency_type in result:
+                stats_dict.setdefault(latency_type, []).append(
+                    result[latency_type])
+
+    def _rec_worst(self, stats_dict, result):
+        for latency_type in ('first_byte_latency', 'last_byte_latency'):
             if result[latency_type] is not None:
                 worst_key = 'worst_%s' % latency_type
                 if worst_key not in stats_dict \
@@ -36,8 +36,12 @@ class RunResults(object):
             file_like = open(self.results_file_path, 'rb')
         unpacker = msgpack.Unpacker(file_like=file_like)
         scenario = Scenario.unpackb(unpacker)
+        # Older results files hold plain lists of result dicts, which the
+        # codec passes through as-is.
+        codec = scenario.codec()
 
-        return scenario, unpacker
+        return scenario, (codec.decode_message(results)
+                          for results in unpacker)
 
     def start_run(self, scenario):
         self.output_file = open(self.results_file_path, 'wb')
@@ -2,9 +2,237 @@
 #Copyright (c) 2012-2021, NVIDIA CORPORATION.
 #SPDX-License-Identifier: Apache-2.0
 
-from collections import defaultdict, deque
+import math
+import msgpack
+from array import array
+from random import Random
 
 import ssbench
+from ssbench.codec import object_index
+
+
+POPULARITY_MODELS = ('round_robin', 'uniform', 'zipf', 'hotset', 'latest')
+MAX_INDEX = 2 ** 32 - 1  # (largest object name index ObjectList can pack)
+INVENTORY_VERSION = 1
+
+
+class Popularity(object):
+    """
+    Decides which of the objects of one size category a READ or UPDATE gets.
+    Objects are numbered from 0 (the oldest) to n - 1 (the newest), and
+    pick() takes constant time however many objects there are.
+
+    The models are:
+
+    - round_robin: each object in turn (the default)
+    - uniform: any object, at random
+    - zipf: the object of rank k (the oldest has rank 1) with probability
+      proportional to 1 / k ** s (approximately, by inverting the
+      continuous power law), for an exponent "s" (default 1.0)
+    - hotset: a "hot_pct" percent of the objects (the oldest; default 10)
+      get "access_pct" percent of the accesses (default 90)
+    - latest: like zipf, but ranked from the newest object, so recently
+      written objects are the popular ones
+    """
+
+    def __init__(self, spec=None, rng=None):
+        """
+        :spec: A model name, or a dict with a "model" name and any of its
+               parameters; None means round_robin
+        :rng: The random.Random to pick with
+        """
+        if spec is None:
+            spec = {}
+        elif not isinstance(spec, dict):
+            spec = {'model': spec}
+        self.model = spec.get('model', 'round_robin')
+        if self.model not in POPULARITY_MODELS:
+            raise ValueError('popularity model must be one of %s' %
+                             ', '.join(POPULARITY_MODELS))
+        self.s = float(spec.get('s', 1.0))
+        if self.s <= 0:
+            raise ValueError('popularity s must be > 0')
+        self.hot_pct = float(spec.get('hot_pct', 10))
+        self.access_pct = float(spec.get('access_pct', 90))
+        if not 0 < self.hot_pct <= 100 or not 0 <= self.access_pct <= 100:
+            raise ValueError('popularity hot_pct must be in (0, 100] and '
+                             'access_pct in [0, 100]')
+        self.random = rng or Random()
+        self.pick = getattr(self, '_pick_' + self.model)
+        self._next = 0
+
+    def _pick_round_robin(self, n):
+        i = self._next % n
+        self._next = i + 1
+        return i
+
+    def _pick_uniform(self, n):
+        return int(self.random.random() * n)
+
+    def _zipf_rank(self, n):
+        # 0-based rank in [0, n)
+        u = self.random.random()
+        if self.s == 1.0:
+            x = (n + 1) ** u
+        else:
+            t = 1 - self.s
+            x = (((n + 1) ** t - 1) * u + 1) ** (1 / t)
+        return min(int(x) - 1, n - 1)
+
+    def _pick_zipf(self, n):
+        return self._zipf_rank(n)
+
+    def _pick_latest(self, n):
+        return n - 1 - self._zipf_rank(n)
+
+    def _pick_hotset(self, n):
+        hot_n = int(math.ceil(n * self.hot_pct / 100))
+        if hot_n >= n or self.random.random() * 100 < self.access_pct:
+            return int(self.random.random() * hot_n)
+        return hot_n + int(self.random.random() * (n - hot_n))
+
+
+class ObjectList(object):
+    """
+    The objects of one size category, oldest first.  Appending, removing the
+    oldest, and getting the i-th object all take constant (amortized) time.
+
+    Objects are (container_name, obj_name, initial) tuples, but aren't stored
+    that way: when the container is one of the scenario's and the name is one
+    Scenario generates ("<size_str>_<index>"), an object takes up just two
+    array entries (the container's index, with the initial flag in its low
+    bit, and the name's index), and the tuple is rebuilt when asked for.
+    Anything else is kept as-is, on the side.
+    """
+
+    def __init__(self, size_str, container_indexes, items=()):
+        """
+        :size_str: The size category's name
+        :container_indexes: A dict of the scenario's container names to
+                            their indexes
+        :items: Objects to start with, oldest first
+        """
+        self.size_str = size_str
+        self.container_indexes = container_indexes
+        self._container_names = sorted(container_indexes,
+                                       key=container_indexes.get)
+        # Container index * 2 + initial, or -1 for an object in _others
+        self._codes = array('i')
+        # Object name index, or the object's index in _others
+        self._indexes = array('I')
+        self._others = []
+        self._head = 0  # entries before here have been popped
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._codes) - self._head
+
+    def __iter__(self):
+        for i in xrange(self._head, len(self._codes)):
+            yield self._get(i)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError('ObjectList index out of range')
+        return self._get(self._head + i)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'ObjectList(%r)' % (list(self),)
+
+    def _get(self, i):
+        code = self._codes[i]
+        if code < 0:
+            return self._others[self._indexes[i]]
+        return (self._container_names[code >> 1],
+                '%s_%06d' % (self.size_str, self._indexes[i]), bool(code & 1))
+
+    def append(self, item):
+        container, name, initial = item
+        container_index = self.container_indexes.get(container)
+        index = object_index(self.size_str, name)
+        if container_index is not None and index is not None and \
+                index <= MAX_INDEX:
+            self._codes.append(container_index * 2 + bool(initial))
+            self._indexes.append(index)
+        else:
+            self._codes.append(-1)
+            self._indexes.append(len(self._others))
+            self._others.append(item)
+
+    def max_index(self):
+        """
+        :returns: The largest name index of the objects with names Scenario
+                  generates (-1 if there aren't any)
+        """
+        result = -1
+        for i in xrange(self._head, len(self._codes)):
+            if self._codes[i] >= 0:
+                index = self._indexes[i]
+            else:
+                index = object_index(
+                    self.size_str, self._others[self._indexes[i]][1])
+            if index > result:
+                result = index
+        return result
+
+    def packed(self):
+        """
+        :returns: A msgpack-able form of the objects for unpacked()
+        """
+        codes = self._codes[self._head:]
+        indexes = self._indexes[self._head:]
+        others = []
+        if self._others:
+            for i, code in enumerate(codes):
+                if code < 0:
+                    old_index = indexes[i]
+                    indexes[i] = len(others)
+                    others.append(self._others[old_index])
+        return [codes.tostring(), indexes.tostring(), others]
+
+    @classmethod
+    def unpacked(cls, size_str, container_indexes, packed):
+        """
+        :returns: An ObjectList of the objects from packed() of an ObjectList
+                  with the same containers
+        """
+        objs = cls(size_str, container_indexes)
+        codes, indexes, others = packed
+        objs._codes.fromstring(codes)
+        objs._indexes.fromstring(indexes)
+        objs._others = [tuple(obj_info) for obj_info in others]
+        return objs
+
+    def mark_initial(self):
+        """
+        Makes every object an initial one.
+        """
+        self._codes = array('i', (code | 1 if code >= 0 else code
+                                  for code in self._codes))
+        self._others = [obj_info and obj_info[:2] + (True,)
+                        for obj_info in self._others]
+
+    def popleft(self):
+        if not len(self):
+            raise IndexError('pop from an empty ObjectList')
+        item = self._get(self._head)
+        if self._codes[self._head] < 0:
+            self._others[self._indexes[self._head]] = None
+        self._head += 1
+        if self._head > 1024 and self._head * 2 > len(self._codes):
+            del self._codes[:self._head]
+            del self._indexes[:self._head]
+            self._head = 0
+        if not len(self):
+            self._others = []
+        return item
 
 
 class RunState(object):
@@ -12,27 +240,48 @@ class RunState(object):
     An object to track the dynamic "state" of a benchmark run.
     """
 
-    def __init__(self):
-        # Stores one deque of (container_name, obj_name) tuples per size_str.
-        # This stores the contents of the cluster during the benchmark run.
-        # Objects are always accessed in the context of a "size_str".
+    def __init__(self, popularity_by_size=None, seed=None, containers=()):
+        """
+        :popularity_by_size: A dict of Popularity specs keyed by size_str
+                             (round_robin for any size not in it)
+        :seed: Seed for the popularity models' random choices
+        :containers: The scenario's container names (objects in these are
+                     stored most compactly)
+        """
+        # Stores one ObjectList of (container_name, obj_name, initial)
+        # tuples per size_str, oldest first.  This stores the contents of the
+        # cluster during the benchmark run.  Objects are always accessed in
+        # the context of a "size_str".
         #
-        # A request for an object CREATE doesn't do anything with the deque.
+        # A request for an object CREATE doesn't do anything with the list.
         # A request for an object DELETE is serviced with popleft().
-        # A READ or UPDATE request is serviced with [0], then the deque is
-        # rotated to the left (the serviced item goes to the back).
+        # A READ or UPDATE request is serviced with whichever object the
+        # size's Popularity picks.
         #
-        # A result for a successful object CREATE is added (to the right of the
-        # deque) with append().
-        # A result for READ, UPDATE, DELETE does nothing with the deque.
-        self.objs_by_size = defaultdict(deque)
+        # A result for a successful object CREATE is added (to the end of the
+        # list) with append().
+        # A result for READ, UPDATE, DELETE does nothing with the list.
+        self.container_indexes = dict(
+            (container, i) for i, container in enumerate(containers))
+        self.objs_by_size = _ObjectsBySize(self.container_indexes)
+        self.random = Random(seed)
+        self.random.jumpahead(2)  # (don't share the scenario's stream)
+        self.popularity_by_size = dict(
+            (size_str, Popularity(spec, self.random))
+            for size_str, spec in (popularity_by_size or {}).iteritems())
 
     def _handle_result(self, result, initial=False):
-        if 'exception' not in result and \
-                result['type'] == ssbench.CREATE_OBJECT:
+        if 'exception' in result:
+            return
+        if result['type'] == ssbench.CREATE_OBJECT:
             # Succeeded
             self.objs_by_size[result['size_str']].append(
                 (result['container'], result['name'], initial))
+        elif result['type'] == ssbench.EXTRACT_ARCHIVE:
+            # The objects the archive did create, as [size_str, name, size]
+            for size_str, name, _ in result['objects']:
+                self.objs_by_size[size_str].append(
+                    (result['container'], name, initial))
 
     def handle_initialization_result(self, result):
         self._handle_result(result, initial=True)
@@ -49,27 +298,85 @@ class RunState(object):
                 # Nothing (of this size) to delete... bummer.
                 return None
         elif job['type'] != ssbench.CREATE_OBJECT:
-            try:
-                obj_info = self.objs_by_size[job['size_str']][0]
-                self.objs_by_size[job['size_str']].rotate(-1)
-            except IndexError:
+            objs = self.objs_by_size[job['size_str']]
+            if not objs:
                 # Empty?  bummer
                 return None
+            popularity = self.popularity_by_size.get(job['size_str'])
+            if popularity is None:
+                popularity = self.popularity_by_size[job['size_str']] = \
+                    Popularity(rng=self.random)
+            obj_info = objs[popularity.pick(len(objs))]
         if obj_info:
             job['container'], job['name'], _ = obj_info
         return job
 
+    def next_object_index(self):
+        """
+        :returns: An object name index beyond that of any object in the run
+                  state, so new objects' names won't collide with theirs
+        """
+        return max([objs.max_index() for objs in
+                    self.objs_by_size.itervalues()] or [-1]) + 1
+
+    def save(self, inventory_path):
+        """
+        Saves the run state's objects to a file for load().
+        """
+        with open(inventory_path, 'wb') as inventory_file:
+            msgpack.pack({
+                'version': INVENTORY_VERSION,
+                'containers': sorted(self.container_indexes,
+                                     key=self.container_indexes.get),
+                'objects': dict((size_str, objs.packed())
+                                for size_str, objs in
+                                self.objs_by_size.iteritems()),
+            }, inventory_file)
+
+    def load(self, inventory_path):
+        """
+        Replaces the run state's objects with those saved by save().  They
+        all count as initial objects (so aren't cleaned up after this run).
+        If they were saved with different containers, they're added one by
+        one.
+        """
+        with open(inventory_path, 'rb') as inventory_file:
+            inventory = msgpack.unpack(inventory_file)
+        if inventory.get('version') != INVENTORY_VERSION:
+            raise ValueError('Unsupported inventory version %r in %s' % (
+                inventory.get('version'), inventory_path))
+        saved_indexes = dict(
+            (container, i)
+            for i, container in enumerate(inventory['containers']))
+        self.objs_by_size.clear()
+        for size_str, packed in inventory['objects'].iteritems():
+            objs = ObjectList.unpacked(size_str, saved_indexes, packed)
+            objs.mark_initial()
+            if saved_indexes != self.container_indexes:
+                objs = ObjectList(size_str, self.container_indexes, objs)
+            self.objs_by_size[size_str] = objs
+
     def cleanup_object_infos(self):
-        for q in sorted(self.objs_by_size.values()):
-            first_initial = None
-            try:
-                while not first_initial or q[0] != first_initial:
-                    obj_info = q[0]
-                    if obj_info[2]:
-                        if not first_initial:
-                            first_initial = obj_info
-                        q.rotate(-1)
-                    else:
-                        yield q.popleft()
-            except IndexError:
-                pass
+        """
+        Generator for the objects created during the benchmark run (as
+        opposed to the initial ones), which are removed from the run state.
+        """
+        for size_str in sorted(self.objs_by_size):
+            objs = self.objs_by_size[size_str]
+            self.objs_by_size[size_str] = ObjectList(
+                size_str, self.container_indexes,
+                (obj_info for obj_info in objs if obj_info[2]))
+            for obj_info in objs:
+                if not obj_info[2]:
+                    yield obj_info
+
+
+class _ObjectsBySize(dict):
+    # An ObjectList for each size_str, made on first use
+    def __init__(self, container_indexes):
+        super(_ObjectsBySize, self).__init__()
+        self.container_indexes = container_indexes
+
+    def __missing__(self, size_str):
+        objs = self[size_str] = ObjectList(size_str, self.container_indexes)
+        return objs
@@ -8,22 +8,29 @@ import signal
 import logging
 import msgpack
 import itertools
+from random import Random
 
 import ssbench
+from ssbench.codec import Codec
 from ssbench.importer import random
 from ssbench.ordered_dict import OrderedDict
+from ssbench.run_state import Popularity
+from ssbench.util import AliasTable, parse_payload
 
 
 class Scenario(object):
     """Encapsulation of a benchmark "CRUD" scenario."""
 
+    ARRIVAL_PROCESSES = ('poisson', 'constant')
+
     class StopGeneratingException(Exception):
         pass
 
     def __init__(self, scenario_filename=None, container_count=None,
                  user_count=None, operation_count=None, run_seconds=None,
                  block_size=None, _scenario_data=None,
-                 version=ssbench.version, delete_after=None, policy=None):
+                 version=ssbench.version, delete_after=None, policy=None,
+                 rate=None, arrival=None, max_outstanding=None, seed=None):
         """Initializes the object from a scenario file on disk.
 
         :scenario_filename: path to a scenario file
@@ -99,6 +106,14 @@ class Scenario(object):
 
         # Set up sizes
         self.sizes_by_name = OrderedDict()
+        # CRUD index samplers (see bench_jobs()) for each size
+        self._crud_tables = {}
+        # Which objects of each size READs and UPDATEs hit (see
+        # run_state.Popularity); sizes default to the top-level popularity
+        self.popularity_by_size = {}
+        # What the data in objects of each size looks like (see
+        # util.parse_payload()), for sizes whose payload isn't "constant"
+        self.payload_by_size = {}
         for size_data in self._scenario_data['sizes']:
             size_data_copy = copy.deepcopy(size_data)
             self.sizes_by_name[size_data_copy['name']] = size_data_copy
@@ -107,11 +122,19 @@ class Scenario(object):
             crud_total = sum(crud_profile)
             size_data_copy['crud_pcts'] = [
                 float(c) / crud_total * 100 for c in crud_profile]
-            # Calculate probability thresholds for each CRUD element for this
-            # object size category (defaulting to global crud profile).
-            size_data_copy['crud_thresholds'] = [1, 1, 1, 1]
-            self._thresholds_for(size_data_copy['crud_thresholds'],
-                                 range(4), crud_profile)
+            # Pick each CRUD element for this object size category in
+            # proportion to its (defaulting to the global) crud profile.
+            self._crud_tables[size_data_copy['name']] = AliasTable(
+                range(4), crud_profile)
+            popularity = size_data_copy.get(
+                'popularity', self._scenario_data.get('popularity'))
+            if popularity is not None:
+                Popularity(popularity)  # raises ValueError if it's bad
+                self.popularity_by_size[size_data_copy['name']] = popularity
+            payload = size_data_copy.get(
+                'payload', self._scenario_data.get('payload', 'constant'))
+            if parse_payload(payload)[0] != 'constant':
+                self.payload_by_size[size_data_copy['name']] = payload
 
         # Calculate probability thresholds for each size (from the
         # initial_files)
@@ -121,6 +144,10 @@ class Scenario(object):
             filter(lambda n: n in self._scenario_data['initial_files'],
                    self.sizes_by_name.keys()),
             self._scenario_data['initial_files'])
+        bench_sizes = self.bench_size_thresholds.keys()
+        self._size_table = AliasTable(
+            bench_sizes, [self._scenario_data['initial_files'][size_str]
+                          for size_str in bench_sizes])
 
         # Expiring time(sec) for create object.
         if delete_after is not None:
@@ -128,6 +155,47 @@ class Scenario(object):
         else:
             self.delete_after = self._scenario_data.get('delete_after')
 
+        # Open-loop target rate (ops/s); when unset, the benchmark run is
+        # closed-loop and limited only by user_count.
+        if rate is not None:
+            self.rate = rate
+        else:
+            self.rate = self._scenario_data.get('rate', None)
+        if self.rate is not None:
+            self.rate = float(self.rate)
+            if self.rate <= 0:
+                raise ValueError('rate must be > 0')
+        if arrival is not None:
+            self.arrival = arrival
+        else:
+            self.arrival = self._scenario_data.get('arrival', 'poisson')
+        if self.arrival not in self.ARRIVAL_PROCESSES:
+            raise ValueError('arrival must be one of %s' %
+                             ', '.join(self.ARRIVAL_PROCESSES))
+        if max_outstanding is not None:
+            self.max_outstanding = max_outstanding
+        else:
+            self.max_outstanding = self._scenario_data.get(
+                'max_outstanding', self.user_count)
+        if self.max_outstanding < 1:
+            raise ValueError('max_outstanding must be >= 1')
+
+        # Seed for the generator behind the job stream (sizes, operations,
+        # containers, etc.); runs with the same seed get the same jobs.  If
+        # none is given, one is picked (and saved with the results).
+        if seed is not None:
+            self.seed = seed
+        else:
+            self.seed = self._scenario_data.get('seed', None)
+        if self.seed is None:
+            self.seed = random.randint(0, 2 ** 32 - 1)
+        self.seed = int(self.seed)
+        self.random = Random(self.seed)
+        # The benchmark jobs get their own stream, so they're the same whether
+        # or not the initial jobs were drawn first (e.g. with --inventory).
+        self.bench_random = Random(self.seed)
+        self.bench_random.jumpahead(3)
+
     def packb(self):
         return msgpack.packb({
             '_scenario_data': self._scenario_data,
@@ -140,6 +208,11 @@ class Scenario(object):
             'container_count': self.container_count,
             'container_concurrency': self.container_concurrency,
             'delete_after': self.delete_after,
+            'policy': self.policy,
+            'rate': self.rate,
+            'arrival': self.arrival,
+            'max_outstanding': self.max_outstanding,
+            'seed': self.seed,
         })
 
     @classmethod
@@ -154,7 +227,12 @@ class Scenario(object):
                        run_seconds=data['run_seconds'],
                        version=data['version'],
                        _scenario_data=data['_scenario_data'],
-                       delete_after=data.get('delete_after'))
+                       delete_after=data.get('delete_after'),
+                       policy=data.get('policy'),
+                       rate=data.get('rate'),
+                       arrival=data.get('arrival'),
+                       max_outstanding=data.get('max_outstanding'),
+                       seed=data.get('seed'))
         return scenario
 
     @property
@@ -170,29 +248,51 @@ class Scenario(object):
             last = last + float(data[idx]) / initial_sum
             target[idx] = last
 
+    def session_settings(self):
+        """
+        Settings shared by every job in a run of this scenario.  The master
+        sends these to each worker once, instead of with every job.
+        """
+        return {
+            'block_size': self.block_size,
+            'delete_after': self.delete_after,
+            'policy': self.policy,
+            'size_names': self.sizes_by_name.keys(),
+            'containers': self.containers,
+            'payload_by_size': self.payload_by_size,
+        }
+
+    def codec(self):
+        """
+        A Codec for the jobs and results of a run of this scenario.
+        """
+        return Codec(self.sizes_by_name.keys(), self.containers)
+
     def job(self, size_str, **kwargs):
-        job = {'size_str': size_str}
-        job.update(kwargs)
-        return job
+        return dict(kwargs, size_str=size_str)
 
-    def create_job(self, size_str, i, container=None, head_first=False):
+    def create_job(self, size_str, i, container=None, head_first=False,
+                   rng=None):
         """
         Creates job dict which will create an object.
+
+        :rng: The random.Random to pick with (default self.random)
         """
 
+        rng = rng or self.random
         if container is None:
-            container = random.choice(self.containers)
-
-        return self.job(size_str,
-                        type=ssbench.CREATE_OBJECT,
-                        container=container,
-                        name='%s_%06d' % (size_str, i),
-                        size=random.randint(
-                            self.sizes_by_name[size_str]['size_min'],
-                            self.sizes_by_name[size_str]['size_max']),
-                        block_size=self.block_size,
-                        head_first=head_first,
-                        delete_after=self.delete_after)
+            container = rng.choice(self.containers)
+
+        job = self.job(size_str,
+                       type=ssbench.CREATE_OBJECT,
+                       container=container,
+                       name='%s_%06d' % (size_str, i),
+                       size=rng.randint(
+                           self.sizes_by_name[size_str]['size_min'],
+                           self.sizes_by_name[size_str]['size_max']))
+        if head_first:
+            job['head_first'] = True
+        return job
 
     def bench_job(self, size_str, crud_index, i):
         """Creates a benchmark work job dict of a given size and crud "index"
@@ -205,15 +305,13 @@ class Scenario(object):
         """
 
         if crud_index == 0:
-            return self.create_job(size_str, i)
+            return self.create_job(size_str, i, rng=self.bench_random)
         elif crud_index == 1:
-            return self.job(size_str, type=ssbench.READ_OBJECT,
-                            block_size=self.block_size)
+            return self.job(size_str, type=ssbench.READ_OBJECT)
         elif crud_index == 2:
             return self.job(
                 size_str, type=ssbench.UPDATE_OBJECT,
-                block_size=self.block_size,
-                size=random.randint(
+                size=self.bench_random.randint(
                     self.sizes_by_name[size_str]['size_min'],
                     self.sizes_by_name[size_str]['size_max']))
         elif crud_index == 3:
@@ -245,7 +343,7 @@ class Scenario(object):
                     index_per_size[size_str] += 1
                     yielded = True
 
-    def bench_jobs(self):
+    def bench_jobs(self, first_index=None):
         """
         Generator for the worker jobs necessary to actually run the scenario.
 
@@ -255,6 +353,8 @@ class Scenario(object):
         If self.run_seconds is not set, exactly self.operation_count jobs will
         be yielded.
 
+        :first_index: Name created objects starting from at least this index
+                      (by default, they follow the initial objects)
         :returns: A generator which yields job objects (dicts)
         """
 
@@ -270,24 +370,18 @@ class Scenario(object):
             prev_alarm = signal.signal(signal.SIGALRM, _stop_running)
             signal.alarm(self.run_seconds)
 
-        index = max_index_size + 1
+        # Pick a size, then which C/R/U/D type the job will be, each with a
+        # single uniform draw into an alias table.
+        rand = self.bench_random.random
+        pick_size = self._size_table.pick
+        crud_picks = dict((size_str, table.pick)
+                          for size_str, table in self._crud_tables.iteritems())
+        index = max(max_index_size + 1, first_index)
         yielded = 0
         while (self.run_seconds and keep_running[0]) or \
                 yielded < self.operation_count:
-            r = random.random()  # uniform on [0, 1)
-            for size_str, prob in self.bench_size_thresholds.iteritems():
-                if r < prob:
-                    this_size_str = size_str
-                    break
-            # Determine which C/R/U/D type this job will be
-            size_crud = self.sizes_by_name[this_size_str]['crud_thresholds']
-            r = random.random()  # uniform on [0, 1)
-            for crud_index, prob in enumerate(size_crud):
-                if r < prob:
-                    this_crud_index = crud_index
-                    break
-
-            yield self.bench_job(this_size_str, this_crud_index, index)
+            size_str = pick_size(rand())
+            yield self.bench_job(size_str, crud_picks[size_str](rand()), index)
 
             index += 1
             yielded += 1
@@ -298,6 +392,29 @@ class Scenario(object):
             # necessary for all known applications of Scenario.
             signal.signal(signal.SIGALRM, prev_alarm)
 
+    def arrival_offsets(self):
+        """
+        Generator for the send times of an open-loop benchmark run, in seconds
+        relative to the start of the run.  Inter-arrival gaps are exponential
+        ("poisson" arrival) or fixed ("constant" arrival) with a mean of
+        1 / self.rate.  The gaps come from their own seeded generator, so the
+        job stream doesn't depend on the arrival process.
+
+        :returns: A generator which yields float offsets, in seconds
+        """
+
+        gaps = Random(self.seed)
+        gaps.jumpahead(1)
+
+        if self.arrival == 'constant':
+            for i in itertools.count():
+                yield i / self.rate
+        else:
+            offset = 0.0
+            while True:
+                yield offset
+                offset += gaps.expovariate(self.rate)
+
 
 class ScenarioNoop(Scenario):
     """
@@ -305,9 +422,4 @@ class ScenarioNoop(Scenario):
     """
 
     def job(self, size_str, **kwargs):
-        job = {
-            'size_str': size_str,
-            'noop': True,
-        }
-        job.update(kwargs)
-        return job
+        return dict(kwargs, size_str=size_str, noop=True)
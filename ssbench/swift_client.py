@@ -11,16 +11,21 @@ Cloud Files client library used internally
 
 import socket
 import sys
+import hashlib
 import logging
 from time import time
 from functools import wraps
 
-from urllib import quote as _quote
+from urllib import quote as _quote, unquote
 from urlparse import urlparse, urlunparse
 
 from httplib import HTTPException
 from geventhttpclient.httplib import HTTPConnection, HTTPSConnection
 from gevent import sleep
+import gevent.socket
+import gevent.ssl
+
+from ssbench.util import tar_archive, monotonic
 
 
 logger = logging.getLogger("swiftclient")
@@ -141,6 +146,64 @@ class ClientException(Exception):
         return b and '%s: %s' % (a, b) or a
 
 
+class VerificationError(ClientException):
+    """
+    A request succeeded, but the object data that came back wasn't what it
+    should have been.
+    """
+    pass
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """
+    An HTTPConnection which notes how long it took to connect, in
+    connect_phases, for the first request on it to report (see _phases()).
+    """
+    connect_phases = None
+
+    def connect(self):
+        start = monotonic()
+        HTTPConnection.connect(self)
+        self.connect_phases = {'connect_time': monotonic() - start}
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """
+    Like TimedHTTPConnection, but the TLS handshake is timed on its own.
+    """
+    connect_phases = None
+
+    def connect(self):
+        # As in HTTPSConnection.connect()
+        start = monotonic()
+        sock = gevent.socket.create_connection((self.host, self.port),
+                                               self.timeout,
+                                               self.source_address)
+        if self._tunnel_host:
+            self.sock = sock
+            self._tunnel()
+        connected = monotonic()
+        self.sock = gevent.ssl.wrap_socket(sock, self.key_file,
+                                           self.cert_file)
+        self.connect_phases = {'connect_time': connected - start,
+                               'tls_time': monotonic() - connected}
+
+
+def _phases(conn, start, sent, headers_at, done):
+    """
+    :returns: How long each phase of a request took, from the given
+              monotonic() times: sending the request, waiting for the
+              response's headers and reading its body (and connecting, if
+              the connection is new)
+    """
+    phases = {'send_time': sent - start, 'wait_time': headers_at - sent,
+              'body_time': done - headers_at}
+    connect_phases = vars(conn).pop('connect_phases', None)
+    if connect_phases:
+        phases.update(connect_phases)
+    return phases
+
+
 def http_connection(url, proxy=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT):
     """
     Make an HTTPConnection or HTTPSConnection
@@ -155,11 +218,11 @@ def http_connection(url, proxy=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT):
     parsed = urlparse(url)
     proxy_parsed = urlparse(proxy) if proxy else None
     if parsed.scheme == 'http':
-        conn = HTTPConnection(
+        conn = TimedHTTPConnection(
             (proxy_parsed if proxy else parsed).netloc,
             timeout=connect_timeout)
     elif parsed.scheme == 'https':
-        conn = HTTPSConnection(
+        conn = TimedHTTPSConnection(
             (proxy_parsed if proxy else parsed).netloc,
             timeout=connect_timeout)
     else:
@@ -654,11 +717,65 @@ def delete_container(url, token, container, http_conn=None):
                               http_response_content=body)
 
 
+# Response bodies being thrown away are read into these (one per chunk size).
+# Nothing ever looks at what's in them, so every greenlet can share them.
+_discard_buffers = {}
+
+
+def _discard_body(resp, chunk_size, md5=None):
+    """
+    Reads and throws away the rest of a response's body.  For a
+    geventhttpclient response with a Content-Length, that's done by reading
+    straight from its socket into a shared buffer, so nothing is allocated
+    per chunk; anything else is read (and thrown away) a chunk at a time.
+
+    :param md5: if given, a hashlib md5 object to update with the body as
+                it goes by
+    :returns: the number of bytes read
+    """
+    sock = getattr(resp, '_sock', None)
+    length = resp.getheader('content-length')
+    if sock is None or length is None or \
+            not hasattr(resp, '_body_buffer') or \
+            resp.getheader('transfer-encoding'):
+        read = 0
+        chunk = resp.read(chunk_size)
+        while chunk:
+            if md5:
+                md5.update(chunk)
+            read += len(chunk)
+            chunk = resp.read(chunk_size)
+        return read
+    # Some of the body may have come in with the headers
+    if md5:
+        md5.update(resp._body_buffer)
+    left = int(length) - len(resp._body_buffer)
+    del resp._body_buffer[:]
+    buf = _discard_buffers.get(chunk_size)
+    if buf is None:
+        buf = _discard_buffers[chunk_size] = bytearray(chunk_size)
+    while left > 0:
+        got = sock.recv_into(buf, min(left, chunk_size))
+        if not got:
+            resp.release()
+            raise HTTPException('connection closed with %d bytes of the '
+                                'body left' % left)
+        if md5:
+            md5.update(buffer(buf, 0, got))
+        left -= got
+    # Done with the body, as if the response's parser had seen it all (which
+    # leaves the connection open for the next request)
+    resp._on_message_complete()
+    return int(length)
+
+
 def get_object(url, token, container, name, http_conn=None,
-               resp_chunk_size=65536):
+               resp_chunk_size=65536, verify=False):
     """
     Modified for benchmarking to GET an object in "chunk sizes" of
-    resp_chunk_size, throwing away the actual contents.
+    resp_chunk_size, throwing away the actual contents (see _discard_body()).
+    If verify is set, the contents are hashed as they go by, and must match
+    the response's ETag and Content-Length.
 
     :param url: storage URL
     :param token: auth token
@@ -667,8 +784,10 @@ def get_object(url, token, container, name, http_conn=None,
     :param http_conn: HTTP connection object (If None, it will create the
                       conn object)
     :param resp_chunk_size: chunk size of data to read; defaults to 65536.
+    :param verify: check the contents against the ETag and Content-Length?
     :returns: benchmarking-decorated response headers.
     :raises ClientException: HTTP GET request failed
+    :raises VerificationError: verify was set, and the contents were wrong
     """
     if http_conn:
         parsed, conn = http_conn
@@ -677,10 +796,12 @@ def get_object(url, token, container, name, http_conn=None,
     path = '%s/%s/%s' % (parsed.path, quote(container), quote(name))
     method = 'GET'
     headers = {'X-Auth-Token': token}
-    start = time()
+    start, clock = time(), monotonic()
     conn.request(method, path, '', headers)
+    sent = monotonic()
     resp = conn.getresponse()
     first_byte_latency = time() - start
+    headers_at = monotonic()
     if resp.status < 200 or resp.status >= 300:
         body = resp.read()
         http_log(('%s%s' % (url.replace(parsed.path, ''), path), method,),
@@ -690,22 +811,46 @@ def get_object(url, token, container, name, http_conn=None,
                               http_path=path, http_status=resp.status,
                               http_reason=resp.reason,
                               http_response_content=body)
-    last_byte_latency = None
-    buf = True
-    while buf:
-        buf = resp.read(resp_chunk_size)
+    md5 = hashlib.md5() if verify else None
+    read = _discard_body(resp, resp_chunk_size, md5)
     last_byte_latency = time() - start
+    phases = _phases(conn, clock, sent, headers_at, monotonic())
+    if verify:
+        problem = _verification_problem(resp, read, md5.hexdigest())
+        if problem:
+            raise VerificationError(
+                'Object GET verification failed (%s)' % problem,
+                http_scheme=parsed.scheme, http_host=conn.host,
+                http_port=conn.port, http_path=path,
+                http_status=resp.status, http_reason=resp.reason)
     resp_headers = _decorated_response_headers(
         resp, first_byte_latency=first_byte_latency,
-        last_byte_latency=last_byte_latency)
+        last_byte_latency=last_byte_latency, phases=phases)
     http_log(('%s%s' % (url.replace(parsed.path, ''), path), method,),
              {'headers': headers}, resp, None)
     return resp_headers
 
 
+def _verification_problem(resp, read, etag):
+    """
+    :returns: What's wrong with a GET response whose body was read bytes
+              long with the given (hex) MD5, or None if nothing is
+    """
+    length = resp.getheader('content-length')
+    if length is not None and int(length) != read:
+        return 'got %d bytes; expected %s' % (read, length)
+    expected = (resp.getheader('etag') or '').strip('"')
+    # A large object's ETag isn't the MD5 of its contents
+    if expected and not resp.getheader('x-object-manifest') and \
+            not resp.getheader('x-static-large-object') and \
+            expected != etag:
+        return 'got MD5 %s; expected %s' % (etag, expected)
+    return None
+
+
 def _decorated_response_headers(resp, first_byte_latency=None,
-                                last_byte_latency=None):
-    resp_headers = {}
+                                last_byte_latency=None, phases=None):
+    resp_headers = dict(phases or {})
     if first_byte_latency is not None:
         resp_headers['x-swiftstack-first-byte-latency'] = first_byte_latency
     if last_byte_latency is not None:
@@ -736,10 +881,13 @@ def head_object(url, token, container, name, http_conn=None):
     path = '%s/%s/%s' % (parsed.path, quote(container), quote(name))
     method = 'HEAD'
     headers = {'X-Auth-Token': token}
-    start_time = time()
+    start_time, clock = time(), monotonic()
     conn.request(method, path, '', headers)
+    sent = monotonic()
     resp = conn.getresponse()
+    headers_at = monotonic()
     body = resp.read()
+    phases = _phases(conn, clock, sent, headers_at, monotonic())
     http_log(('%s%s' % (url.replace(parsed.path, ''), path), method,),
              {'headers': headers}, resp, body)
     if resp.status < 200 or resp.status >= 300:
@@ -750,16 +898,20 @@ def head_object(url, token, container, name, http_conn=None):
                               http_response_content=body)
     now = time()
     return _decorated_response_headers(
-        resp, last_byte_latency=now - start_time)
+        resp, last_byte_latency=now - start_time, phases=phases)
 
 
 def put_object(url, token=None, container=None, name=None, contents=None,
                content_length=None, chunk_size=65536,
-               content_type=None, headers=None, http_conn=None, proxy=None):
+               content_type=None, headers=None, http_conn=None, proxy=None,
+               offset=0):
     """
-    Modified for benchmarking to take a constant string in "contents" and write
-    out the first "chunk_size" bytes of "contents" until "content_length" bytes
-    have been sent.  A "contents" value of None will still do a zero-byte PUT.
+    Modified for benchmarking to take a constant string (or buffer, like an
+    mmap) in "contents" and write it out, starting at "offset" and wrapping
+    around at its end, "chunk_size" bytes at a time until "content_length"
+    bytes have been sent.  A "contents" value of None will still do a
+    zero-byte PUT.  The contents are never copied, so the same string may be
+    shared by any number of concurrent PUTs.
 
     If the length of contents is less than chunk_size, the length of contents
     will be the de facto chunk size.
@@ -783,6 +935,7 @@ def put_object(url, token=None, container=None, name=None, contents=None,
                       conn object)
     :param proxy: proxy to connect through, if any; None by default; str of the
                   format 'http://127.0.0.1:8888' to set one
+    :param offset: where in contents to start
     :returns: dict with benchmarking headers
     :raises ClientException: HTTP PUT request failed
     """
@@ -809,22 +962,26 @@ def put_object(url, token=None, container=None, name=None, contents=None,
         raise ValueError('For benchmarking, content_length cannot be None!')
     if content_type is not None:
         headers['Content-Type'] = content_type
-    request_start = time()
+    request_start, clock = time(), monotonic()
     conn.putrequest('PUT', path)
     for header, value in headers.iteritems():
         conn.putheader(header, value)
     conn.endheaders()
     left = content_length
-    chunk_size = min(chunk_size, len(contents))
     while left > 0:
-        if left < chunk_size:
-            conn.send(contents[:left])
-            left = 0
-        else:
+        length = min(chunk_size, left, len(contents) - offset)
+        if length == len(contents):
             conn.send(contents)
-            left -= chunk_size
+        else:
+            # (A buffer doesn't copy the bytes)
+            conn.send(buffer(contents, offset, length))
+        left -= length
+        offset = (offset + length) % len(contents)
+    sent = monotonic()
     resp = conn.getresponse()
+    headers_at = monotonic()
     body = resp.read()
+    phases = _phases(conn, clock, sent, headers_at, monotonic())
     headers = {'X-Auth-Token': token}
     http_log(('%s%s' % (url.replace(parsed.path, ''), path), 'PUT',),
              {'headers': headers}, resp, body)
@@ -835,7 +992,107 @@ def put_object(url, token=None, container=None, name=None, contents=None,
                               http_reason=resp.reason,
                               http_response_content=body)
     return _decorated_response_headers(
-        resp, last_byte_latency=time() - request_start)
+        resp, last_byte_latency=time() - request_start, phases=phases)
+
+
+def extract_archive(url, token, container, members, name=None,
+                    chunk_size=65536, http_conn=None):
+    """
+    Modified for benchmarking to create objects whose contents are taken from
+    constant strings, by uploading a tar archive of them (generated on the
+    fly) to the bulk middleware's extract-archive.
+
+    :param url: storage URL
+    :param token: auth token
+    :param container: container name to create the objects in
+    :param members: a list of (object name, size, contents, offset) tuples,
+                    as for util.tar_archive()
+    :param name: ignored (the objects' names are in members)
+    :param chunk_size: chunk size of data to write; default 65536
+    :param http_conn: HTTP connection object (If None, it will create the
+                      conn object)
+    :returns: dict with benchmarking headers, and the middleware's results
+              (e.g. {"Number Files Created": 7, "Errors": [], ...}) under
+              "extract_result"
+    :raises ClientException: HTTP PUT request failed, or the cluster doesn't
+                             support extract-archive
+    """
+    if http_conn:
+        parsed, conn = http_conn
+    else:
+        parsed, conn = http_connection(url)
+    path = '%s/%s' % (parsed.path.rstrip('/'), quote(container))
+    qs = 'extract-archive=tar'
+    length, pieces = tar_archive(members)
+    headers = {'X-Auth-Token': token, 'Content-Length': str(length),
+               'Accept': 'application/json'}
+    request_start, clock = time(), monotonic()
+    conn.putrequest('PUT', '%s?%s' % (path, qs))
+    for header, value in headers.iteritems():
+        conn.putheader(header, value)
+    conn.endheaders()
+    # Tar headers and padding are small; send them along with the contents
+    # in chunk_size pieces.
+    chunk, chunk_length = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        chunk_length += len(piece)
+        if chunk_length >= chunk_size:
+            conn.send(''.join(chunk))
+            chunk, chunk_length = [], 0
+    if chunk:
+        conn.send(''.join(chunk))
+    sent = monotonic()
+    resp = conn.getresponse()
+    headers_at = monotonic()
+    body = resp.read()
+    phases = _phases(conn, clock, sent, headers_at, monotonic())
+    http_log(('%s?%s' % (url.replace(parsed.path, '') + path, qs), 'PUT',),
+             {'headers': {'X-Auth-Token': token}}, resp, body)
+    if resp.status < 200 or resp.status >= 300:
+        raise ClientException('Archive PUT failed', http_scheme=parsed.scheme,
+                              http_host=conn.host, http_port=conn.port,
+                              http_path=path, http_query=qs,
+                              http_status=resp.status,
+                              http_reason=resp.reason,
+                              http_response_content=body)
+    result = _extract_result(body)
+    if result is None:
+        # Without the middleware, this was just a container PUT
+        raise ClientException('Extract archive not supported',
+                              http_scheme=parsed.scheme, http_host=conn.host,
+                              http_port=conn.port, http_path=path,
+                              http_query=qs, http_status=resp.status,
+                              http_reason=resp.reason,
+                              http_response_content=body)
+    resp_headers = _decorated_response_headers(
+        resp, last_byte_latency=time() - request_start, phases=phases)
+    resp_headers['extract_result'] = result
+    return resp_headers
+
+
+def _extract_result(body):
+    """
+    :returns: The results in an extract-archive response's (JSON) body, or
+              None if it doesn't have any
+    """
+    try:
+        result = json_loads(body)
+    except ValueError:
+        return None
+    if not isinstance(result, dict) or 'Number Files Created' not in result:
+        return None
+    return result
+
+
+def archive_failures(extract_result):
+    """
+    :returns: The set of names of the objects which an extract-archive (with
+              the given results) failed to create
+    """
+    # Failures are listed by (quoted) path: /<ver>/<acct>/<cont>/<obj>
+    return set(unquote(path).split('/', 4)[-1]
+               for path, _ in extract_result.get('Errors') or ())
 
 
 def post_object(url, token, container, name, headers, http_conn=None):
@@ -904,10 +1161,13 @@ def delete_object(url, token=None, container=None, name=None, http_conn=None,
         headers = {}
     if token:
         headers['X-Auth-Token'] = token
-    start_time = time()
+    start_time, clock = time(), monotonic()
     conn.request('DELETE', path, '', headers)
+    sent = monotonic()
     resp = conn.getresponse()
+    headers_at = monotonic()
     body = resp.read()
+    phases = _phases(conn, clock, sent, headers_at, monotonic())
     http_log(('%s%s' % (url.replace(parsed.path, ''), path), 'DELETE',),
              {'headers': headers}, resp, body)
     if resp.status < 200 or resp.status >= 300:
@@ -917,7 +1177,58 @@ def delete_object(url, token=None, container=None, name=None, http_conn=None,
                               http_status=resp.status, http_reason=resp.reason,
                               http_response_content=body)
     return _decorated_response_headers(
-        resp, last_byte_latency=time() - start_time)
+        resp, last_byte_latency=time() - start_time, phases=phases)
+
+
+def bulk_delete(url, token, container, names, http_conn=None):
+    """
+    Delete objects with a single request to the bulk middleware's
+    bulk-delete.
+
+    :param url: storage URL
+    :param token: auth token
+    :param container: container name that the objects are in
+    :param names: object names to delete (at most the cluster's
+                  max_deletes_per_request; 10000 by default)
+    :param http_conn: HTTP connection object (If None, it will create the
+                      conn object)
+    :returns: a dict of the middleware's results, e.g. {"Number Deleted": 7,
+              "Number Not Found": 1, "Errors": [], ...}
+    :raises ClientException: HTTP POST request failed, or the cluster doesn't
+                             support bulk-delete
+    """
+    if http_conn:
+        parsed, conn = http_conn
+    else:
+        parsed, conn = http_connection(url)
+    path = '%s?bulk-delete' % parsed.path.rstrip('/')
+    body = '\n'.join(quote('/%s/%s' % (container, name)) for name in names)
+    headers = {'X-Auth-Token': token, 'Content-Type': 'text/plain',
+               'Accept': 'application/json'}
+    method = 'POST'
+    conn.request(method, path, body, headers)
+    resp = conn.getresponse()
+    resp_body = resp.read()
+    http_log(('%s?bulk-delete' % url, method,), {'headers': headers}, resp,
+             resp_body)
+    if resp.status < 200 or resp.status >= 300:
+        raise ClientException('Bulk delete failed',
+                              http_scheme=parsed.scheme, http_host=conn.host,
+                              http_port=conn.port, http_path=path,
+                              http_status=resp.status, http_reason=resp.reason,
+                              http_response_content=resp_body)
+    try:
+        result = json_loads(resp_body)
+    except ValueError:
+        result = None
+    if not isinstance(result, dict) or 'Number Deleted' not in result:
+        # Without the middleware, this was just an account POST
+        raise ClientException('Bulk delete not supported',
+                              http_scheme=parsed.scheme, http_host=conn.host,
+                              http_port=conn.port, http_path=path,
+                              http_status=resp.status, http_reason=resp.reason,
+                              http_response_content=resp_body)
+    return result
 
 
 class Connection(object):
@@ -1095,3 +1406,7 @@ class Connection(object):
     def delete_object(self, container, obj):
         """Wrapper for :func:`delete_object`"""
         return self._retry(None, delete_object, container, obj)
+
+    def bulk_delete(self, container, names):
+        """Wrapper for :func:`bulk_delete`"""
+        return self._retry(None, bulk_delete, container, names)
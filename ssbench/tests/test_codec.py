@@ -0,0 +1,73 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import msgpack
+from unittest import TestCase
+
+import ssbench
+from ssbench.codec import Codec, CODEC_VERSION
+
+
+class TestCodec(TestCase):
+    def setUp(self):
+        self.codec = Codec(['tiny', 'small'],
+                           ['ssbench_000000_default_policy',
+                            'ssbench_000001_default_policy'])
+        self.result = {
+            'type': ssbench.READ_OBJECT,
+            'size_str': 'small',
+            'container': 'ssbench_000001_default_policy',
+            'name': 'small_000042',
+            'worker_id': 3,
+            'scheduled_at': 1234.5,
+            'completed_at': 1235.0,
+            'first_byte_latency': 0.25,
+            'last_byte_latency': 0.5,
+            'trans_id': 'tx1234',
+            'retries': 0,
+        }
+
+    def test_round_trip(self):
+        raw = self.codec.encode([self.result, self.result])
+        self.assertEqual([self.result, self.result], self.codec.decode(raw))
+
+    def test_interns_known_names(self):
+        version, records = msgpack.loads(self.codec.encode([self.result]))
+        self.assertEqual(CODEC_VERSION, version)
+        # type, size_str, container and name all went as small ints
+        self.assertEqual([1, 1, 1, 42], records[0][1:5])
+        self.assertLess(len(self.codec.encode([self.result])),
+                        len(msgpack.dumps([self.result])) / 2)
+
+    def test_none_is_not_absent(self):
+        result = dict(self.result, first_byte_latency=None)
+        del result['trans_id']
+        self.assertEqual([result],
+                         self.codec.decode(self.codec.encode([result])))
+
+    def test_unknown_names_and_keys(self):
+        job = {
+            'type': ssbench.CREATE_OBJECT,
+            'size_str': 'gigantic',
+            'container': 'somewhere_else',
+            'name': 'gigantic_000007',
+            'size': 99,
+            'job_datum': 'extra',
+        }
+        odd_name = dict(self.result, name='small_42')
+        self.assertEqual([job, odd_name], self.codec.decode(
+            self.codec.encode([job, odd_name])))
+
+    def test_control_messages_and_legacy(self):
+        session = {'type': 'SESSION', 'session': {'block_size': 9}}
+        self.assertEqual([session],
+                         self.codec.decode(self.codec.encode([session])))
+        # Plain lists of dicts (as older ssbench sent and saved) pass through
+        self.assertEqual([self.result],
+                         self.codec.decode(msgpack.dumps([self.result])))
+        self.assertEqual([], self.codec.decode(msgpack.dumps([])))
+
+    def test_bad_version(self):
+        with self.assertRaises(ValueError):
+            self.codec.decode(msgpack.dumps([CODEC_VERSION + 1, []]))
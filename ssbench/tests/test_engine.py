@@ -0,0 +1,235 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import mock
+from nose.tools import assert_equal, assert_raises, assert_almost_equal
+from nose.tools import assert_not_equal
+
+from ssbench import engine
+from ssbench.histogram import Histogram
+from ssbench.util import content_md5, payload_pool
+
+
+class TestWorkerProcesses(object):
+    def test_process_count(self):
+        assert_equal(3, engine.process_count('3'))
+        with mock.patch.object(engine.multiprocessing, 'cpu_count',
+                               return_value=12):
+            assert_equal(12, engine.process_count('auto'))
+        assert_raises(ValueError, engine.process_count, '0')
+        assert_raises(ValueError, engine.process_count, 'lots')
+
+    def test_child_worker_id(self):
+        assert_equal(5, engine.child_worker_id(5, 1, 0))
+        assert_equal([8, 9, 10, 11],
+                     [engine.child_worker_id(2, 4, i) for i in xrange(4)])
+
+    def test_run_worker_processes_restarts_crashes(self):
+        run_worker = mock.Mock()
+        mock_fork = mock.Mock(side_effect=[101, 102, 103])
+        with mock.patch.object(engine.os, 'wait', side_effect=[
+                (101, 1 << 8),  # crashed
+                (102, engine.SUICIDE_EXIT_STATUS << 8),
+                (103, 0)]), \
+                mock.patch.object(engine.signal, 'signal'), \
+                mock.patch.object(engine.time, 'sleep') as mock_sleep:
+            engine.run_worker_processes(2, run_worker, fork=mock_fork)
+        # Only the crashed child was restarted; nothing ran in the parent
+        assert_equal(3, mock_fork.call_count)
+        mock_sleep.assert_called_once_with(engine.RESTART_DELAY)
+        assert_equal(0, run_worker.call_count)
+
+    def test_run_worker_processes_reseeds_random(self):
+        read_end, write_end = os.pipe()
+
+        def run_worker(index):
+            os.write(write_end, '%r\n' % engine.random.random())
+
+        with mock.patch.object(engine.signal, 'signal'):
+            engine.run_worker_processes(2, run_worker)
+        os.close(write_end)
+        with os.fdopen(read_end) as draws:
+            first, second = draws.read().split()
+        assert_not_equal(first, second)
+
+
+class TestUrlSelector(object):
+    urls = ['http://proxy1/v1/a', 'http://proxy2/v1/a', 'http://proxy3/v1/a']
+
+    def test_unknown_policy(self):
+        assert_raises(ValueError, engine.UrlSelector, 'fastest')
+
+    def test_one_url(self):
+        selector = engine.UrlSelector('p2c-ewma')
+        assert_equal(self.urls[0], selector.choose(self.urls[:1]))
+
+    def test_round_robin(self):
+        selector = engine.UrlSelector('round-robin')
+        chosen = [selector.choose(self.urls) for _ in xrange(6)]
+        assert_equal(self.urls, sorted(chosen[:3]))
+        assert_equal(chosen[:3], chosen[3:])
+
+    def test_least_outstanding(self):
+        selector = engine.UrlSelector('least-outstanding')
+        for url in self.urls:
+            selector.started(url)
+        selector.started(self.urls[0])
+        selector.started(self.urls[2])
+        assert_equal(self.urls[1], selector.choose(self.urls))
+        selector.started(self.urls[1])
+        selector.started(self.urls[1])
+        selector.finished(self.urls[0], 0.1)
+        selector.finished(self.urls[0], 0.1)
+        assert_equal(self.urls[0], selector.choose(self.urls))
+
+    def test_p2c_ewma(self):
+        selector = engine.UrlSelector('p2c-ewma')
+        slow, fast = self.urls[:2]
+        for url, latency in ((slow, 2.0), (fast, 0.1)):
+            selector.started(url)
+            selector.finished(url, latency)
+        assert_equal(set([fast]),
+                     set(selector.choose([slow, fast]) for _ in xrange(20)))
+        # The fast one gets busy enough to cost more than the slow one
+        for _ in xrange(20):
+            selector.started(fast)
+        assert_equal(slow, selector.choose([slow, fast]))
+
+    def test_ewma(self):
+        selector = engine.UrlSelector('p2c-ewma')
+        selector.started(self.urls[0])
+        selector.finished(self.urls[0], 1.0)
+        assert_equal(1.0, selector.latency[self.urls[0]])
+        selector.started(self.urls[0])
+        selector.finished(self.urls[0], 2.0)
+        assert_almost_equal(1.2, selector.latency[self.urls[0]])
+        assert_equal(0, selector.in_flight[self.urls[0]])
+
+    def test_finished_without_started(self):
+        # As for a request started under an earlier session's selector
+        selector = engine.UrlSelector('least-outstanding')
+        selector.finished(self.urls[0], 0.5)
+        assert_equal(0, selector.in_flight[self.urls[0]])
+        assert_equal(0.5, selector.latency[self.urls[0]])
+
+
+class _Engine(engine.Engine):
+    worker_id = 3
+
+    def __init__(self):
+        self.queued = []
+
+    def queue_result(self, result):
+        self.queued.append(result)
+
+
+class TestResultSummary(object):
+    def setUp(self):
+        self.engine = _Engine()
+        self.engine.start_session({'summary_interval': 10})
+
+    def _put(self, op_type='get_object', last_byte_latency=0.5, **kwargs):
+        kwargs.setdefault('retries', 0)
+        self.engine.put_results(
+            {'type': op_type, 'size_str': 'small', 'container': 'c',
+             'name': 'small_000001'}, kwargs,
+            first_byte_latency=0.1, last_byte_latency=last_byte_latency,
+            trans_id='tx')
+
+    def test_summarized(self):
+        self._put()
+        self._put('upload_object')
+        assert_equal([
+            {'type': 'get_object', 'worker_id': 3, 'summarized': True},
+            {'type': 'upload_object', 'worker_id': 3, 'size_str': 'small',
+             'container': 'c', 'name': 'small_000001', 'summarized': True},
+        ], self.engine.queued)
+
+    def test_sampled(self):
+        self.engine.session.update(raw_sample_rate=1.0)
+        self._put()
+        result, = self.engine.queued
+        assert_equal(True, result['sampled'])
+        assert_equal('tx', result['trans_id'])
+
+        # Failures and (with raw_tail_latency) slow results are always kept
+        self.engine.queued = []
+        self.engine.session.update(raw_sample_rate=0.0, raw_tail_latency=2)
+        self._put(last_byte_latency=1.9)
+        self._put(last_byte_latency=2.1)
+        self._put(exception='oops')
+        assert_equal([None, True, True], [
+            queued.get('sampled') for queued in self.engine.queued])
+
+    def test_flush_summary(self):
+        self._put()
+        self._put(last_byte_latency=0.7, retries=1, conn_hits=1)
+        self.engine.flush_summary()
+        summary = self.engine.queued[-1]
+        assert_equal('SUMMARY', summary['type'])
+        assert_equal(3, summary['worker_id'])
+        assert_equal(True, summary['flushed'])
+        (op_type, size_str, storage_url, entry), = summary['entries']
+        assert_equal(('get_object', 'small', None),
+                     (op_type, size_str, storage_url))
+        assert_equal((2, 0, 1, 1), (entry['req_count'], entry['errors'],
+                                    entry['retries'], entry['conn_hits']))
+        assert_equal([2], summary['completions'].values())
+        last_byte = Histogram.decode(entry['latencies']['last_byte_latency'])
+        assert_equal((2, 0.5, 0.7), (last_byte.count, last_byte.min,
+                                     last_byte.max))
+        # The next result starts a new summary
+        self._put(exception='oops', verify_failed=True)
+        self.engine.flush_summary()
+        (_, _, _, entry), = self.engine.queued[-1]['entries']
+        assert_equal((0, 1, 1), (entry['req_count'], entry['errors'],
+                                 entry['verify_errors']))
+        assert_equal({}, entry['latencies'])
+
+    def test_flush_without_summary(self):
+        # The master still hears back from a worker with nothing to report
+        self.engine.start_session({})
+        self.engine.flush_summary()
+        assert_equal([{'type': 'SUMMARY', 'worker_id': 3, 'completions': {},
+                       'entries': [], 'flushed': True}], self.engine.queued)
+        assert_equal(None, self.engine.summary)
+
+    def test_sent_every_interval(self):
+        with mock.patch.object(engine.time, 'time') as mock_time:
+            mock_time.return_value = 1000.0
+            self.engine.start_session({'summary_interval': 10})
+            self._put()
+            mock_time.return_value = 1010.0
+            self._put()
+        assert_equal(['SUMMARY'], [result['type']
+                                   for result in self.engine.queued
+                                   if not result.get('summarized')])
+        assert_equal(1010.0, self.engine.summary.started_at)
+
+
+class TestPayloads(object):
+    def setUp(self):
+        self.engine = _Engine()
+        self.engine.start_session({'verify': True,
+                                   'payload_by_size': {'small': 'random'}})
+
+    def test_pool_offsets(self):
+        stride = len(payload_pool('random')) // engine.PAYLOAD_POOL_OFFSETS
+        for _ in xrange(20):
+            _, offset = self.engine._contents('small')
+            assert_equal(0, offset % stride)
+
+    def test_upload_headers_cached(self):
+        object_info = {'size_str': 'small', 'size': 5000}
+        _, offset = self.engine._contents('small')
+        headers = self.engine._upload_headers(object_info, 'A', offset)
+        assert_equal(content_md5(payload_pool('random'), 5000, offset),
+                     headers['etag'])
+        # The next object starting there doesn't hash it all over again
+        with mock.patch('ssbench.util.content_md5') as mock_md5:
+            assert_equal(headers, self.engine._upload_headers(
+                object_info, 'A', offset))
+        assert_equal(0, mock_md5.call_count)
@@ -0,0 +1,68 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import random
+from unittest import TestCase
+
+import msgpack
+
+import ssbench.util
+from ssbench.histogram import Histogram, bucket_index, bucket_bounds
+
+
+class TestHistogram(TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        self.values = [rng.lognormvariate(-3, 1.5) for _ in xrange(5000)]
+
+    def test_buckets(self):
+        for value in (0.0, 0.000042, 0.000127, 0.000128, 0.003, 1.5, 3600.0):
+            low, high = bucket_bounds(bucket_index(value))
+            self.assertTrue(low <= value < high, (low, value, high))
+            self.assertLessEqual(high - low, max(value / 64, 1e-6))
+        # Buckets are contiguous
+        for index in xrange(1, 1000):
+            self.assertAlmostEqual(bucket_bounds(index - 1)[1],
+                                   bucket_bounds(index)[0])
+
+    def test_stats(self):
+        histogram = Histogram(self.values)
+        self.assertEqual(5000, len(histogram))
+        self.assertEqual(min(self.values), histogram.min)
+        self.assertEqual(max(self.values), histogram.max)
+        self.assertAlmostEqual(ssbench.util.mean(self.values),
+                               histogram.mean())
+        self.assertAlmostEqual(ssbench.util.uncorrected_stdev(self.values),
+                               histogram.stdev())
+        ordered = sorted(self.values)
+        for nth_pctile, exact in ((50, ordered[2499]), (95, ordered[4749]),
+                                  (99.9, ordered[4994])):
+            self.assertAlmostEqual(exact, histogram.percentile(nth_pctile),
+                                   delta=exact * 0.008)
+        self.assertEqual(histogram.percentile(50), histogram.median())
+        self.assertEqual(histogram.max, histogram.percentile(100))
+
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertFalse(histogram)
+        self.assertEqual(None, histogram.percentile(95))
+        self.assertEqual(None, histogram.mean())
+
+    def test_merge(self):
+        merged = Histogram(self.values[:1000])
+        merged.merge(Histogram(self.values[1000:]))
+        merged.merge(Histogram())
+        whole = Histogram(self.values)
+        self.assertEqual(whole.counts, merged.counts)
+        self.assertEqual((whole.count, whole.min, whole.max),
+                         (merged.count, merged.min, merged.max))
+        self.assertAlmostEqual(whole.total, merged.total)
+
+    def test_encode(self):
+        histogram = Histogram(self.values)
+        decoded = Histogram.decode(msgpack.loads(
+            msgpack.dumps(histogram.encode()), use_list=False))
+        self.assertEqual(histogram.counts, decoded.counts)
+        self.assertEqual(histogram.percentile(95), decoded.percentile(95))
+        self.assertEqual(histogram.stdev(), decoded.stdev())
@@ -0,0 +1,108 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import os
+import gzip
+import shutil
+import tempfile
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import ssbench
+from ssbench.scenario import Scenario
+from ssbench.log_replay import LogReplay, parse_log_line
+
+from ssbench.tests.test_scenario import ScenarioFixture
+
+
+def _log_line(method, path, status, recvd='-', sent='-', start=None,
+              source='-'):
+    line = ('Mar 28 10:12:11 proxy1 proxy-server: 10.0.0.1 10.0.0.1 '
+            '28/Mar/2013/10/12/11 %s %s HTTP/1.0 %d - python-swiftclient '
+            'AUTH_tk1234 %s %s - tx1234 - 0.0123 %s -' % (
+                method, path, status, recvd, sent, source))
+    if start is not None:
+        line += ' %.3f %.3f 0' % (start, start + 0.0123)
+    return line + '\n'
+
+
+class TestLogReplay(ScenarioFixture):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.temp_dir, 'proxy.log')
+        super(TestLogReplay, self).setUp()
+        self.scenario = Scenario(self.stub_scenario_file, seed=42)
+        self.lines = [
+            _log_line('PUT', '/v1/AUTH_a/c/o1', 201, recvd=150, start=100.0),
+            _log_line('GET', '/v1/AUTH_a/c/o1', 200, sent=150, start=100.5),
+            # not replayed: HEAD, failures, container requests, subrequests
+            _log_line('HEAD', '/v1/AUTH_a/c/o1', 200, start=100.6),
+            _log_line('GET', '/v1/AUTH_a/c/nope', 404, start=100.7),
+            _log_line('GET', '/v1/AUTH_a/c', 200, sent=99, start=100.8),
+            _log_line('GET', '/v1/AUTH_a/c/o1', 200, sent=150, start=100.9,
+                      source='SW'),
+            'some unrelated junk\n',
+            _log_line('GET', '/v1/AUTH_a/c/o%202', 200, sent=9999,
+                      start=101.0),
+            _log_line('DELETE', '/v1/AUTH_a/c/o1', 204, start=102.0),
+        ]
+        with open(self.log_path, 'wb') as log_file:
+            log_file.writelines(self.lines)
+
+    def tearDown(self):
+        super(TestLogReplay, self).tearDown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parse_log_line(self):
+        assert_equal((100.0, 'PUT', '/v1/AUTH_a/c/o1', 201, 150, 0),
+                     parse_log_line(self.lines[0]))
+        assert_equal('/v1/AUTH_a/c/o 2', parse_log_line(self.lines[7])[2])
+        # Older logs have no start_time; fall back to the (UTC) datetime
+        assert_equal((1364465531, 'GET', '/v1/AUTH_a/c/o1', 200, 0, 150),
+                     parse_log_line(_log_line('GET', '/v1/AUTH_a/c/o1', 200,
+                                              sent=150)))
+        for i in (4, 5, 6):
+            assert_equal(None, parse_log_line(self.lines[i]))
+
+    def test_size_str_for(self):
+        replay = LogReplay(self.log_path, self.scenario)
+        assert_equal('tiny', replay.size_str_for(100))
+        assert_equal('tiny', replay.size_str_for(0))
+        assert_equal('small', replay.size_str_for(199))
+        assert_equal('large', replay.size_str_for(401))
+        assert_equal('red herring', replay.size_str_for(10 ** 6))
+
+    def test_timed_bench_jobs(self):
+        replay = LogReplay(self.log_path, self.scenario, speed=2.0)
+        assert_true(replay.timed)
+        timed_jobs = list(replay.bench_jobs())
+        assert_equal([0.0, 0.25, 0.5, 1.0],
+                     [offset for offset, _ in timed_jobs])
+        create, read1, read2, delete = [job for _, job in timed_jobs]
+        assert_equal(ssbench.CREATE_OBJECT, create['type'])
+        assert_equal('small', create['size_str'])
+        assert_equal('small_000701', create['name'])
+        assert_equal(150, create['size'])
+        assert_equal({'type': ssbench.READ_OBJECT, 'size_str': 'small'},
+                     read1)
+        assert_equal({'type': ssbench.READ_OBJECT,
+                      'size_str': 'red herring'}, read2)
+        assert_equal(ssbench.DELETE_OBJECT, delete['type'])
+        assert_true(delete['size_str'] in
+                    self.scenario_dict['initial_files'])
+
+        assert_equal(2, len(list(replay.bench_jobs(run_seconds=0.5))))
+
+    def test_untimed_bench_jobs(self):
+        with open(self.log_path, 'rb') as log_file:
+            with gzip.open(self.log_path + '.gz', 'wb') as gz_file:
+                gz_file.write(log_file.read())
+        replay = LogReplay(self.log_path + '.gz', self.scenario, speed=None)
+        jobs = list(replay.bench_jobs())
+        assert_equal([ssbench.CREATE_OBJECT, ssbench.READ_OBJECT,
+                      ssbench.READ_OBJECT, ssbench.DELETE_OBJECT],
+                     [job['type'] for job in jobs])
+
+    def test_bad_speed(self):
+        with assert_raises(ValueError):
+            LogReplay(self.log_path, self.scenario, speed=0)
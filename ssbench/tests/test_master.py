@@ -9,6 +9,7 @@ import StringIO
 from unittest import TestCase
 from flexmock import flexmock
 import mock
+import gevent
 import zmq.green as zmq
 
 import msgpack
@@ -16,7 +17,9 @@ import msgpack
 import ssbench
 from ssbench.master import Master
 from ssbench.run_results import RunResults
+from ssbench.run_state import RunState
 from ssbench import swift_client as client
+from ssbench.swift_client import ClientException
 from ssbench.tests.test_scenario import ScenarioFixture
 
 
@@ -58,11 +61,12 @@ class TestMaster(ScenarioFixture, TestCase):
         self.mock_context = flexmock()
         flexmock(zmq.Context).new_instances(self.mock_context).once
 
-        self.mock_work_push = flexmock(send=self._send)
+        self.mock_work_router = flexmock(send_multipart=self._send_multipart,
+                                         recv_multipart=self._recv_multipart)
         self.mock_context.should_receive('socket').with_args(
-            zmq.PUSH,
-        ).and_return(self.mock_work_push).once
-        self.mock_work_push.should_receive('bind').with_args(
+            zmq.ROUTER,
+        ).and_return(self.mock_work_router).once
+        self.mock_work_router.should_receive('bind').with_args(
             self.work_endpoint,
         ).once
 
@@ -74,6 +78,13 @@ class TestMaster(ScenarioFixture, TestCase):
             self.results_endpoint,
         ).once
 
+        self.mock_poller = flexmock(poll=self._poll)
+        flexmock(zmq.Poller).new_instances(self.mock_poller).once
+        self.mock_poller.should_receive('register').with_args(
+            self.mock_work_router, zmq.POLLIN).once
+        self.mock_poller.should_receive('register').with_args(
+            self.mock_results_pull, zmq.POLLIN).once
+
         with mock.patch.object(ssbench.master, 'is_ipv6') as mock_is_ipv6:
             mock_is_ipv6.return_value = False
             self.master = Master(self.zmq_host, self.zmq_work_port,
@@ -83,22 +94,61 @@ class TestMaster(ScenarioFixture, TestCase):
             mock_is_ipv6.assert_called_once_with(self.zmq_host)
 
         self._send_calls = []
+        self._send_idents = []
+        self._sessions_sent = []
         self._recv_returns = []
+        self._router_recvs = []
+        self._hold_results = False
+        self._results_taken = 0
+        self._jobs_sent = 0
+
+        # One worker has already said HELLO
+        self.master.workers = {
+            'worker-1': {'worker_id': 1, 'concurrency': 1000, 'in_flight': 0},
+        }
+        self.master.worker_idents = {1: 'worker-1'}
 
     def tearDown(self):
         super(TestMaster, self).tearDown()
 
-    def _send(self, data):
-        self._send_calls.append(data)
+    def _send_multipart(self, frames):
+        ident, data = frames
+        jobs = self.master.codec.decode_message(msgpack.loads(data))
+        if jobs[0]['type'] == 'SESSION':
+            self._sessions_sent.append((ident, jobs[0]['session']))
+            return
+        self._send_idents.append(ident)
+        # Keep plain msgpack'ed dicts around so tests needn't decode them
+        self._send_calls.append(msgpack.dumps(jobs))
+        self._jobs_sent += len(jobs)
+
+    def _recv_multipart(self):
+        return self._router_recvs.pop(0)
 
     def _recv(self):
         value = self._recv_returns.pop(0)
+        self._results_taken += 1
         return value
 
+    def _poll(self, timeout=None):
+        ready = []
+        if self._router_recvs:
+            ready.append((self.mock_work_router, zmq.POLLIN))
+        # Results (one per message) only show up for jobs which were sent,
+        # and while they are "held", only once the master is willing to
+        # block for them.
+        if self._recv_returns and self._results_taken < self._jobs_sent and (
+                timeout is None or not self._hold_results):
+            ready.append((self.mock_results_pull, zmq.POLLIN))
+        if not ready and timeout is None:
+            raise AssertionError('Master would block forever')
+        return ready
+
     def assert_bench_output(self, output, expected):
         expected_stderr = '''\
         Benchmark Run:
           X    work job raised an exception
+          V    work job got back the wrong object data (with --verify)
           .  <  1s first-byte-latency
           o  <  3s first-byte-latency
           O  < 10s first-byte-latency
@@ -120,6 +170,7 @@ class TestMaster(ScenarioFixture, TestCase):
             container='container',
             name='john.smith',
             first_byte_latency=0,
+            worker_id=1,
         )
         recvs = [[job_result] for _ in range(len(bench_jobs))]
         self._recv_returns = map(msgpack.dumps, recvs)
@@ -152,9 +203,118 @@ class TestMaster(ScenarioFixture, TestCase):
         expected_results = [job_result] * len(bench_jobs)
         self.assertEqual(parsed_calls, expected_results)
 
+    def test_run_scenario_with_replay(self):
+        replay_jobs = [
+            self.scenario_noop.job('small', type=ssbench.READ_OBJECT)
+            for _ in range(3)]
+        replay = flexmock(log_path='proxy.log', timed=False)
+        replay.should_receive('bench_jobs').with_args(
+            run_seconds=self.scenario.run_seconds, first_index=0).and_return(
+                iter(replay_jobs)).once()
+        flexmock(self.scenario).should_receive('bench_jobs').never()
+        self._recv_returns = self._results_for([1, 1, 1])
+        temp_file = tempfile.NamedTemporaryFile()
+        mock_run_results = flexmock(RunResults(temp_file.name))
+        mock_run_results.should_receive('process_raw_results').times(3)
+
+        ori_stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.master.run_scenario(self.scenario, auth_kwargs={},
+                                     noop=True, run_results=mock_run_results,
+                                     replay=replay)
+        finally:
+            sys.stderr = ori_stderr
+
+        sent_jobs = sum(map(msgpack.loads, self._send_calls), [])
+        self.assertEqual([ssbench.READ_OBJECT] * 3,
+                         [job['type'] for job in sent_jobs])
+
+    def test_run_scenario_with_inventory(self):
+        flexmock(client).should_receive('head_container')
+        flexmock(self.scenario).should_receive('initial_jobs').never()
+        flexmock(RunState).should_receive('load').once()
+        flexmock(RunState).should_receive('save').once()
+        inventory_file = tempfile.NamedTemporaryFile()
+
+        orig_stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.master.run_scenario(
+                self.scenario, auth_kwargs=dict(
+                    token='MOCK_TOKEN',
+                    storage_urls=['http://127.0.0.1:8080/auth/v1.0']),
+                run_results=None, inventory_path=inventory_file.name,
+                populate_only=True)
+        finally:
+            sys.stderr = orig_stderr
+        self.assertEqual([], self._send_calls)
+
+    def test_run_scenario_creates_only_missing_objects(self):
+        initial_jobs = [
+            self.scenario.create_job('small', i, container=container,
+                                     head_first=True)
+            for i, container in enumerate(self.scenario.containers[:3])]
+        flexmock(self.scenario).should_receive('initial_jobs').and_return(
+            iter(initial_jobs))
+        listings = {
+            self.scenario.containers[0]: [{'name': 'other'},
+                                          {'name': 'small_000000'}],
+            self.scenario.containers[2]: [{'name': 'small_000002'}],
+        }
+
+        def get_container(url, token, container, marker=None, limit=None,
+                          http_conn=None):
+            # Listings come a page of one object at a time
+            listing = [o for o in listings.get(container, [])
+                       if o['name'] > marker]
+            return {}, listing[:1]
+
+        client = mock.Mock()
+        client.get_container.side_effect = get_container
+        created = dict(initial_jobs[1], worker_id=1)
+        self._recv_returns = [msgpack.dumps([created])]
+
+        orig_stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            with mock.patch('ssbench.master.client', new=client):
+                self.master.run_scenario(
+                    self.scenario, auth_kwargs=dict(
+                        token='MOCK_TOKEN',
+                        storage_urls=['http://127.0.0.1:8080/auth/v1.0']),
+                    run_results=None, populate_only=True)
+        finally:
+            sys.stderr = orig_stderr
+
+        # One PUT (without a HEAD first), and a few listing requests
+        sent_jobs = sum(map(msgpack.loads, self._send_calls), [])
+        self.assertEqual(['small_000001'], [j['name'] for j in sent_jobs])
+        self.assertNotIn('head_first', sent_jobs[0])
+        self.assertEqual(len(self.scenario.containers) + 3,
+                         client.get_container.call_count)
+        self.assertFalse(client.head_object.called)
+
+    def test_archive_jobs(self):
+        jobs = [self.scenario.create_job('tiny', i, container='c%d' % (i % 2))
+                for i in xrange(5)]
+        archive_jobs = list(ssbench.master._archive_jobs(
+            jobs + [{'type': ssbench.DELETE_OBJECT}], 2))
+        self.assertEqual([ssbench.EXTRACT_ARCHIVE] * 2, [
+            j['type'] for j in archive_jobs[:2]])
+        self.assertEqual({'type': ssbench.DELETE_OBJECT}, archive_jobs[2])
+        self.assertEqual(
+            [('c0', ['tiny_000000', 'tiny_000002']),
+             ('c1', ['tiny_000001', 'tiny_000003']),
+             ('c0', ['tiny_000004'])],
+            [(j['container'], [name for _, name, _ in j['objects']])
+             for j in archive_jobs if j['type'] == ssbench.EXTRACT_ARCHIVE])
+        self.assertEqual(['tiny', 'tiny_000000', jobs[0]['size']],
+                         archive_jobs[0]['objects'][0])
+
     def test_run_scenario_only_doable_job_should_pass(self):
 
-        def not_doable_jobs():
+        def not_doable_jobs(first_index=None):
             yield dict(
                 type=ssbench.CREATE_OBJECT,
                 size_str='small',
@@ -180,6 +340,16 @@ class TestMaster(ScenarioFixture, TestCase):
         mock_client = flexmock(client)
         mock_client \
             .should_receive('head_container')
+        mock_client \
+            .should_receive('get_container') \
+            .and_return(({}, []))
+        # the object created during the run is cleaned up with bulk-delete
+        mock_client \
+            .should_receive('bulk_delete') \
+            .with_args('http://127.0.0.1:8080/auth/v1.0', 'MOCK_TOKEN',
+                       'container', ['john.smith']) \
+            .and_return({'Number Deleted': 1}) \
+            .once()
 
         bench_jobs = list(self.scenario.bench_jobs())
 
@@ -190,6 +360,7 @@ class TestMaster(ScenarioFixture, TestCase):
                 container='container',
                 name='john.smith',
                 first_byte_latency=0,
+                worker_id=1,
             )
             job_result.update(kwargs)
             return job_result
@@ -238,6 +409,7 @@ class TestMaster(ScenarioFixture, TestCase):
                 type='type',
                 container='container',
                 name='john.smith',
+                worker_id=1,
             )
             job_result.update(kwargs)
             recvs = [[job_result] for _ in range(len(bench_jobs))]
@@ -285,6 +457,252 @@ class TestMaster(ScenarioFixture, TestCase):
         exception_output = run_with_args(exception=1)
         self.assert_bench_output(exception_output, 'X' * len(bench_jobs))
 
+    def test_do_a_run_scheduled(self):
+        # Nothing comes back until the drain, so with max_outstanding=2 the
+        # jobs which come due while two are in flight get dropped.
+        self._hold_results = True
+        timed_jobs = [(-1.0, {'type': ssbench.READ_OBJECT, 'test_id': 0}),
+                      (0.0, {'type': ssbench.READ_OBJECT, 'test_id': 1}),
+                      (0.0, {'type': ssbench.READ_OBJECT, 'test_id': 2}),
+                      (0.0, {'type': ssbench.READ_OBJECT, 'test_id': 3})]
+        result = dict(type=ssbench.READ_OBJECT, container='container',
+                      name='john.smith', first_byte_latency=0, worker_id=1)
+        self._recv_returns = map(msgpack.dumps, [[result], [result]])
+        processed = []
+
+        stats = self.master.do_a_run(10, iter(timed_jobs), processed.append,
+                                     {}, scheduled=True, max_outstanding=2)
+
+        self.assertEqual({'sent': 2, 'late': 1, 'dropped': 2}, stats)
+        sent_jobs = sum(map(msgpack.loads, self._send_calls), [])
+        self.assertEqual([0, 1], [j['test_id'] for j in sent_jobs])
+        # Each job carries its intended start time for latency correction
+        self.assertLess(sent_jobs[0]['scheduled_at'],
+                        sent_jobs[1]['scheduled_at'])
+        self.assertEqual(2, len(processed))
+
+    def test_do_a_run_scheduled_processes_results_while_waiting(self):
+        timed_jobs = [(0.0, {'type': ssbench.READ_OBJECT, 'test_id': 0}),
+                      (0.02, {'type': ssbench.READ_OBJECT, 'test_id': 1})]
+        result = dict(type=ssbench.READ_OBJECT, container='container',
+                      name='john.smith', first_byte_latency=0, worker_id=1)
+        self._recv_returns = map(msgpack.dumps, [[result], [result]])
+        processed = []
+
+        stats = self.master.do_a_run(1, iter(timed_jobs), processed.append,
+                                     {}, scheduled=True)
+
+        # The first job's result arrived before the second came due, so
+        # max_outstanding (defaulting to concurrency) wasn't hit.
+        self.assertEqual({'sent': 2, 'late': 0, 'dropped': 0}, stats)
+        self.assertEqual(2, len(self._send_calls))
+        self.assertEqual(2, len(processed))
+
+    def test_do_a_run_scheduled_drops_without_credit(self):
+        self.master.workers['worker-1']['concurrency'] = 1
+        self._hold_results = True
+        timed_jobs = [(0.0, {'type': ssbench.READ_OBJECT, 'test_id': 0}),
+                      (0.0, {'type': ssbench.READ_OBJECT, 'test_id': 1})]
+        result = dict(type=ssbench.READ_OBJECT, container='container',
+                      name='john.smith', first_byte_latency=0, worker_id=1)
+        self._recv_returns = [msgpack.dumps([result])]
+
+        stats = self.master.do_a_run(10, iter(timed_jobs), lambda _: None,
+                                     {}, scheduled=True)
+
+        self.assertEqual({'sent': 1, 'late': 0, 'dropped': 1}, stats)
+        self.assertEqual(0, self.master.workers['worker-1']['in_flight'])
+
+    def _read_jobs(self, count):
+        return (dict(type=ssbench.READ_OBJECT, test_id=i)
+                for i in xrange(count))
+
+    def _results_for(self, worker_ids):
+        return [msgpack.dumps([dict(
+            type=ssbench.READ_OBJECT, container='container',
+            name='john.smith', first_byte_latency=0, worker_id=worker_id)])
+            for worker_id in worker_ids]
+
+    def test_do_a_run_sends_against_credits(self):
+        self.master.workers = {
+            'worker-1': {'worker_id': 1, 'concurrency': 1, 'in_flight': 0},
+            'worker-2': {'worker_id': 2, 'concurrency': 3, 'in_flight': 0},
+        }
+        self.master.worker_idents = {1: 'worker-1', 2: 'worker-2'}
+        self._recv_returns = self._results_for([2, 2, 2, 1])
+
+        self.master.do_a_run(10, self._read_jobs(4), lambda _: None, {})
+
+        # The worker with the most free slots gets each job, and no worker
+        # gets more than its concurrency in flight.
+        self.assertEqual(['worker-2', 'worker-2', 'worker-1', 'worker-2'],
+                         self._send_idents)
+        for worker in self.master.workers.values():
+            self.assertEqual(0, worker['in_flight'])
+
+    def test_do_a_run_waits_for_hello(self):
+        self.master.workers = {}
+        self.master.worker_idents = {}
+        self._router_recvs = [['worker-7', msgpack.dumps(
+            {'type': 'HELLO', 'worker_id': 7, 'concurrency': 2})]]
+        self._recv_returns = self._results_for([7, 7, 7])
+
+        self.master.do_a_run(10, self._read_jobs(3), lambda _: None, {},
+                             batch_size=5)
+
+        self.assertEqual(['worker-7', 'worker-7'], self._send_idents)
+        self.assertEqual([2, 1], [len(msgpack.loads(data))
+                                  for data in self._send_calls])
+        self.assertEqual({'worker_id': 7, 'concurrency': 2, 'in_flight': 0,
+                          'session_id': 1},
+                         self.master.workers['worker-7'])
+
+    def test_do_a_run_sends_session_once(self):
+        self.master.workers['worker-1']['concurrency'] = 1
+        self.master.workers['worker-2'] = {
+            'worker_id': 2, 'concurrency': 1, 'in_flight': 0}
+        self.master.worker_idents[2] = 'worker-2'
+        auth_kwargs = {'token': 'MOCK_TOKEN', 'storage_urls': ['http://a']}
+        self._recv_returns = self._results_for([1, 2, 1, 2])
+
+        self.master.do_a_run(10, self._read_jobs(2), lambda _: None,
+                             auth_kwargs, session={'block_size': 99})
+        self.master.do_a_run(10, self._read_jobs(2), lambda _: None,
+                             auth_kwargs, session={'block_size': 99})
+
+        session = {'auth_kwargs': auth_kwargs, 'block_size': 99,
+                   'connect_timeout': 3.14159, 'network_timeout': 2.71828}
+        self.assertEqual([('worker-1', session), ('worker-2', session)],
+                         sorted(self._sessions_sent))
+        # Jobs don't carry any of the session's settings
+        for job in sum(map(msgpack.loads, self._send_calls), []):
+            self.assertEqual(set(['test_id', 'type', 'scheduled_at']),
+                             set(job.keys()))
+
+        # A new session goes out ahead of the next jobs
+        self._recv_returns = self._results_for([1])
+        self.master.do_a_run(10, self._read_jobs(1), lambda _: None,
+                             auth_kwargs, session={'block_size': 100})
+        self.assertEqual(3, len(self._sessions_sent))
+        self.assertEqual(100, self._sessions_sent[-1][1]['block_size'])
+
+    def test_do_a_run_forgets_lost_worker(self):
+        self.master.workers['worker-0'] = {
+            'worker_id': 0, 'concurrency': 5000, 'in_flight': 0}
+        self.master.worker_idents[0] = 'worker-0'
+
+        def _send_multipart(frames):
+            if frames[0] == 'worker-0':
+                raise zmq.ZMQError(113)
+            self._send_multipart(frames)
+        self.mock_work_router.send_multipart = _send_multipart
+        self._recv_returns = self._results_for([1])
+
+        self.master.do_a_run(10, self._read_jobs(1), lambda _: None, {})
+
+        self.assertEqual(['worker-1'], self._send_idents)
+        self.assertNotIn('worker-0', self.master.workers)
+        self.assertNotIn(0, self.master.worker_idents)
+
+    def test_do_a_run_survives_restarted_worker(self):
+        # Worker 1's process dies with our job in flight, and its
+        # replacement says HELLO under a new identity.
+        self.master.workers['worker-1']['concurrency'] = 1
+        self._router_recvs = [['worker-1-again', msgpack.dumps(
+            {'type': 'HELLO', 'worker_id': 1, 'concurrency': 1})]]
+
+        self.master.do_a_run(10, self._read_jobs(1), lambda _: None, {})
+
+        self.assertEqual(['worker-1'], self._send_idents)
+        self.assertNotIn('worker-1', self.master.workers)
+        self.assertEqual('worker-1-again', self.master.worker_idents[1])
+
+        # The next run's jobs go to the new process
+        self._recv_returns = self._results_for([1])
+        self.master.do_a_run(10, self._read_jobs(1), lambda _: None, {})
+        self.assertEqual(['worker-1', 'worker-1-again'], self._send_idents)
+        self.assertEqual(0, self.master.workers['worker-1-again']['in_flight'])
+
+    def test_process_results_to_archive_result(self):
+        # An extract_archive result names its objects, but has no "name"
+        self.master.workers['worker-1']['in_flight'] = 1
+        raw = self.master.codec.encode([{
+            'type': ssbench.EXTRACT_ARCHIVE, 'worker_id': 1,
+            'container': 'c', 'objects': [['tiny', 'tiny_000001', 99]],
+            'completed_at': 1.0, 'first_byte_latency': 0.1,
+            'last_byte_latency': 0.2, 'retries': 0}])
+        run_state = RunState({}, containers=['c'])
+        self.assertEqual(1, self.master.process_results_to(
+            raw, run_state.handle_initialization_result, label='Init:'))
+        self.assertEqual(0, self.master.workers['worker-1']['in_flight'])
+        self.assertEqual(1, len(run_state.objs_by_size['tiny']))
+
+    def test_process_results_to_with_summaries(self):
+        self.master.workers['worker-1']['in_flight'] = 3
+        sampled = {'type': ssbench.READ_OBJECT, 'worker_id': 1,
+                   'size_str': 'tiny', 'container': 'c', 'name': 'tiny_1',
+                   'completed_at': 1.0, 'first_byte_latency': 0.1,
+                   'last_byte_latency': 0.2, 'retries': 0, 'sampled': True}
+        raw = self.master.codec.encode([
+            {'type': 'SUMMARY', 'worker_id': 1, 'completions': {1: 3},
+             'entries': []},
+            {'type': ssbench.CREATE_OBJECT, 'worker_id': 1,
+             'size_str': 'tiny', 'container': 'c', 'name': 'tiny_2',
+             'summarized': True},
+            {'type': ssbench.READ_OBJECT, 'worker_id': 1,
+             'summarized': True},
+            sampled])
+        processed = []
+        run_results = mock.Mock()
+
+        self.assertEqual(3, self.master.process_results_to(
+            raw, processed.append, run_results=run_results))
+
+        self.assertEqual(0, self.master.workers['worker-1']['in_flight'])
+        self.assertEqual(['tiny_2', None, 'tiny_1'],
+                         [result.get('name') for result in processed])
+        # Only the summary and samples are saved
+        (saved_raw,), _ = run_results.process_raw_results.call_args
+        self.assertEqual(['SUMMARY', ssbench.READ_OBJECT], [
+            result['type'] for result in self.master.codec.decode(saved_raw)])
+
+    def test_do_a_run_flushes_summaries(self):
+        self._recv_returns = [msgpack.dumps([dict(
+            type=ssbench.READ_OBJECT, worker_id=1, summarized=True)])] * 2 + [
+            msgpack.dumps([dict(type='SUMMARY', worker_id=1, completions={},
+                                entries=[], flushed=True)])]
+
+        self.master.do_a_run(10, self._read_jobs(2), lambda _: None, {},
+                             session={'summary_interval': 5})
+
+        self.assertEqual([{'type': 'FLUSH'}], msgpack.loads(
+            self._send_calls[-1]))
+        self.assertEqual(set([1]), self.master.flushed)
+        self.assertEqual([], self._recv_returns)
+
+    def test_flush_summaries_gives_up(self):
+        self.master.FLUSH_TIMEOUT = 0.01
+        self.master.session_id = self.master.workers['worker-1'][
+            'session_id'] = 1
+        with mock.patch.object(ssbench.master.logging, 'warning') as warning:
+            self.master._flush_summaries(lambda: 0)
+        self.assertEqual(['worker-1'], self._send_idents)
+        self.assertIn('worker(s) %s', warning.call_args[0][0])
+
+    def test_kill_workers(self):
+        self._router_recvs = [
+            ['worker-7', msgpack.dumps({'type': 'HELLO', 'worker_id': 7,
+                                        'concurrency': 2})]]
+        flexmock(self.mock_poller).should_receive('poll').replace_with(
+            lambda timeout: self._poll(timeout) if self._router_recvs
+            else [])
+
+        self.master.kill_workers(timeout=0.01)
+
+        self.assertEqual(['worker-1', 'worker-7'], self._send_idents)
+        self.assertEqual([[{'type': 'SUICIDE'}]] * 2,
+                         map(msgpack.loads, self._send_calls))
+
     def test_cleanup_containers(self):
         container_test_sets = [
             # default policy
@@ -337,3 +755,80 @@ class TestMaster(ScenarioFixture, TestCase):
                     http_conn=None
                 ))
             client.delete_container.assert_has_calls(expected_calls, any_order=True)
+
+    def _cleanup_client(self, object_count):
+        # A mock client for one ssbench container holding object_count
+        # objects, listed a page of BULK_DELETE_MAX at a time
+        names = ['obj_%06d' % i for i in xrange(object_count)]
+
+        def get_container(url, token, container, marker=None, limit=None,
+                          http_conn=None):
+            start = names.index(marker) + 1 if marker else 0
+            return None, [{'name': n} for n in names[start:start + limit]]
+
+        client = mock.Mock()
+        client.ClientException = ClientException
+        client.get_account.return_value = (None, [
+            {'name': 'ssbench_001_default_policy', 'count': object_count},
+            {'name': 'foo', 'count': 3}])
+        client.get_container.side_effect = get_container
+        client.http_connection.return_value = None
+        return client, names
+
+    def test_object_deleter_bounds_single_deletes(self):
+        running = []
+        most_running = []
+
+        def delete_object(url, token, container, name):
+            running.append(name)
+            most_running.append(len(running))
+            gevent.sleep(0.001)
+            running.remove(name)
+
+        client = mock.Mock()
+        client.delete_object.side_effect = delete_object
+        with mock.patch('ssbench.master.client', new=client):
+            deleter = ssbench.master._ObjectDeleter(['http://s'], 'token', 2)
+            deleter.bulk = False
+            deleter.delete_objects(('c%d' % (i % 3), 'o%d' % i)
+                                   for i in xrange(30))
+
+        self.assertEqual(30, deleter.deleted)
+        # However many batches (one per container) are at it at once
+        self.assertEqual(2, max(most_running))
+
+    def test_cleanup_containers_bulk_delete(self):
+        client, names = self._cleanup_client(25000)
+        client.bulk_delete.side_effect = lambda url, token, container, batch: {
+            'Number Deleted': len(batch) - 1, 'Number Not Found': 1,
+            'Errors': []}
+
+        with mock.patch('ssbench.master.client', new=client):
+            self.master.cleanup_containers(
+                {'token': 'auth_token', 'storage_urls': ['http://s']},
+                'ssbench', 2, 'default_policy')
+
+        self.assertEqual([names[:10000], names[10000:20000], names[20000:]],
+                         [c[0][3] for c in client.bulk_delete.call_args_list])
+        self.assertFalse(client.delete_object.called)
+        client.delete_container.assert_called_once_with(
+            'http://s', 'auth_token', 'ssbench_001_default_policy',
+            http_conn=None)
+
+    def test_cleanup_containers_without_bulk_delete(self):
+        client, names = self._cleanup_client(5)
+        client.bulk_delete.side_effect = ClientException(
+            'Bulk delete not supported', http_status=204)
+
+        with mock.patch('ssbench.master.client', new=client):
+            self.master.cleanup_containers(
+                {'token': 'auth_token', 'storage_urls': ['http://s']},
+                'ssbench', 2, 'default_policy')
+
+        # Only tried once
+        self.assertEqual(1, client.bulk_delete.call_count)
+        self.assertEqual(names, sorted(
+            c[0][3] for c in client.delete_object.call_args_list))
+        client.delete_container.assert_called_once_with(
+            'http://s', 'auth_token', 'ssbench_001_default_policy',
+            http_conn=None)
@@ -0,0 +1,142 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import socket
+import hashlib
+from unittest import TestCase
+from urlparse import urlparse
+
+import mock
+import zmq
+
+from ssbench import poll_worker
+
+
+class TestPollWorker(TestCase):
+    def setUp(self):
+        self.worker = poll_worker.PollWorker('127.0.0.1', 1, 2, 7, 2)
+        self.worker.start_session({
+            'auth_kwargs': {'token': 'the-token',
+                            'storage_urls': ['http://swift:8080/v1/AUTH_t']},
+        })
+        # Give the worker a connection to us to use
+        self.server, client_sock = socket.socketpair()
+        client_sock.setblocking(0)
+        self.conn = poll_worker._Connection(('http', 'swift:8080'),
+                                            client_sock)
+        self.worker.idle[self.conn.key] = [self.conn]
+
+    def tearDown(self):
+        self.server.close()
+        self.conn.close()
+        self.worker.work_dealer.close(linger=0)
+        self.worker.results_push.close(linger=0)
+        self.worker.context.term()
+
+    def _exchange(self):
+        self.assertEqual(1, len(self.worker.exchanges))
+        return self.worker.exchanges.values()[0]
+
+    def _request(self):
+        # Lets the worker send its request, and returns it
+        self.worker._step(self._exchange(), zmq.POLLOUT)
+        self.assertFalse(self._exchange().sending)
+        return self.server.recv(4096)
+
+    def _respond(self, status, headers=(), body=''):
+        self.server.sendall('HTTP/1.1 %s\r\nContent-Length: %d\r\n%s\r\n%s' % (
+            status, len(body),
+            ''.join('%s: %s\r\n' % header for header in headers), body))
+        self.worker._step(self._exchange(), zmq.POLLIN)
+
+    def test_get_object(self):
+        job = {'type': 'get_object', 'container': 'c', 'name': 'o 1'}
+        self.worker.handle_get_object(job)
+        request = self._request()
+        self.assertTrue(request.startswith(
+            'GET /v1/AUTH_t/c/o%201 HTTP/1.1\r\n'))
+        self.assertIn('X-Auth-Token: the-token\r\n', request)
+        self._respond('200 OK', [('X-Trans-Id', 'tx1')], 'hello')
+        self.assertEqual({}, self.worker.exchanges)
+        self.assertEqual([self.conn], self.worker.idle[self.conn.key])
+        result, = self.worker.results
+        self.assertEqual('tx1', result['trans_id'])
+        self.assertEqual(0, result['retries'])
+        self.assertEqual(7, result['worker_id'])
+        self.assertTrue(result['first_byte_latency'] <=
+                        result['last_byte_latency'])
+        for phase in ('send_time', 'wait_time', 'body_time'):
+            self.assertGreaterEqual(result[phase], 0.0)
+        # The connection was already open
+        self.assertNotIn('connect_time', result)
+        self.assertNotIn('exception', result)
+
+    def test_get_object_verify(self):
+        self.worker.session['verify'] = True
+        job = {'type': 'get_object', 'container': 'c', 'name': 'o'}
+        self.worker.handle_get_object(job)
+        self._request()
+        self._respond('200 OK', [('Etag', hashlib.md5('hello').hexdigest())],
+                      'jello')
+        result, = self.worker.results
+        self.assertTrue(result['verify_failed'])
+        self.assertIn('VerificationError', result['exception'])
+
+    def test_retries(self):
+        job = {'type': 'delete_object', 'container': 'c', 'name': 'o'}
+        self.worker.handle_delete_object(job)
+        self._request()
+        self._respond('503 Service Unavailable', body='busy')
+        # Retried, on the same (kept-alive) connection
+        self.assertEqual([], self.worker.results)
+        self.assertTrue(self._request().startswith('DELETE /v1/AUTH_t/c/o '))
+        self._respond('204 No Content')
+        result, = self.worker.results
+        self.assertEqual(1, result['retries'])
+        self.assertEqual(2, result['conn_hits'])
+        self.assertNotIn('exception', result)
+
+    def test_gives_up(self):
+        job = {'type': 'delete_object', 'container': 'c', 'name': 'o'}
+        self.worker.idle.clear()
+        with mock.patch.object(self.worker, '_connection',
+                               side_effect=socket.error('refused')) as conn:
+            self.worker.handle_delete_object(job)
+        # Tried once, then retried max_retries (2) times
+        self.assertEqual(3, conn.call_count)
+        result, = self.worker.results
+        self.assertEqual(2, result['retries'])
+        self.assertIn('refused', result['exception'])
+
+    def test_stale_connection_replaced(self):
+        self.server.close()  # the server hung up
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.worker.addresses['swift', 8080] = (
+            socket.AF_INET, socket.SOCK_STREAM, 0, '', listener.getsockname())
+        call = mock.Mock(counts={})
+        conn = self.worker._connection(
+            urlparse('http://swift:8080/v1/AUTH_t'), call)
+        self.assertIsNot(self.conn, conn)
+        self.assertEqual([], self.worker.idle[self.conn.key])
+        self.assertEqual({'conn_reconnects': 1}, call.counts)
+        conn.close()
+        listener.close()
+
+    def test_upload_head_first(self):
+        job = {'type': 'upload_object', 'container': 'c', 'name': 'o',
+               'size': 3, 'head_first': True}
+        self.worker.handle_upload_object(job)
+        self.assertTrue(self._request().startswith('HEAD '))
+        self._respond('404 Not Found')
+        # Not there, so it's uploaded
+        request = self._request()
+        self.assertTrue(request.startswith('PUT /v1/AUTH_t/c/o '))
+        self.assertIn('Content-Length: 3\r\n', request)
+        self.assertTrue(request.endswith('\r\n\r\nAAA'))
+        self._respond('201 Created')
+        result, = self.worker.results
+        self.assertNotIn('head_first', result)
+        self.assertNotIn('exception', result)
@@ -8,6 +8,7 @@ from unittest import TestCase
 from cStringIO import StringIO
 
 import ssbench
+from ssbench.engine import ResultSummary
 from ssbench.reporter import Reporter
 from ssbench.ordered_dict import OrderedDict
 import ssbench.util
@@ -808,6 +809,158 @@ class TestReporter(TestReporterBase):
             data=[1, 1, 5, 3, 0, 2],
         ), self.reporter.stats['time_series'])
 
+    def test_calculate_scenario_stats_corrected_latency(self):
+        # Results from jobs stamped with their intended start time carry
+        # latencies corrected for coordinated omission; pretend every job
+        # sat queued for a second before it was actually started.
+        for results in self.stub_results:
+            for result in results:
+                if 'exception' not in result:
+                    result['corrected_first_byte_latency'] = \
+                        result['first_byte_latency'] + 1.0
+                    result['corrected_last_byte_latency'] = \
+                        result['last_byte_latency'] + 1.0
+        self.reporter.read_results(nth_pctile=50)
+        agg_stats = self.reporter.stats['agg_stats']
+        self.assertEqual(' 1.100', agg_stats['corrected_first_byte_latency'][
+            'min'])
+        self.assertEqual('  4.000', agg_stats['corrected_last_byte_latency'][
+            'max'])
+
+        report_lines = self.reporter.generate_default_report().split('\n')
+        self.assertIn(
+            '     Corrected first-byte:  1.100 -   2.200    1.508  (  0.386)'
+            '    1.400  (all obj sizes)', report_lines)
+        self.assertIn(
+            '     Corrected  last-byte:  3.200 -   3.200    3.200  (  0.000)'
+            '    3.200  (    huge objs)', report_lines)
+
+    def test_calculate_scenario_stats_no_corrected_latency(self):
+        agg_stats = self.reporter.stats['agg_stats']
+        self.assertNotIn('corrected_first_byte_latency', agg_stats)
+        self.assertNotIn('corrected_last_byte_latency', agg_stats)
+
+    def test_calculate_scenario_stats_verify_errors(self):
+        # The one exception was a --verify failure
+        self.stub_results[2][0]['verify_failed'] = True
+        self.reporter.read_results(nth_pctile=50)
+        agg_stats = self.reporter.stats['agg_stats']
+        self.assertEqual(1, agg_stats['errors'])
+        self.assertEqual(1, agg_stats['verify_errors'])
+        self.assertNotIn('verify_errors', self.reporter.stats['op_stats'][
+            ssbench.READ_OBJECT])
+
+        report = self.reporter.generate_default_report()
+        self.assertEqual(2, report.count('Verification failures:     1'))
+        self.assertIn('total_verify_errors',
+                      self.reporter.generate_default_report(output_csv=True))
+
+    def test_calculate_scenario_stats_connection_counts(self):
+        self.assertNotIn('conn_hits', self.reporter.stats['agg_stats'])
+        self.stub_results[0][0].update(conn_misses=1)
+        self.stub_results[0][1].update(conn_hits=1)
+        self.stub_results[1][0].update(conn_hits=2, conn_reconnects=1)
+        self.reporter.read_results(nth_pctile=50)
+        agg_stats = self.reporter.stats['agg_stats']
+        self.assertEqual((3, 1, 1), (agg_stats['conn_hits'],
+                                     agg_stats['conn_misses'],
+                                     agg_stats['conn_reconnects']))
+
+        report = self.reporter.generate_default_report()
+        self.assertIn('Connections:     3 reused;     1 opened;     1 '
+                      'reopened', report)
+        self.assertIn('total_conn_reconnects',
+                      self.reporter.generate_default_report(output_csv=True))
+
+    def test_calculate_scenario_stats_phases(self):
+        self.assertNotIn('wait_time', self.reporter.stats['agg_stats'])
+        self.assertNotIn('Phases', self.reporter.generate_default_report())
+
+        for results in self.stub_results:
+            for result in results:
+                if 'exception' not in result:
+                    result.update(send_time=0.001, wait_time=0.25,
+                                  body_time=0.5)
+        self.stub_results[0][0].update(connect_time=0.002)
+        self.reporter.read_results(nth_pctile=50)
+        agg_stats = self.reporter.stats['agg_stats']
+        self.assertEqual('  0.250', agg_stats['wait_time']['avg'])
+        self.assertEqual('  0.002', agg_stats['connect_time']['pctile'])
+        self.assertNotIn('tls_time', agg_stats)
+
+        report = self.reporter.generate_default_report()
+        self.assertIn(
+            '       Phases, avg/50%-ile: connect   0.002/  0.002  send '
+            '  0.001/  0.001  wait   0.250/  0.250  body   0.500/  0.500  '
+            '(all obj sizes)', report.split('\n'))
+        self.assertIn('  body   0.500/  0.500  (    huge objs)', report)
+
+    def test_calculate_scenario_stats_from_summaries(self):
+        self.reporter.read_results(nth_pctile=50, format_numbers=False)
+        raw_stats = self.reporter.stats
+        # The same results, as workers with a summary_interval would send
+        # them: in SUMMARY records, plus a few samples
+        summaries = {}
+        for results in self.stub_results:
+            for result in results:
+                summaries.setdefault(result['worker_id'], ResultSummary(
+                    100.0)).add(result)
+        sampled = [dict(self.stub_results[2][0], sampled=True),
+                   dict(self.stub_results[1][0], sampled=True)]
+        self.run_results.read_results.return_value = (self.scenario, [
+            [summary.record(worker_id)
+             for worker_id, summary in summaries.iteritems()], sampled])
+        self.reporter.read_results(nth_pctile=50, format_numbers=False)
+        stats = self.reporter.stats
+
+        for key in ('req_count', 'errors', 'retries', 'worker_count',
+                    'start', 'stop', 'avg_req_per_sec'):
+            self.assertAlmostEqual(raw_stats['agg_stats'][key],
+                                   stats['agg_stats'][key])
+        for key in ('min', 'max', 'avg', 'std_dev'):
+            self.assertAlmostEqual(
+                raw_stats['agg_stats']['last_byte_latency'][key],
+                stats['agg_stats']['last_byte_latency'][key])
+        for key in ('start', 'stop', 'data'):
+            self.assertEqual(raw_stats['time_series'][key],
+                             stats['time_series'][key])
+        self.assertEqual(sorted(raw_stats['worker_stats']),
+                         sorted(stats['worker_stats']))
+        for op_type, op_stats in raw_stats['op_stats'].iteritems():
+            self.assertEqual(op_stats['req_count'],
+                             stats['op_stats'][op_type]['req_count'])
+            for size_str, size_stats in op_stats['size_stats'].iteritems():
+                self.assertEqual(
+                    size_stats['last_byte_latency']['max'],
+                    stats['op_stats'][op_type]['size_stats'][size_str][
+                        'last_byte_latency']['max'])
+        # Only samples can name the slowest request
+        self.assertEqual(sampled[1]['trans_id'], stats['agg_stats'][
+            'worst_last_byte_latency'][1])
+
+        self.reporter.read_results(nth_pctile=50)
+        self.assertIn(sampled[1]['trans_id'],
+                      self.reporter.generate_default_report())
+
+    def test_calculate_scenario_stats_url_stats(self):
+        self.assertEqual({}, self.reporter.stats['url_stats'])
+        report = self.reporter.generate_default_report()
+        self.assertNotIn('Per storage URL', report)
+
+        for i, result in enumerate(self.stub_results[0]):
+            result['storage_url'] = 'http://proxy%d/v1/a' % (i % 2)
+        self.reporter.read_results(nth_pctile=50)
+        url_stats = self.reporter.stats['url_stats']
+        self.assertEqual(['http://proxy0/v1/a', 'http://proxy1/v1/a'],
+                         sorted(url_stats))
+        self.assertEqual(
+            len(self.stub_results[0]),
+            sum(stats['req_count'] + stats['errors']
+                for stats in url_stats.itervalues()))
+        report = self.reporter.generate_default_report()
+        self.assertIn('Per storage URL:  Count  Errors', report)
+        self.assertIn('  http://proxy1/v1/a\n', report)
+
     def test_write_rps_histogram(self):
         # Write out time series data (requests-per-second histogram) to an
         # already open CSV file
@@ -11,6 +11,7 @@ import subprocess
 from nose.tools import (assert_equal, assert_false, assert_greater,
                         assert_raises)
 
+import ssbench
 from ssbench.scenario import Scenario
 from ssbench.run_results import RunResults
 
@@ -164,3 +165,24 @@ class TestRunResults(ScenarioFixture):
             [{'two-1': 2.1}, {'two-2': 2.2}],
             [{'three': '3'}],
         ])
+
+    def test_read_compact_results(self):
+        self.run_results.start_run(self.scenario)
+        result = {
+            'type': ssbench.CREATE_OBJECT,
+            'size_str': 'small',
+            'container': self.scenario.containers[3],
+            'name': 'small_000003',
+            'size': 200,
+            'first_byte_latency': 0.1,
+            'last_byte_latency': 0.2,
+        }
+        self.run_results.process_raw_results(
+            self.scenario.codec().encode([result, result]))
+        # Older, plain-dict results still read back fine, too
+        self.run_results.process_raw_results(msgpack.packb([result]))
+        self.run_results.finalize()
+
+        _, unpacker = RunResults(self.result_file_path).read_results()
+
+        assert_equal(list(unpacker), [[result, result], [result]])
@@ -2,11 +2,17 @@
 #Copyright (c) 2012-2021, NVIDIA CORPORATION.
 #SPDX-License-Identifier: Apache-2.0
 
-from nose.tools import assert_equal, assert_set_equal
-from collections import deque
+import os
+import shutil
+import tempfile
+from nose.tools import (assert_equal, assert_set_equal, assert_raises,
+                        assert_greater, assert_less, assert_almost_equal)
+from random import Random
+from collections import deque, Counter
+import msgpack
 
 import ssbench
-from ssbench.run_state import RunState
+from ssbench.run_state import RunState, Popularity, ObjectList
 
 
 class TestRunState(object):
@@ -206,16 +212,22 @@ class TestRunState(object):
             'container': 'bucket0',
             'name': 'obj2',
         })
+        # Objects stay in order; the next one gets the next access
         assert_equal(self.run_state.objs_by_size, {
             'obtuse': deque([
                 ('bucket0', 'obj1', True),
                 ('bucket1', 'obj1', True),
                 ('bucket3', 'obj4', False)]),
             'round': deque([
-                ('bucket0', 'obj3', False),  # (got rotated)
-                ('bucket1', 'obj6', False),
-                ('bucket0', 'obj2', True)]),
+                ('bucket0', 'obj2', True),
+                ('bucket0', 'obj3', False),
+                ('bucket1', 'obj6', False)]),
         })
+        assert_equal('obj3', self.run_state.fill_in_job({
+            'type': ssbench.UPDATE_OBJECT,
+            'size_str': 'round',
+            'size': 991,
+        })['name'])
 
     def test_fill_in_job_for_read_object(self):
         self._fill_initial_results()
@@ -231,9 +243,9 @@ class TestRunState(object):
         })
         assert_equal(self.run_state.objs_by_size, {
             'obtuse': deque([
-                ('bucket1', 'obj1', True),  # (got rotated)
-                ('bucket3', 'obj4', False),
-                ('bucket0', 'obj1', True)]),
+                ('bucket0', 'obj1', True),
+                ('bucket1', 'obj1', True),
+                ('bucket3', 'obj4', False)]),
             'round': deque([
                 ('bucket0', 'obj2', True),
                 ('bucket0', 'obj3', False),
@@ -292,3 +304,207 @@ class TestRunState(object):
             'obtuse': deque([]),
             'round': deque([]),
         })
+
+    def test_handle_archive_result(self):
+        self.run_state.handle_initialization_result({
+            'type': ssbench.EXTRACT_ARCHIVE,
+            'container': 'bucket0',
+            'objects': [['obtuse', 'obj1', 88], ['round', 'obj2', 90],
+                        ['obtuse', 'obj3', 89]],
+        })
+        self.run_state.handle_initialization_result({
+            'type': ssbench.EXTRACT_ARCHIVE,
+            'container': 'bucket1',
+            'objects': [['obtuse', 'obj4', 88]],
+            'exception': 'oh noes!',
+        })
+        assert_equal({
+            'obtuse': [('bucket0', 'obj1', True), ('bucket0', 'obj3', True)],
+            'round': [('bucket0', 'obj2', True)],
+        }, dict((size_str, list(objs)) for size_str, objs in
+                self.run_state.objs_by_size.iteritems()))
+
+    def test_fill_in_job_with_popularity(self):
+        self.run_state = RunState({'obtuse': 'latest'}, seed=1)
+        self._fill_initial_results()
+        self._fill_run_results()
+        names = Counter(self.run_state.fill_in_job({
+            'type': ssbench.READ_OBJECT,
+            'size_str': 'obtuse',
+        })['name'] for _ in xrange(1000))
+        # The newest object is the most popular
+        assert_greater(names['obj4'], names['obj1'])
+        # Other sizes are still round-robin
+        assert_equal(['obj2', 'obj3', 'obj6', 'obj2'], [
+            self.run_state.fill_in_job({
+                'type': ssbench.READ_OBJECT,
+                'size_str': 'round',
+            })['name'] for _ in xrange(4)])
+
+
+class TestPopularity(object):
+    def _counts(self, spec, n=100, picks=20000):
+        popularity = Popularity(spec, Random(42))
+        return Counter(popularity.pick(n) for _ in xrange(picks))
+
+    def test_round_robin(self):
+        popularity = Popularity()
+        assert_equal([0, 1, 2, 0, 1], [popularity.pick(3) for _ in xrange(5)])
+        # The list shrank
+        assert_equal([0, 1, 0], [popularity.pick(2) for _ in xrange(3)])
+
+    def test_uniform(self):
+        counts = self._counts('uniform')
+        assert_equal(range(100), sorted(counts))
+        assert_less(max(counts.values()), 300)
+
+    def test_zipf(self):
+        counts = self._counts({'model': 'zipf', 's': 1.2})
+        assert_equal(0, max(counts, key=counts.get))
+        assert_greater(counts[0], counts[1])
+        assert_greater(counts[1], counts[9])
+        assert_greater(counts[9], counts[99])
+        assert_equal(range(100), sorted(counts))
+
+        counts = self._counts('zipf')  # s = 1
+        assert_greater(counts[0], counts[9] * 5)
+
+    def test_latest(self):
+        counts = self._counts('latest')
+        assert_equal(99, max(counts, key=counts.get))
+        assert_greater(counts[98], counts[0])
+
+    def test_hotset(self):
+        counts = self._counts({'model': 'hotset', 'hot_pct': 20,
+                               'access_pct': 75})
+        hot = sum(counts[i] for i in xrange(20))
+        assert_almost_equal(0.75, hot / 20000.0, delta=0.02)
+        assert_equal(range(100), sorted(counts))
+        # Everything is "hot" when there are too few objects
+        assert_equal([0], self._counts({'model': 'hotset'}, n=1).keys())
+
+    def test_bad_specs(self):
+        for spec in ('popular', {'model': 'zipf', 's': 0},
+                     {'model': 'hotset', 'hot_pct': 0},
+                     {'model': 'hotset', 'access_pct': 101}):
+            with assert_raises(ValueError):
+                Popularity(spec)
+
+
+class TestObjectList(object):
+    def setUp(self):
+        self.containers = dict(('c%d' % i, i) for i in xrange(3))
+
+    def test_object_list(self):
+        objs = ObjectList('small', self.containers)
+        for i in xrange(3000):
+            objs.append(('c%d' % (i % 3), 'small_%06d' % i, i < 10))
+        for i in xrange(2000):
+            assert_equal(('c%d' % (i % 3), 'small_%06d' % i, i < 10),
+                         objs.popleft())
+        assert_equal(1000, len(objs))
+        assert_equal(('c2', 'small_002000', False), objs[0])
+        assert_equal(('c2', 'small_002999', False), objs[999])
+        assert_equal(('c1', 'small_002500', False), list(objs)[500])
+        with assert_raises(IndexError):
+            objs[1000]
+        with assert_raises(IndexError):
+            ObjectList('small', {}).popleft()
+
+    def test_compact_storage(self):
+        objs = ObjectList('small', self.containers)
+        objs.append(('c1', 'small_000042', True))
+        objs.append(('c2', 'small_1234567', False))
+        assert_equal([], objs._others)
+        assert_equal([3, 4], list(objs._codes))
+        assert_equal([42, 1234567], list(objs._indexes))
+
+        # Anything else is kept as-is
+        odd = [('elsewhere', 'small_000001', False),
+               ('c0', 'tiny_000001', False),
+               ('c0', 'small_1', True),
+               ('c0', 'small_%d' % 2 ** 32, False)]
+        for obj_info in odd:
+            objs.append(obj_info)
+        assert_equal(odd, objs._others)
+        assert_equal([('c1', 'small_000042', True),
+                      ('c2', 'small_1234567', False)] + odd, list(objs))
+        while objs:
+            objs.popleft()
+        assert_equal([], objs._others)
+
+    def test_packed_after_popping_others(self):
+        objs = ObjectList('small', self.containers)
+        for obj_info in [('x', 'small_000001', False),
+                         ('y', 'small_000002', False),
+                         ('c0', 'small_000003', False)]:
+            objs.append(obj_info)
+        objs.popleft()
+        packed = msgpack.loads(msgpack.dumps(objs.packed()))
+        assert_equal([('y', 'small_000002', False),
+                      ('c0', 'small_000003', False)],
+                     list(ObjectList.unpacked('small', self.containers,
+                                              packed)))
+
+
+class TestInventory(object):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.inventory_path = os.path.join(self.temp_dir, 'inventory')
+        self.containers = ['c0', 'c1', 'c2']
+        self.run_state = RunState(containers=self.containers)
+        for i, (container, initial) in enumerate([('c0', True),
+                                                  ('c1', True),
+                                                  ('elsewhere', True),
+                                                  ('c2', False)]):
+            self.run_state._handle_result({
+                'type': ssbench.CREATE_OBJECT,
+                'size_str': 'small',
+                'container': container,
+                'name': 'small_%06d' % (i + 7),
+            }, initial=initial)
+        self.run_state._handle_result({
+            'type': ssbench.CREATE_OBJECT,
+            'size_str': 'tiny',
+            'container': 'c1',
+            'name': 'tiny_%d' % 2 ** 33,
+        })
+        self.run_state.objs_by_size['small'].popleft()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_next_object_index(self):
+        assert_equal(0, RunState().next_object_index())
+        assert_equal(2 ** 33 + 1, self.run_state.next_object_index())
+
+    def test_save_and_load(self):
+        self.run_state.save(self.inventory_path)
+        run_state = RunState(containers=self.containers)
+        run_state.load(self.inventory_path)
+        # Everything loaded is an initial object
+        assert_equal({
+            'small': [('c1', 'small_000008', True),
+                      ('elsewhere', 'small_000009', True),
+                      ('c2', 'small_000010', True)],
+            'tiny': [('c1', 'tiny_%d' % 2 ** 33, True)],
+        }, dict((size_str, list(objs))
+                for size_str, objs in run_state.objs_by_size.iteritems()))
+        assert_equal([], list(run_state.cleanup_object_infos()))
+        assert_equal(2 ** 33 + 1, run_state.next_object_index())
+
+    def test_load_with_other_containers(self):
+        self.run_state.save(self.inventory_path)
+        run_state = RunState(containers=['c2', 'c1'])
+        run_state.load(self.inventory_path)
+        objs = run_state.objs_by_size['small']
+        assert_equal([('c1', 'small_000008', True),
+                      ('elsewhere', 'small_000009', True),
+                      ('c2', 'small_000010', True)], list(objs))
+        assert_equal([3, -1, 1], list(objs._codes))
+
+    def test_load_bad_version(self):
+        with open(self.inventory_path, 'wb') as inventory_file:
+            msgpack.pack({'version': 99}, inventory_file)
+        with assert_raises(ValueError):
+            RunState().load(self.inventory_path)
@@ -11,7 +11,7 @@ from cStringIO import StringIO
 from nose.tools import (assert_equal, assert_dict_equal, assert_is_instance,
                         assert_raises, assert_list_equal, assert_not_in,
                         assert_almost_equal, assert_true, assert_in,
-                        assert_greater)
+                        assert_greater, assert_not_equal)
 from exceptions import OSError
 from collections import Counter
 
@@ -111,6 +111,12 @@ class TestScenario(ScenarioFixture):
                      'version', 'bench_size_thresholds', 'delete_after']:
             assert_equal(getattr(unpacked, attr), getattr(self.scenario, attr))
 
+    def test_packb_unpackb_policy(self):
+        scenario = Scenario(self.stub_scenario_file, policy='gold')
+        unpacked = Scenario.unpackb(scenario.packb())
+        assert_equal('gold', unpacked.policy)
+        assert_equal(scenario.containers, unpacked.containers)
+
     def test_unpackb_backwards_compat(self):
         # Older ssbench didn't have a delete_after key in scenario data; make
         # sure we can still load those for reporting
@@ -203,6 +209,131 @@ class TestScenario(ScenarioFixture):
         assert_equal(101, scenario.operation_count)
         assert_equal(202, scenario.delete_after)
 
+    def test_rate_defaults(self):
+        assert_equal(None, self.scenario.rate)
+        assert_equal('poisson', self.scenario.arrival)
+        assert_equal(self.scenario.user_count, self.scenario.max_outstanding)
+
+    def test_rate_from_scenario_and_overrides(self):
+        self.scenario_dict['rate'] = 250
+        self.scenario_dict['arrival'] = 'constant'
+        self.scenario_dict['max_outstanding'] = 40
+        self.write_scenario_file()
+        scenario = Scenario(self.stub_scenario_file)
+        assert_equal(250.0, scenario.rate)
+        assert_equal('constant', scenario.arrival)
+        assert_equal(40, scenario.max_outstanding)
+
+        scenario = Scenario(self.stub_scenario_file, rate=12.5,
+                            arrival='poisson', max_outstanding=3)
+        assert_equal(12.5, scenario.rate)
+        assert_equal('poisson', scenario.arrival)
+        assert_equal(3, scenario.max_outstanding)
+
+        unpacked = Scenario.unpackb(scenario.packb())
+        for attr in ['rate', 'arrival', 'max_outstanding']:
+            assert_equal(getattr(unpacked, attr), getattr(scenario, attr))
+
+    def test_invalid_rate_settings(self):
+        with assert_raises(ValueError):
+            Scenario(self.stub_scenario_file, rate=0)
+        with assert_raises(ValueError):
+            Scenario(self.stub_scenario_file, rate=10, arrival='bursty')
+        with assert_raises(ValueError):
+            Scenario(self.stub_scenario_file, rate=10, max_outstanding=0)
+
+    def test_arrival_offsets_constant(self):
+        scenario = Scenario(self.stub_scenario_file, rate=4,
+                            arrival='constant')
+        offsets = scenario.arrival_offsets()
+        assert_list_equal([0.0, 0.25, 0.5, 0.75, 1.0],
+                          [offsets.next() for _ in xrange(5)])
+
+    def test_arrival_offsets_poisson(self):
+        scenario = Scenario(self.stub_scenario_file, rate=100)
+        offsets = scenario.arrival_offsets()
+        got = [offsets.next() for _ in xrange(20001)]
+        assert_equal(0.0, got[0])
+        assert_list_equal(got, sorted(got))
+        # 20000 gaps averaging 1/100 s each
+        assert_almost_equal(200.0, got[-1], delta=10.0)
+
+    def test_seed(self):
+        def _jobs(scenario):
+            return list(scenario.initial_jobs()) + list(scenario.bench_jobs())
+
+        scenario = Scenario(self.stub_scenario_file, seed=42)
+        assert_equal(42, scenario.seed)
+        assert_equal(_jobs(scenario),
+                     _jobs(Scenario(self.stub_scenario_file, seed=42)))
+        assert_not_equal(_jobs(Scenario(self.stub_scenario_file, seed=42)),
+                         _jobs(Scenario(self.stub_scenario_file, seed=43)))
+
+        # The seed may come from the scenario file; otherwise one is picked
+        self.scenario_dict['seed'] = 7
+        self.write_scenario_file()
+        assert_equal(7, Scenario(self.stub_scenario_file).seed)
+        assert_equal(8, Scenario(self.stub_scenario_file, seed=8).seed)
+        del self.scenario_dict['seed']
+        self.write_scenario_file()
+        assert_is_instance(Scenario(self.stub_scenario_file).seed, int)
+
+        # ...and it is saved with the scenario
+        assert_equal(42, Scenario.unpackb(scenario.packb()).seed)
+
+    def test_seeded_arrivals_dont_change_jobs(self):
+        closed = Scenario(self.stub_scenario_file, seed=42)
+        opened = Scenario(self.stub_scenario_file, seed=42, rate=100)
+        offsets = opened.arrival_offsets()
+        open_jobs = [job for _, job in zip(offsets, opened.bench_jobs())]
+        assert_equal(list(closed.bench_jobs()), open_jobs)
+        offsets = Scenario(self.stub_scenario_file, seed=42,
+                           rate=100).arrival_offsets()
+        assert_equal([offsets.next() for _ in xrange(10)],
+                     [o for o, _ in zip(opened.arrival_offsets(),
+                                        xrange(10))])
+
+    def test_seeded_bench_jobs_dont_need_initial_jobs(self):
+        # As when a run loads its initial objects' inventory instead
+        skipped = Scenario(self.stub_scenario_file, seed=42)
+        drawn = Scenario(self.stub_scenario_file, seed=42)
+        assert_true(list(drawn.initial_jobs()))
+        assert_equal(list(skipped.bench_jobs()), list(drawn.bench_jobs()))
+
+    def test_popularity(self):
+        assert_equal({}, self.scenario.popularity_by_size)
+        self.scenario_dict['popularity'] = 'uniform'
+        self.scenario_dict['sizes'][1]['popularity'] = {'model': 'zipf',
+                                                        's': 1.5}
+        self.write_scenario_file()
+        scenario = Scenario(self.stub_scenario_file)
+        assert_equal({'model': 'zipf', 's': 1.5},
+                     scenario.popularity_by_size['small'])
+        assert_equal('uniform', scenario.popularity_by_size['tiny'])
+
+        self.scenario_dict['sizes'][1]['popularity'] = 'viral'
+        self.write_scenario_file()
+        with assert_raises(ValueError):
+            Scenario(self.stub_scenario_file)
+
+    def test_payload(self):
+        assert_equal({}, self.scenario.payload_by_size)
+        self.scenario_dict['payload'] = 'compressible:2.5'
+        self.scenario_dict['sizes'][1]['payload'] = 'random'
+        self.scenario_dict['sizes'][2]['payload'] = 'constant'
+        self.write_scenario_file()
+        scenario = Scenario(self.stub_scenario_file)
+        assert_equal({'tiny': 'compressible:2.5', 'small': 'random',
+                      'red herring': 'compressible:2.5',
+                      'large': 'compressible:2.5'}, scenario.payload_by_size)
+
+        for payload in ('compressible', 'compressible:0.5', 'random:2',
+                        'noise'):
+            self.scenario_dict['sizes'][1]['payload'] = payload
+            self.write_scenario_file()
+            with assert_raises(ValueError):
+                Scenario(self.stub_scenario_file)
+
     def test_invalid_user_count(self):
         self.scenario_dict['user_count'] = -1
         self.write_scenario_file()
@@ -372,34 +503,36 @@ class TestScenario(ScenarioFixture):
         bench_job = self.scenario.bench_job('small', 0, 31)
         assert_in(bench_job['container'], self.scenario.containers)
         assert_equal('small_000031', bench_job['name'])
-        assert_equal(None, bench_job['block_size'])
-        assert_in(bench_job['size'], [199, 200])
-        assert_equal(ssbench.CREATE_OBJECT, bench_job['type'])
-
-    def test_bench_job_0_with_block_size(self):
-        self.scenario.block_size = 88
-        bench_job = self.scenario.bench_job('small', 0, 31)
-        assert_in(bench_job['container'], self.scenario.containers)
-        assert_equal('small_000031', bench_job['name'])
-        assert_equal(88, bench_job['block_size'])
         assert_in(bench_job['size'], [199, 200])
         assert_equal(ssbench.CREATE_OBJECT, bench_job['type'])
+        # Run-wide settings travel in the session, not in each job
+        assert_not_in('block_size', bench_job)
+        assert_not_in('delete_after', bench_job)
+        assert_not_in('head_first', bench_job)
+
+    def test_session_settings(self):
+        size_names = ['tiny', 'small', 'medium', 'red herring', 'large']
+        assert_dict_equal(dict(block_size=None, delete_after=None,
+                               policy=None, size_names=size_names,
+                               containers=self.scenario.containers,
+                               payload_by_size={}),
+                          self.scenario.session_settings())
+        self.scenario_dict['sizes'][0]['payload'] = 'random'
+        self.write_scenario_file()
+        scenario = Scenario(self.stub_scenario_file, block_size=88,
+                            delete_after=30, policy='gold')
+        assert_dict_equal(dict(block_size=88, delete_after=30,
+                               policy='gold', size_names=size_names,
+                               containers=scenario.containers,
+                               payload_by_size={'tiny': 'random'}),
+                          scenario.session_settings())
+        assert_equal('ssbench_000099_gold', scenario.containers[-1])
 
     def test_bench_job_1(self):
         bench_job = self.scenario.bench_job('large', 1, 492)
         assert_dict_equal(dict(
             type=ssbench.READ_OBJECT,
             size_str='large',
-            block_size=None,
-        ), bench_job)
-
-    def test_bench_job_1_with_block_size(self):
-        self.scenario.block_size = 99
-        bench_job = self.scenario.bench_job('large', 1, 492)
-        assert_dict_equal(dict(
-            type=ssbench.READ_OBJECT,
-            size_str='large',
-            block_size=99,
         ), bench_job)
 
     def test_bench_job_2(self):
@@ -408,17 +541,6 @@ class TestScenario(ScenarioFixture):
         assert_dict_equal(dict(
             type=ssbench.UPDATE_OBJECT,
             size_str='tiny',
-            block_size=None,
-        ), bench_job)
-
-    def test_bench_job_2_with_block_size(self):
-        self.scenario.block_size = 71
-        bench_job = self.scenario.bench_job('tiny', 2, 9329)
-        assert_in(bench_job.pop('size'), [99, 100])
-        assert_dict_equal(dict(
-            type=ssbench.UPDATE_OBJECT,
-            size_str='tiny',
-            block_size=71,
         ), bench_job)
 
     def test_bench_job_3(self):
@@ -428,14 +550,6 @@ class TestScenario(ScenarioFixture):
             size_str='huge',
         ), bench_job)
 
-    def test_bench_job_3_with_block_size(self):
-        self.scenario.block_size = 111
-        bench_job = self.scenario.bench_job('huge', 3, 30230)
-        assert_dict_equal(dict(
-            type=ssbench.DELETE_OBJECT,
-            size_str='huge',
-        ), bench_job)
-
     def test_initial_jobs(self):
         jobs = list(self.scenario.initial_jobs())
 
@@ -454,8 +568,6 @@ class TestScenario(ScenarioFixture):
             'size_str': 'tiny',
             'name': 'tiny_000001',
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }, jobs[0])
         assert_in(jobs[1].pop('size'), [199, 200])
         assert_dict_equal({
@@ -464,8 +576,6 @@ class TestScenario(ScenarioFixture):
             'size_str': 'small',
             'name': 'small_000001',
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }, jobs[1])
         assert_in(jobs[2].pop('size'), [299, 300])
         assert_dict_equal({
@@ -474,8 +584,6 @@ class TestScenario(ScenarioFixture):
             'size_str': 'medium',
             'name': 'medium_000001',
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }, jobs[2])
         assert_in(jobs[3].pop('size'), [399, 400])
         assert_dict_equal({
@@ -484,8 +592,6 @@ class TestScenario(ScenarioFixture):
             'size_str': 'large',
             'name': 'large_000001',
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }, jobs[3])
         # This scenario called for no initial "huge" files, so we wrapped back
         # to tiny (#2)
@@ -496,8 +602,6 @@ class TestScenario(ScenarioFixture):
             'size_str': 'tiny',
             'name': 'tiny_000002',
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }, jobs[4])
 
         size_counter = Counter([_['size_str'] for _ in jobs])
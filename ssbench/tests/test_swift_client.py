@@ -0,0 +1,114 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import socket
+import hashlib
+import mock
+from httplib import HTTPException
+from unittest import TestCase
+
+from geventhttpclient.httplib import HTTPResponse
+
+from ssbench import swift_client as client
+
+
+class TestDiscardBody(TestCase):
+    def setUp(self):
+        self.server, self.client_sock = socket.socketpair()
+
+    def tearDown(self):
+        self.server.close()
+        self.client_sock.close()
+
+    def _response(self, headers, body):
+        self.server.sendall('HTTP/1.1 200 OK\r\n%s\r\n%s' % (
+            ''.join('%s: %s\r\n' % header for header in headers), body))
+        return HTTPResponse(self.client_sock)
+
+    def test_discard_with_content_length(self):
+        resp = self._response([('Content-Length', 100000)], 'x' * 100000)
+        client._discard_body(resp, 4096)
+        self.assertTrue(resp.message_complete)
+        self.assertTrue(resp.isclosed())  # done with, but still connected
+        self.assertFalse(resp.should_close())
+        # The next response on the connection is intact
+        self.server.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        self.assertEqual('ok', HTTPResponse(self.client_sock).read())
+
+    def test_discard_cut_short(self):
+        resp = self._response([('Content-Length', 100000)], 'x' * 1000)
+        self.server.shutdown(socket.SHUT_WR)
+        with self.assertRaises(HTTPException):
+            client._discard_body(resp, 4096)
+
+    def test_discard_chunked(self):
+        resp = self._response([('Transfer-Encoding', 'chunked')],
+                              '5\r\nhello\r\n0\r\n\r\n')
+        client._discard_body(resp, 4096)
+        self.assertTrue(resp.message_complete)
+        self.assertEqual('', resp.read())
+
+    def test_discard_with_md5(self):
+        body = ''.join(chr(i % 251) for i in xrange(100000))
+        for headers in ([('Content-Length', len(body))],
+                        [('Transfer-Encoding', 'chunked')]):
+            if headers[0][0] == 'Transfer-Encoding':
+                sent = '%x\r\n%s\r\n0\r\n\r\n' % (len(body), body)
+            else:
+                sent = body
+            md5 = hashlib.md5()
+            resp = self._response(headers, sent)
+            self.assertEqual(len(body), client._discard_body(resp, 4096, md5))
+            self.assertEqual(hashlib.md5(body).hexdigest(), md5.hexdigest())
+
+
+class TestVerificationProblem(TestCase):
+    def _problem(self, headers, read=5, body='hello'):
+        resp = mock.Mock()
+        resp.getheader.side_effect = lambda name: dict(headers).get(name)
+        return client._verification_problem(
+            resp, read, hashlib.md5(body).hexdigest())
+
+    def test_good(self):
+        etag = hashlib.md5('hello').hexdigest()
+        self.assertEqual(None, self._problem([('content-length', '5'),
+                                              ('etag', etag)]))
+        self.assertEqual(None, self._problem([('etag', '"%s"' % etag)]))
+        self.assertEqual(None, self._problem([]))
+
+    def test_short(self):
+        self.assertEqual('got 4 bytes; expected 5',
+                         self._problem([('content-length', '5')], read=4))
+
+    def test_wrong_md5(self):
+        etag = hashlib.md5('hello').hexdigest()
+        self.assertTrue(self._problem([('etag', etag)], body='jello'))
+        # Large objects' ETags aren't their contents' MD5s
+        self.assertEqual(None, self._problem([
+            ('etag', etag), ('x-static-large-object', 'True')], body='jello'))
+
+
+class TestPhases(TestCase):
+    def test_phases(self):
+        conn = client.TimedHTTPConnection('127.0.0.1', 1)
+        self.assertEqual(
+            {'send_time': 1.0, 'wait_time': 2.0, 'body_time': 3.0},
+            client._phases(conn, 10.0, 11.0, 13.0, 16.0))
+
+    def test_connect_phases_reported_once(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        conn = client.TimedHTTPConnection(*listener.getsockname())
+        try:
+            conn.connect()
+            phases = client._phases(conn, 10.0, 11.0, 13.0, 16.0)
+            self.assertGreaterEqual(phases['connect_time'], 0.0)
+            self.assertNotIn('tls_time', phases)
+            # Later requests on the connection didn't connect
+            self.assertNotIn('connect_time',
+                             client._phases(conn, 10.0, 11.0, 13.0, 16.0))
+        finally:
+            conn.close()
+            listener.close()
@@ -0,0 +1,84 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+import os
+import shutil
+import mock
+import tempfile
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import ssbench.trace
+from ssbench.scenario import Scenario
+from ssbench.trace import Trace, write_trace
+
+from ssbench.tests.test_scenario import ScenarioFixture
+
+
+class TestTrace(ScenarioFixture):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.trace_path = os.path.join(self.temp_dir, 'some.trace')
+        super(TestTrace, self).setUp()
+        self.scenario_dict['operation_count'] = 500
+        self.write_scenario_file()
+
+    def tearDown(self):
+        super(TestTrace, self).tearDown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _scenario(self, **kwargs):
+        return Scenario(self.stub_scenario_file, seed=42, **kwargs)
+
+    def test_write_and_replay(self):
+        assert_equal((1400, 500),
+                     write_trace(self._scenario(), self.trace_path,
+                                 batch_size=64))
+
+        trace = Trace(self.trace_path)
+        assert_equal(42, trace.scenario.seed)
+        trace.check_scenario(self._scenario())
+        scenario = self._scenario()
+        assert_equal(list(scenario.initial_jobs()),
+                     list(trace.initial_jobs()))
+        assert_equal(list(scenario.bench_jobs()), list(trace.bench_jobs()))
+
+        # Can't go back
+        with assert_raises(ValueError):
+            list(trace.initial_jobs())
+
+    def test_bench_jobs_skips_initial_jobs(self):
+        write_trace(self._scenario(), self.trace_path)
+        scenario = self._scenario()
+        list(scenario.initial_jobs())
+
+        bench_jobs = list(Trace(self.trace_path, noop=True).bench_jobs())
+        assert_equal(500, len(bench_jobs))
+        assert_true(all(job.pop('noop') for job in bench_jobs))
+        assert_equal(list(scenario.bench_jobs()), bench_jobs)
+
+    def test_bench_jobs_run_seconds(self):
+        write_trace(self._scenario(), self.trace_path, batch_size=100)
+        trace = Trace(self.trace_path)
+        # Stops at the end of the batch during which time ran out
+        with mock.patch.object(ssbench.trace.time, 'time') as mock_time:
+            mock_time.side_effect = [1000.0, 1000.5, 1001.5]
+            assert_equal(200, len(list(trace.bench_jobs(run_seconds=1))))
+
+    def test_requires_operation_count(self):
+        with assert_raises(ValueError):
+            write_trace(self._scenario(run_seconds=10), self.trace_path)
+
+    def test_check_scenario(self):
+        write_trace(self._scenario(), self.trace_path)
+        trace = Trace(self.trace_path)
+        trace.check_scenario(self._scenario(user_count=7))
+        with assert_raises(ValueError):
+            trace.check_scenario(self._scenario(container_count=3))
+        with assert_raises(ValueError):
+            trace.check_scenario(self._scenario(policy='gold'))
+        del self.scenario_dict['sizes'][-1]
+        del self.scenario_dict['initial_files']['large']
+        self.write_scenario_file()
+        with assert_raises(ValueError):
+            trace.check_scenario(self._scenario())
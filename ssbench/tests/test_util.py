@@ -4,6 +4,10 @@
 
 import math
 import mock
+import hashlib
+import zlib
+import tarfile
+from StringIO import StringIO
 import ssbench.util
 from unittest import TestCase
 
@@ -60,3 +64,89 @@ class TestUtil(TestCase):
         mock_getaddrinfo.side_effect = test_tuples
         for expected in expected_values:
             self.assertEqual(ssbench.util.is_ipv6('host'), expected)
+
+    def test_alias_table(self):
+        table = ssbench.util.AliasTable(['a', 'b', 'c', 'd'], [5, 0, 1, 14])
+        # Evenly spaced draws pick each item in proportion to its weight
+        counts = dict.fromkeys('abcd', 0)
+        for k in xrange(20000):
+            counts[table.pick((k + 0.5) / 20000)] += 1
+        self.assertEqual({'a': 5000, 'b': 0, 'c': 1000, 'd': 14000}, counts)
+        self.assertEqual('d', table.pick(0.9999999999))
+
+        self.assertEqual('x', ssbench.util.AliasTable(['x'], [3]).pick(0.5))
+        with self.assertRaises(ValueError):
+            ssbench.util.AliasTable(['a', 'b'], [0, 0])
+        with self.assertRaises(ValueError):
+            ssbench.util.AliasTable([], [])
+
+    def test_payload(self):
+        contents = ssbench.util.payload('AB', 5)
+        self.assertEqual('ABABA', contents)
+        self.assertIs(contents, ssbench.util.payload('AB', 5))
+        self.assertEqual('A' * 889, ssbench.util.payload('A', 889))
+
+    def test_content_md5(self):
+        self.assertEqual(hashlib.md5('CDEABCDEAB').hexdigest(),
+                         ssbench.util.content_md5('ABCDE', 10, offset=2))
+        self.assertEqual(hashlib.md5('').hexdigest(),
+                         ssbench.util.content_md5('ABCDE', 0))
+
+    def test_payload_md5(self):
+        etag = ssbench.util.payload_md5('B', 200000)
+        self.assertEqual(hashlib.md5('B' * 200000).hexdigest(), etag)
+        self.assertIs(etag, ssbench.util.payload_md5('B', 200000))
+
+    def test_payload_pool_md5(self):
+        pool = ssbench.util.payload_pool('random')
+        offset = len(pool) - 1000  # (wraps around)
+        etag = ssbench.util.payload_pool_md5('random', 3000, offset)
+        self.assertEqual(hashlib.md5(pool[offset:] + pool[:2000]).hexdigest(),
+                         etag)
+        self.assertIs(etag,
+                      ssbench.util.payload_pool_md5('random', 3000, offset))
+
+    def test_tar_archive(self):
+        members = [('small_000001', 700, 'ABC', 1), ('a/b', 0, 'ABC', 0),
+                   ('x' * 150, 1024, 'A' * 2000, 1500)]
+        length, pieces = ssbench.util.tar_archive(members)
+        archive = ''.join(pieces)
+        self.assertEqual(length, len(archive))
+        tar = tarfile.open(fileobj=StringIO(archive))
+        self.assertEqual([member[:2] for member in members],
+                         [(info.name, info.size) for info in tar])
+        self.assertEqual('BC' + 'ABC' * 232 + 'AB',
+                         tar.extractfile('small_000001').read())
+        self.assertEqual('A' * 1024, tar.extractfile('x' * 150).read())
+
+    def test_parse_payload(self):
+        self.assertEqual(('constant', None),
+                         ssbench.util.parse_payload('constant'))
+        self.assertEqual(('random', None),
+                         ssbench.util.parse_payload('random'))
+        self.assertEqual(('compressible', 3.0),
+                         ssbench.util.parse_payload('compressible:3'))
+        for spec in ('compressible', 'compressible:x', 'compressible:0.9',
+                     'random:2', 'letters', None):
+            with self.assertRaises(ValueError):
+                ssbench.util.parse_payload(spec)
+
+    def test_payload_pool(self):
+        pool = ssbench.util.payload_pool('random', 2 ** 21)
+        self.assertEqual(2 ** 21, len(pool))
+        self.assertIs(pool, ssbench.util.payload_pool('random', 2 ** 21))
+        self.assertGreater(len(zlib.compress(pool[:])), 2 ** 21 * 0.99)
+
+        pool = ssbench.util.payload_pool('compressible:4', 2 ** 21)
+        self.assertEqual(2 ** 21, len(pool))
+        ratio = 2.0 ** 21 / len(zlib.compress(pool[:]))
+        self.assertGreater(ratio, 3.5)
+        self.assertLess(ratio, 4.1)
+
+        with self.assertRaises(ValueError):
+            ssbench.util.payload_pool('constant')
+
+    def test_monotonic(self):
+        before = ssbench.util.monotonic()
+        self.assertLessEqual(before, ssbench.util.monotonic())
+        self.assertIsInstance(before, float)
@@ -4,9 +4,13 @@
 
 import time
 import socket
+import hashlib
 from flexmock import flexmock
 import mock
-from nose.tools import assert_equal, assert_raises, assert_true
+import msgpack
+from nose.tools import (assert_equal, assert_raises, assert_true,
+                        assert_almost_equal)
+import gevent
 import gevent.queue
 import zmq.green as zmq
 from contextlib import contextmanager
@@ -33,11 +37,11 @@ class TestWorker(object):
         self.mock_context = flexmock()
         flexmock(zmq.Context).new_instances(self.mock_context).once
 
-        self.mock_work_pull = flexmock()
+        self.mock_work_dealer = flexmock()
         self.mock_context.should_receive('socket').with_args(
-            zmq.PULL,
-        ).and_return(self.mock_work_pull).once
-        self.mock_work_pull.should_receive('connect').with_args(
+            zmq.DEALER,
+        ).and_return(self.mock_work_dealer).once
+        self.mock_work_dealer.should_receive('connect').with_args(
             self.work_endpoint,
         ).once
 
@@ -83,6 +87,9 @@ class TestWorker(object):
         stub_url = 'http://someAuthUrl'
         self.mock_conn_pools_lock.should_receive('acquire').ordered.once
         mock_conn = flexmock()
+        # Connects in the background, not before the first job can run
+        mock_conn.should_receive('warm_up').with_args(
+            self.worker.concurrency).once
         flexmock(worker.ConnectionPool).new_instances(mock_conn).with_args(
             worker.ConnectionPool, client.http_connection,
             dict(url=stub_url, connect_timeout=3.142),
@@ -104,6 +111,17 @@ class TestWorker(object):
         self.worker.conn_pools[stub_url] = 'foobar'
         self.worker._create_connection_pool(stub_url)
 
+    def test_recv_jobs_sends_hello_while_idle(self):
+        hello = msgpack.dumps({'type': 'HELLO', 'worker_id': self.worker_id,
+                               'concurrency': self.worker.concurrency})
+        self.mock_work_dealer.should_receive('poll').with_args(
+            worker.Worker.HELLO_INTERVAL * 1000,
+        ).and_return(0).and_return(0).and_return(1).times(3)
+        self.mock_work_dealer.should_receive('send').with_args(hello).twice
+        self.mock_work_dealer.should_receive('recv').and_return('jobs').once
+
+        assert_equal('jobs', self.worker._recv_jobs())
+
     def test_put_open_connection_back(self):
         url = 'http://someAuthUrl'
 
@@ -130,16 +148,33 @@ class TestWorker(object):
 
         pool_mock = mock.Mock()
         pool_mock.get.return_value = (url, mock_closed_conn)
-        pool_mock.create.return_value = (None, None)
         self.mock_worker.conn_pools[url] = pool_mock
         with self.mock_worker.connection(url) as conn:
             conn[1].close
-        pool_mock.put.assert_called_with((None, None))
+        pool_mock.discard.assert_called_with((url, mock_closed_conn))
+        assert_equal(0, pool_mock.put.call_count)
+
+    def test_discard_broken_connection(self):
+        url = 'http://someAuthUrl'
+        mock_conn = mock.Mock()
+        mock_conn.sock.closed = False
+
+        pool_mock = mock.Mock()
+        pool_mock.get.return_value = (url, mock_conn)
+        self.mock_worker.conn_pools[url] = pool_mock
+        counts = {}
+        with self.mock_worker.connection(url, counts):
+            raise socket.error('broken')
+        pool_mock.get.assert_called_once_with(counts)
+        pool_mock.discard.assert_called_with((url, mock_conn))
+        assert_equal(0, pool_mock.put.call_count)
 
     def test_ignoring_http_responses_with_storage_url(self):
         call_info = {
             'container': 'someContainer',
             'name': 'someName',
+        }
+        self.worker.session = {
             'auth_kwargs': {
                 'storage_urls': ['someUrl'],
                 'token': 'someToken',
@@ -171,6 +206,7 @@ class TestWorker(object):
                                                   extra_key='extra value')
 
         assert_equal(got, self.stub_fn_return)
+        assert_equal('someUrl', got['storage_url'])
         assert_equal([((), dict(
             container='someContainer',
             name='someName',
@@ -179,6 +215,7 @@ class TestWorker(object):
             http_conn=mock_entry,
             extra_key='extra value',
         ))], self.stub_fn_calls)
+        assert_equal({'someUrl': 0}, self.worker.url_selector.in_flight)
 
     def test_ignoring_http_responses_with_no_auth_info(self):
         call_info = {
@@ -198,6 +235,8 @@ class TestWorker(object):
         call_info = {
             'container': 'someContainer',
             'name': 'someName',
+        }
+        self.worker.session = {
             'auth_kwargs': {
                 'auth_url': 'http://someAuthUrl',
                 'user': 'someUser',
@@ -209,7 +248,7 @@ class TestWorker(object):
         self.mock_token_data_lock.should_receive('acquire').ordered.once
         self.mock_token_data_lock.should_receive('release').ordered.once
         self.mock_client.should_receive('get_auth').with_args(
-            **call_info['auth_kwargs']
+            **self.worker.session['auth_kwargs']
         ).and_return(('someStorageUrl', 'someStorageToken')).once
         mock_pool = flexmock()
 
@@ -245,6 +284,8 @@ class TestWorker(object):
         call_info = {
             'container': 'someContainer',
             'name': 'someName',
+        }
+        self.worker.session = {
             'auth_kwargs': {
                 'auth_url': 'http://someAuthUrl',
                 'user': 'someUser',
@@ -253,7 +294,8 @@ class TestWorker(object):
             'connect_timeout': 3.142,
             'network_timeout': 2.718,
         }
-        token_key = self.worker._token_key(call_info['auth_kwargs'])
+        token_key = self.worker._token_key(
+            self.worker.session['auth_kwargs'])
 
         def _insert_auth():
             self.worker.token_data[token_key] = (['otherUrl'], 'otherToken')
@@ -303,6 +345,8 @@ class TestWorker(object):
         call_info = {
             'container': 'someContainer',
             'name': 'someName',
+        }
+        self.worker.session = {
             'auth_kwargs': {
                 'storage_urls': ['someUrl'],
                 'token': 'someToken',
@@ -318,14 +362,14 @@ class TestWorker(object):
         ).replace_with(_insert_mock_pool).once
 
         @contextmanager
-        def _get_mock_conn(url):
+        def _get_mock_conn(url, counts):
             yield self.worker.conn_pools[url]
 
         def _raise_401(**args):
             raise client.ClientException('oh noes!', http_status=401)
 
         self.mock_worker.should_receive('connection').with_args(
-            'someUrl'
+            'someUrl', {}
         ).replace_with(_get_mock_conn).times(self.max_retries + 1)
 
         with assert_raises(client.ClientException) as ce:
@@ -348,7 +392,6 @@ class TestWorker(object):
             'container': 'Picture',
             'name': object_name,
             'size': 99000,
-            'delete_after': None,
         }
         self.mock_worker.should_receive(
             'ignoring_http_responses'
@@ -373,6 +416,30 @@ class TestWorker(object):
         ).once
         self.mock_worker.handle_upload_object(object_info)
 
+    def test_handle_upload_object_verify(self):
+        object_info = {
+            'type': ssbench.CREATE_OBJECT,
+            'container': 'Picture',
+            'name': 'SP000001',
+            'size': 99000,
+        }
+        self.worker.session = {'verify': True}
+        self.mock_worker.should_receive(
+            'ignoring_http_responses'
+        ).with_args(
+            (503,), client.put_object, object_info,
+            content_length=99000,
+            chunk_size=worker.DEFAULT_BLOCK_SIZE,
+            contents='A' * worker.DEFAULT_BLOCK_SIZE,
+            headers={'etag': hashlib.md5('A' * 99000).hexdigest()},
+        ).and_return({
+            'x-swiftstack-last-byte-latency': 8.23283,
+            'x-trans-id': 'abcdef',
+            'retries': 0,
+        }).once
+        self.result_queue.should_receive('put').once
+        self.mock_worker.handle_upload_object(object_info)
+
     def test_handle_upload_object_head_first_present(self):
         object_name = '/foo/bar/SP000001'
         object_info = {
@@ -381,9 +448,8 @@ class TestWorker(object):
             'name': object_name,
             'size': 99000,
             'head_first': True,
-            'block_size': 889,
-            'delete_after': None,
         }
+        self.worker.session = {'block_size': 889}
         self.mock_worker.should_receive(
             'ignoring_http_responses'
         ).with_args(
@@ -409,7 +475,6 @@ class TestWorker(object):
             last_byte_latency=8.84328, trans_id='abcdef',
             completed_at=self.stub_time, retries=0)
         exp_put.pop('head_first')
-        exp_put.pop('block_size')
         self.result_queue.should_receive('put').with_args(exp_put).once
         self.mock_worker.handle_upload_object(object_info)
 
@@ -421,9 +486,8 @@ class TestWorker(object):
             'name': object_name,
             'size': 99000,
             'head_first': True,
-            'block_size': None,
-            'delete_after': None,
         }
+        self.worker.session = {'block_size': None, 'delete_after': None}
         self.mock_worker.should_receive(
             'ignoring_http_responses'
         ).with_args(
@@ -449,10 +513,48 @@ class TestWorker(object):
             last_byte_latency=4.493, trans_id='evn',
             completed_at=self.stub_time, retries=0)
         exp_put.pop('head_first')
-        exp_put.pop('block_size')
         self.result_queue.should_receive('put').with_args(exp_put).once
         self.mock_worker.handle_upload_object(object_info)
 
+    def test_handle_extract_archive(self):
+        archive_info = {
+            'type': ssbench.EXTRACT_ARCHIVE,
+            'container': 'Picture',
+            'objects': [['tiny', 'tiny_000001', 99], ['tiny', 'a b', 100],
+                        ['small', 'small_000001', 1990]],
+        }
+        self.worker.session = {'block_size': 889}
+        self.mock_worker.should_receive(
+            'ignoring_http_responses'
+        ).with_args(
+            (503,), client.extract_archive, archive_info,
+            members=[('tiny_000001', 99, 'A' * 889, 0),
+                     ('a b', 100, 'A' * 889, 0),
+                     ('small_000001', 1990, 'A' * 889, 0)],
+            chunk_size=889,
+        ).and_return({
+            'x-swiftstack-last-byte-latency': 8.23283,
+            'x-trans-id': 'abcdef',
+            'retries': 0,
+            'extract_result': {
+                'Number Files Created': 2,
+                'Errors': [['/v1/AUTH_a/Picture/a%20b', '400 Bad Request']],
+            },
+        }).once
+        self.result_queue.should_receive('put').with_args({
+            'type': ssbench.EXTRACT_ARCHIVE,
+            'container': 'Picture',
+            'objects': [['tiny', 'tiny_000001', 99],
+                        ['small', 'small_000001', 1990]],
+            'worker_id': self.worker_id,
+            'first_byte_latency': None,
+            'last_byte_latency': 8.23283,
+            'trans_id': 'abcdef',
+            'completed_at': self.stub_time,
+            'retries': 0,
+        }).once
+        self.mock_worker.handle_extract_archive(archive_info)
+
     def test_handle_delete_object(self):
         object_info = {
             'type': ssbench.DELETE_OBJECT,
@@ -483,7 +585,6 @@ class TestWorker(object):
             'container': 'Picture',
             'name': 'BestObjEvar',
             'size': 483213,
-            'delete_after': None,
         }
         self.mock_worker.should_receive(
             'ignoring_http_responses',
@@ -535,6 +636,61 @@ class TestWorker(object):
 
         self.mock_worker.handle_get_object(object_info)
 
+    def test_handle_get_object_verify(self):
+        object_info = {
+            'type': ssbench.READ_OBJECT,
+            'container': 'Document',
+            'name': 'SuperObject',
+        }
+        self.worker.session = {'verify': True}
+        self.mock_worker.should_receive(
+            'ignoring_http_responses',
+        ).with_args(
+            (404, 503), client.get_object, object_info,
+            resp_chunk_size=worker.DEFAULT_BLOCK_SIZE, verify=True,
+        ).and_raise(client.VerificationError('bad data')).once
+        results = []
+        self.result_queue.should_receive('put').replace_with(results.append)
+        self.mock_worker.handle_job(object_info)
+        assert_equal(1, len(results))
+        assert_true(results[0]['verify_failed'])
+        assert_true('VerificationError' in results[0]['exception'])
+
+    def _put_results_with_scheduled_at(self, scheduled_at):
+        results = []
+        self.result_queue.should_receive('put').replace_with(results.append)
+        self.mock_worker.put_results(
+            {'type': ssbench.READ_OBJECT, 'scheduled_at': scheduled_at},
+            first_byte_latency=0.5, last_byte_latency=2.0)
+        assert_equal(1, len(results))
+        assert_true('scheduled_at' not in results[0])
+        return results[0]
+
+    def test_put_results_corrected_latency(self):
+        # The job was meant to start 10s ago, but the request only took 2s
+        result = self._put_results_with_scheduled_at(self.stub_time - 10.0)
+        assert_equal(0.5, result['first_byte_latency'])
+        assert_equal(2.0, result['last_byte_latency'])
+        assert_almost_equal(8.5, result['corrected_first_byte_latency'],
+                            places=3)
+        assert_almost_equal(10.0, result['corrected_last_byte_latency'],
+                            places=3)
+
+    def test_put_results_corrected_latency_clock_skew(self):
+        # Corrected latencies never drop below the service latencies
+        result = self._put_results_with_scheduled_at(self.stub_time + 5.0)
+        assert_equal(0.5, result['corrected_first_byte_latency'])
+        assert_equal(2.0, result['corrected_last_byte_latency'])
+
+    def test_put_exception_results_not_corrected(self):
+        results = []
+        self.result_queue.should_receive('put').replace_with(results.append)
+        self.mock_worker.put_exception_results(
+            {'type': ssbench.READ_OBJECT, 'scheduled_at': self.stub_time},
+            Exception('oops'))
+        assert_true('scheduled_at' not in results[0])
+        assert_true('corrected_last_byte_latency' not in results[0])
+
     def test_dispatching_bad_job_type(self):
         info = {'type': 'zomg,what?', 'a': 1}
         assert_raises(NameError, self.mock_worker.handle_job, info)
@@ -564,6 +720,7 @@ class TestWorker(object):
         info = {'type': ssbench.READ_OBJECT, 'container': 'fun', 'a': 2}
         wrappedException = client.ClientException('slam bam')
         wrappedException.retries = 3
+        wrappedException.storage_url = 'http://proxy2/v1/AUTH_a'
         self.mock_worker.should_receive('handle_get_object').with_args(
             info).and_raise(wrappedException).once
         got = []
@@ -579,7 +736,7 @@ class TestWorker(object):
             add_dicts(
                 info, worker_id=self.worker_id, completed_at=self.stub_time,
                 exception=repr(wrappedException),
-                retries=3),
+                retries=3, storage_url='http://proxy2/v1/AUTH_a'),
             got[0])
 
     def test_dispatching_value_error_exception(self):
@@ -635,3 +792,86 @@ class TestWorker(object):
         self.mock_worker.should_receive(
             'handle_delete_object').with_args(info).once
         self.mock_worker.handle_job(info)
+
+
+class TestConnectionPool(object):
+    def setUp(self):
+        self.peers = []  # the "server" ends of our connections
+        self.pool = worker.ConnectionPool(self._connection,
+                                          {'url': 'http://someUrl'},
+                                          maxsize=2, max_idle=30)
+
+    def tearDown(self):
+        for sock in self.peers:
+            sock.close()
+
+    def _connection(self, url):
+        conn = mock.Mock()
+        conn.sock, peer = socket.socketpair()
+        self.peers.append(peer)
+        return url, conn
+
+    def test_lazy(self):
+        assert_equal([], self.peers)
+        counts = {}
+        conn = self.pool.get(counts)
+        assert_equal(1, len(self.peers))
+        self.pool.put(conn)
+        assert_true(self.pool.get(counts) is conn)
+        assert_equal({'conn_hits': 1, 'conn_misses': 1}, counts)
+        assert_equal(dict(counts, conn_reconnects=0), self.pool.counts)
+
+    def test_stale_connection_replaced(self):
+        conn = self.pool.get()
+        self.pool.put(conn)
+        self.peers[0].close()  # the server hung up
+        counts = {}
+        new_conn = self.pool.get(counts)
+        assert_true(new_conn is not conn)
+        conn[1].close.assert_called_once_with()
+        assert_equal({'conn_reconnects': 1}, counts)
+        assert_equal(1, self.pool.size)
+
+    def test_broken_connection_replaced(self):
+        conn = self.pool.get()
+        self.pool.discard(conn)
+        conn[1].close.assert_called_once_with()
+        counts = {}
+        self.pool.get(counts)
+        assert_equal({'conn_reconnects': 1}, counts)
+
+    def test_idle_connections_reaped(self):
+        with mock.patch.object(worker.time, 'time', return_value=100.0):
+            old_conn, conn = self.pool.get(), self.pool.get()
+            self.pool.put(old_conn)
+        with mock.patch.object(worker.time, 'time', return_value=125.0):
+            self.pool.put(conn)
+        with mock.patch.object(worker.time, 'time', return_value=131.0):
+            assert_true(self.pool.get() is conn)
+            self.pool.put(conn)
+        old_conn[1].close.assert_called_once_with()
+        assert_equal(1, self.pool.size)
+        assert_equal(0, self.pool.counts['conn_reconnects'])
+
+    def test_warm_up(self):
+        self.pool.warm_up(5, fan_out=2)
+        gevent.sleep(0.01)
+        # No more than maxsize, and the jobs get them for free
+        assert_equal(2, len(self.peers))
+        counts = {}
+        self.pool.get(counts)
+        self.pool.get(counts)
+        assert_equal({'conn_hits': 2}, counts)
+
+    def test_warm_up_connect_phases_dropped(self):
+        def connection(url):
+            url, conn = self._connection(url)
+            conn.connect_phases = {'connect': 0.5}
+            return url, conn
+        self.pool.factory = connection
+        self.pool.warm_up(1)
+        gevent.sleep(0.01)
+        assert_true('connect_phases' not in vars(self.pool.get()[1]))
+        # But a job which had to wait for a connection still sees it
+        conn = self.pool.get()[1]
+        assert_equal({'connect': 0.5}, vars(conn)['connect_phases'])
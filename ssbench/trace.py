@@ -0,0 +1,131 @@
+#
+#Copyright (c) 2012-2021, NVIDIA CORPORATION.
+#SPDX-License-Identifier: Apache-2.0
+
+"""
+Pre-generated job streams ("traces") for a scenario.
+
+A trace file holds the packed Scenario it was generated from, then the
+scenario's initial jobs, then its benchmark jobs.  Each phase is a series of
+Codec-encoded batches of jobs, ended by a msgpack nil.  Replaying a trace
+reads it through mmap, so very large traces needn't fit in memory, and every
+replay sends byte-for-byte the same jobs.
+"""
+
+import mmap
+import time
+import msgpack
+
+from ssbench.scenario import Scenario
+
+INITIAL, BENCH = 0, 1
+
+
+def write_trace(scenario, trace_path, batch_size=1000):
+    """
+    Writes out the initial and benchmark jobs of a scenario (which must have
+    an operation_count, not just run_seconds).
+
+    :scenario: The Scenario to generate jobs from
+    :trace_path: Path of the trace file to write
+    :batch_size: How many jobs go in each encoded batch
+    :returns: A tuple of (initial job count, benchmark job count)
+    """
+    if not scenario.operation_count:
+        raise ValueError('A trace requires an operation_count')
+    codec = scenario.codec()
+    end_of_phase = msgpack.packb(None)
+    counts = []
+    with open(trace_path, 'wb') as trace_file:
+        trace_file.write(scenario.packb())
+        for jobs in (scenario.initial_jobs(), scenario.bench_jobs()):
+            count = 0
+            batch = []
+            for job in jobs:
+                batch.append(job)
+                if len(batch) >= batch_size:
+                    trace_file.write(codec.encode(batch))
+                    count += len(batch)
+                    batch = []
+            if batch:
+                trace_file.write(codec.encode(batch))
+                count += len(batch)
+            trace_file.write(end_of_phase)
+            counts.append(count)
+    return tuple(counts)
+
+
+class Trace(object):
+    def __init__(self, trace_path, noop=False):
+        """
+        :trace_path: Path of a trace file from write_trace()
+        :noop: Mark every job as a no-op (see ScenarioNoop)
+        """
+        self.trace_path = trace_path
+        self.noop = noop
+        with open(trace_path, 'rb') as trace_file:
+            self._mmap = mmap.mmap(trace_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        self._unpacker = msgpack.Unpacker(file_like=self._mmap)
+        self.scenario = Scenario.unpackb(self._unpacker)
+        self._codec = self.scenario.codec()
+        self._phase = INITIAL
+
+    def check_scenario(self, scenario):
+        """
+        Makes sure jobs from this trace make sense for a run of the given
+        scenario: they must use its size names and containers.
+
+        :raises ValueError: if they don't
+        """
+        if self.scenario.sizes_by_name.keys() != \
+                scenario.sizes_by_name.keys():
+            raise ValueError('Trace %s has sizes %s; the scenario has %s' % (
+                self.trace_path, ', '.join(self.scenario.sizes_by_name),
+                ', '.join(scenario.sizes_by_name)))
+        if self.scenario.containers != scenario.containers:
+            raise ValueError(
+                'Trace %s uses %d containers named %s_*; the scenario has %d '
+                'named %s_*' % (
+                    self.trace_path, len(self.scenario.containers),
+                    self.scenario.containers[0].rpartition('_')[0],
+                    len(scenario.containers),
+                    scenario.containers[0].rpartition('_')[0]))
+
+    def initial_jobs(self):
+        """
+        Generator for the trace's initial jobs (see
+        Scenario.initial_jobs()).
+        """
+        return self._jobs(INITIAL)
+
+    def bench_jobs(self, run_seconds=None):
+        """
+        Generator for the trace's benchmark jobs (see Scenario.bench_jobs()).
+        Any initial jobs not yet read are skipped.
+
+        :run_seconds: If set, stop after about this many seconds, even if the
+                      trace has more jobs
+        """
+        return self._jobs(BENCH, run_seconds)
+
+    def _jobs(self, phase, run_seconds=None):
+        if self._phase > phase:
+            raise ValueError('Trace %s has already been read past that '
+                             'phase' % self.trace_path)
+        while self._phase < phase:
+            for message in self._unpacker:
+                if message is None:
+                    break
+            self._phase += 1
+        stop_at = time.time() + run_seconds if run_seconds else None
+        for message in self._unpacker:
+            if message is None:
+                break
+            for job in self._codec.decode_message(message):
+                if self.noop:
+                    job['noop'] = True
+                yield job
+            if stop_at and time.time() >= stop_at:
+                break
+        self._phase += 1
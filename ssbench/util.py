@@ -4,8 +4,62 @@
 
 import math
 import os
-import resource
+import sys
+import ctypes
+import ctypes.util
+import hashlib
+import mmap
+import time
 import socket
+import tarfile
+import resource
+
+
+# Bytes of random data to take non-constant payloads from
+PAYLOAD_POOL_SIZE = 64 * 2 ** 20
+
+# Objects taken from a payload pool start at one of this many evenly spaced
+# places in it, so their MD5s can be cached
+PAYLOAD_POOL_OFFSETS = 256
+
+# Most (pattern, size) MD5s payload_md5() (or (spec, size, offset) MD5s
+# payload_pool_md5()) keeps around at once
+PAYLOAD_MD5_CACHE_SIZE = 2 ** 16
+
+
+def _linux_monotonic():
+    """
+    :returns: A monotonic() which calls clock_gettime(CLOCK_MONOTONIC)
+              directly, or None if we can't
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                            ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1  # (from <linux/time.h>)
+
+    def monotonic():
+        now = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return now.tv_sec + now.tv_nsec * 1e-9
+    return monotonic
+
+
+# Seconds since some fixed point, which never go backwards (as time.time() can
+# when the clock is set); for timing the phases of a request.  Python 2 has no
+# time.monotonic(), so outside Linux this is just time.time().
+monotonic = _linux_monotonic() or time.time
 
 
 def add_dicts(*args, **kwargs):
@@ -21,6 +75,166 @@ def add_dicts(*args, **kwargs):
     return result
 
 
+def token_key(auth_kwargs):
+    """
+    :returns: A string identifying a set of credentials, for caching the
+              storage URLs and token they get
+    """
+    parts = []
+    for key in sorted(auth_kwargs.keys()):
+        value = auth_kwargs.get(key, '') or ''
+        if isinstance(value, dict):
+            parts.append(token_key(value))
+        elif isinstance(value, list):
+            parts.extend(value)
+        else:
+            parts.append(value)
+    return '\x01'.join(map(str, parts))
+
+
+def correct_latencies(result):
+    """
+    If a job's result carries the job's "scheduled_at" time (when the master
+    intended it to start), adds first- and last-byte latencies measured from
+    that time instead of from when the request actually started, so time a
+    job spent queued behind a stalled server is not omitted.  These can
+    never be less than the plain latencies (which guards against clock skew
+    between the master and worker hosts).
+
+    :returns: The result, without "scheduled_at"
+    """
+    scheduled_at = result.pop('scheduled_at', None)
+    if scheduled_at is not None and \
+            result.get('last_byte_latency') is not None:
+        queued = max(result['completed_at'] - scheduled_at
+                     - result['last_byte_latency'], 0.0)
+        result['corrected_last_byte_latency'] = \
+            result['last_byte_latency'] + queued
+        if result.get('first_byte_latency') is not None:
+            result['corrected_first_byte_latency'] = \
+                result['first_byte_latency'] + queued
+    return result
+
+
+_payloads = {}
+
+
+def payload(pattern, size):
+    """
+    :returns: A string of size bytes of pattern, repeated.  It's only built
+              the first time it's asked for; after that, everyone gets the
+              same string.
+    """
+    contents = _payloads.get((pattern, size))
+    if contents is None:
+        contents = _payloads[pattern, size] = \
+            (pattern * (size // len(pattern) + 1))[:size]
+    return contents
+
+
+def content_md5(contents, size, offset=0):
+    """
+    :returns: The hex MD5 of size bytes of contents, starting at offset and
+              wrapping around at its end (i.e. of what put_object() sends)
+    """
+    md5 = hashlib.md5()
+    while size > 0:
+        length = min(size, len(contents) - offset)
+        md5.update(buffer(contents, offset, length))
+        size -= length
+        offset = 0
+    return md5.hexdigest()
+
+
+_payload_md5s = {}
+
+
+def payload_md5(pattern, size):
+    """
+    :returns: The hex MD5 of size bytes of pattern, repeated.  It's only
+              computed the first time it's asked for (unless a great many
+              other sizes have been asked for since).
+    """
+    etag = _payload_md5s.get((pattern, size))
+    if etag is None:
+        if len(_payload_md5s) >= PAYLOAD_MD5_CACHE_SIZE:
+            _payload_md5s.clear()
+        block_size = 2 ** 16 // len(pattern) * len(pattern)
+        etag = _payload_md5s[pattern, size] = content_md5(
+            payload(pattern, block_size), size)
+    return etag
+
+
+def parse_payload(spec):
+    """
+    Parses a payload spec: "constant" (one letter, repeated), "random", or
+    "compressible:RATIO" (random, but compressing to about 1/RATIO of its
+    size; RATIO >= 1).
+
+    :returns: A tuple of (kind, ratio), where ratio is None unless kind is
+              "compressible"
+    :raises ValueError: if the spec is none of those
+    """
+    kind, _, ratio = str(spec).partition(':')
+    if kind in ('constant', 'random') and not ratio:
+        return kind, None
+    if kind == 'compressible':
+        try:
+            ratio = float(ratio)
+        except ValueError:
+            ratio = 0
+        if ratio >= 1:
+            return kind, ratio
+    raise ValueError('payload must be "constant", "random", or '
+                     '"compressible:RATIO" (with RATIO >= 1), not %r' %
+                     (spec,))
+
+
+_payload_pools = {}
+
+
+def payload_pool(spec, size=PAYLOAD_POOL_SIZE):
+    """
+    :spec: A "random" or "compressible:RATIO" payload spec (see
+           parse_payload())
+    :returns: An anonymous mmap of size bytes of random data, or, for a
+              compressible spec, of 4 KiB blocks which each start with random
+              data and are padded with zeros.  It's only built the first time
+              it's asked for; after that, everyone gets the same one.
+    """
+    pool = _payload_pools.get((spec, size))
+    if pool is None:
+        kind, ratio = parse_payload(spec)
+        if kind == 'constant':
+            raise ValueError('constant payloads have no pool')
+        pool = mmap.mmap(-1, size)  # (zero-filled)
+        step = 2 ** 20 if ratio is None else 4096
+        random_length = step if ratio is None else int(round(step / ratio))
+        for start in xrange(0, size, step):
+            length = min(random_length, size - start)
+            pool[start:start + length] = os.urandom(length)
+        _payload_pools[spec, size] = pool
+    return pool
+
+
+_payload_pool_md5s = {}
+
+
+def payload_pool_md5(spec, size, offset):
+    """
+    :returns: The hex MD5 of size bytes of spec's payload pool, starting at
+              offset (see content_md5()).  It's only computed the first time
+              it's asked for (unless a great many others have been since).
+    """
+    etag = _payload_pool_md5s.get((spec, size, offset))
+    if etag is None:
+        if len(_payload_pool_md5s) >= PAYLOAD_MD5_CACHE_SIZE:
+            _payload_pool_md5s.clear()
+        etag = _payload_pool_md5s[spec, size, offset] = content_md5(
+            payload_pool(spec), size, offset)
+    return etag
+
+
 def raise_file_descriptor_limit():
     _, hard_nofile = resource.getrlimit(resource.RLIMIT_NOFILE)
     nofile_target = hard_nofile
@@ -81,3 +295,87 @@ def median(iterable):
         right_median = sorted_list[len(sorted_list) / 2]
         left_median = sorted_list[len(sorted_list) / 2 - 1]
         return (right_median + left_median) / 2.0
+
+
+class AliasTable(object):
+    """
+    Picks one of a list of items, with the given relative weights, in constant
+    time (Walker's alias method).  Building the table is O(n), and each pick
+    takes one uniform random number and at most two list lookups, however
+    many items there are.
+    """
+
+    def __init__(self, items, weights):
+        """
+        :items: The things to pick from
+        :weights: Relative weight of each item (non-negative, not all zero)
+        """
+        total = float(sum(weights))
+        if len(items) != len(weights) or not items or total <= 0:
+            raise ValueError('AliasTable needs items with positive total '
+                             'weight')
+        n = len(items)
+        self.items = list(items)
+        self.probs = [1.0] * n
+        self.aliases = range(n)
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.probs[s] = scaled[s]
+            self.aliases[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Anything left over is only off from 1.0 by rounding, so keeps its
+        # probability of 1.0.
+
+    def pick(self, r):
+        """
+        :r: A uniform random number on [0, 1)
+        :returns: One of the items
+        """
+        r *= len(self.items)
+        i = int(r)
+        if r - i < self.probs[i]:
+            return self.items[i]
+        return self.items[self.aliases[i]]
+
+
+def tar_archive(members):
+    """
+    Generates a tar archive of files whose contents are taken from larger
+    strings (or buffers), a piece at a time, so the archive is never all in
+    memory.
+
+    :members: A list of (name, size, contents, offset) tuples, one per file,
+              whose contents start at offset in contents, wrapping around at
+              its end
+    :returns: A tuple of (the archive's length, a generator of its pieces)
+    """
+    now = int(time.time())
+    headers = []
+    length = 2 * tarfile.BLOCKSIZE  # (end-of-archive marker)
+    for name, size, _, _ in members:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = now
+        headers.append(info.tobuf())
+        length += len(headers[-1]) + \
+            -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def pieces():
+        for header, (_, size, contents, offset) in zip(headers, members):
+            yield header
+            left = size
+            while left > 0:
+                piece = contents[offset:offset + left]
+                yield piece
+                left -= len(piece)
+                offset = 0
+            if size % tarfile.BLOCKSIZE:
+                yield tarfile.NUL * (
+                    tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+    return length, pieces()
@@ -17,38 +17,177 @@ gevent.monkey.patch_time()
 
 import os
 import time
+import select
 import socket
 import msgpack
 import logging
-import traceback
 import zmq.green as zmq
 from httplib import CannotSendRequest
 from contextlib import contextmanager
 from geventhttpclient.response import HTTPConnectionClosed
 
-from ssbench.importer import random
-from ssbench.util import add_dicts, raise_file_descriptor_limit
+from ssbench.codec import Codec
+from ssbench.engine import Engine, UrlSelector
+from ssbench.engine import DEFAULT_BLOCK_SIZE  # noqa (re-exported)
+from ssbench.util import token_key
+from ssbench.util import raise_file_descriptor_limit
 from ssbench.util import is_ipv6
 import ssbench.swift_client as client
 
 
-DEFAULT_BLOCK_SIZE = 2 ** 16  # 65536
-
-
-class ConnectionPool(gevent.queue.Queue):
+# Idle connections older than this (in seconds) are closed instead of reused,
+# before the server's own idle timeout can close them under us.
+DEFAULT_MAX_IDLE = 30
+# How many connections a pool opens at once while warming up
+WARM_UP_FAN_OUT = 16
+
+
+def _close(conn):
+    try:
+        conn[1].close()
+    except Exception:
+        pass
+
+
+def _is_stale(conn):
+    """
+    :returns: True if an idle connection can't be reused: its socket is
+              closed, or readable (so the server hung up, or sent something
+              we never asked for)
+    """
+    sock = conn[1].sock
+    if sock is None or sock.closed:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class ConnectionPool(object):
+    """
+    Up to maxsize connections to one storage URL, each opened when it's first
+    needed (or ahead of time, by warm_up()).  Idle connections are reused
+    newest first, so any which go unneeded for max_idle seconds are closed.
+    Idle connections which have gone stale are replaced.
+
+    The pool counts connections reused ("conn_hits"), newly opened
+    ("conn_misses") and opened to replace a stale or broken one
+    ("conn_reconnects"); get() adds to a given counts dict too.
+    """
     def __init__(self, factory, factory_kwargs, maxsize=1,
-                 network_timeout=client.DEFAULT_NETWORK_TIMEOUT):
+                 network_timeout=client.DEFAULT_NETWORK_TIMEOUT,
+                 max_idle=DEFAULT_MAX_IDLE):
         self.factory = factory
         self.factory_kwargs = factory_kwargs
         self.network_timeout = network_timeout
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+
+        # One per connection in use (or being opened)
+        self.slots = gevent.coros.BoundedSemaphore(maxsize)
+        self.idle = []  # [(conn, idle since), ...], oldest first
+        self.size = 0  # connections open (or being opened)
+        self.lost = 0  # stale or broken connections not yet replaced
+        self.counts = dict(conn_hits=0, conn_misses=0, conn_reconnects=0)
+
+    def _count(self, key, counts):
+        self.counts[key] += 1
+        if counts is not None:
+            counts[key] = counts.get(key, 0) + 1
+
+    def get(self, counts=None):
+        """
+        :returns: An idle connection, or a new one if there isn't one; blocks
+                  while maxsize connections are in use.  Give every one back
+                  with put() or discard().
+        """
+        self.slots.acquire()
+        try:
+            self._reap()
+            while self.idle:
+                conn, _ = self.idle.pop()
+                if not _is_stale(conn):
+                    self._count('conn_hits', counts)
+                    return conn
+                _close(conn)
+                self.size -= 1
+                self.lost += 1
+            reconnect = self.lost > 0
+            self.size += 1
+            try:
+                conn = self.create(is_initial=not reconnect)
+            except BaseException:
+                self.size -= 1
+                raise
+            if reconnect:
+                self.lost -= 1
+                self._count('conn_reconnects', counts)
+            else:
+                self._count('conn_misses', counts)
+            return conn
+        except BaseException:
+            self.slots.release()
+            raise
 
-        gevent.queue.Queue.__init__(self, maxsize)
+    def put(self, conn):
+        """
+        Gives back a connection, from get(), which may be reused.
+        """
+        self.idle.append((conn, time.time()))
+        self.slots.release()
 
-        logging.info('Initializing ConnectionPool to %s with %d '
+    def discard(self, conn):
+        """
+        Gives back a broken connection, from get(), and closes it.
+        """
+        _close(conn)
+        self.size -= 1
+        self.lost += 1
+        self.slots.release()
+
+    def _reap(self):
+        oldest = time.time() - self.max_idle
+        while self.idle and self.idle[0][1] < oldest:
+            _close(self.idle.pop(0)[0])
+            self.size -= 1
+
+    def warm_up(self, count, fan_out=WARM_UP_FAN_OUT):
+        """
+        Starts opening up to count connections in the background, fan_out at
+        a time, without making anyone wait for them.
+        """
+        gevent.spawn(self._warm_up, count, fan_out)
+
+    def _warm_up(self, count, fan_out):
+        logging.info('Warming up ConnectionPool to %s with up to %d '
                      'connections...',
-                     factory_kwargs.get('url', 'UNKNOWN'), maxsize)
-        for _ in xrange(maxsize):
-            self.put(self.create(is_initial=True))  # pylint: disable=E1101
+                     self.factory_kwargs.get('url', 'UNKNOWN'), count)
+        group = gevent.pool.Pool(fan_out)
+        for _ in xrange(count):
+            if self.size >= self.maxsize:
+                break
+            group.spawn(self._warm_one)
+        group.join()
+
+    def _warm_one(self):
+        # Only while it wouldn't take a slot someone's waiting for
+        if not self.slots.acquire(blocking=False):
+            return
+        if self.size >= self.maxsize:
+            self.slots.release()
+            return
+        self.size += 1
+        try:
+            conn = self.create(is_initial=True)
+        except Exception as e:
+            self.size -= 1
+            self.slots.release()
+            logging.warning('ConnectionPool warm-up failed: %r', e)
+            return
+        # No job waited for this one to connect, so don't charge one for it
+        vars(conn[1]).pop('connect_phases', None)
+        self.put(conn)
 
     def create(self, is_initial=False):
         if not is_initial:
@@ -73,7 +212,7 @@ class ConnectionPool(gevent.queue.Queue):
         return conn
 
 
-class Worker(object):
+class Worker(Engine):
     def __init__(self, zmq_host, zmq_work_port, zmq_results_port, worker_id,
                  max_retries, profile_count=0, concurrency=256, batch_size=1):
         work_endpoint = 'tcp://%s:%d' % (zmq_host, zmq_work_port)
@@ -91,11 +230,18 @@ class Worker(object):
         self.conn_pools = {}  # hashed by storage_url
         self.token_data = {}
         self.token_data_lock = gevent.coros.Semaphore(1)
+        # Settings shared by all jobs of the current run (auth_kwargs,
+        # timeouts, block_size, etc.), as last sent by the master
+        self.session = {}
+        self.url_selector = UrlSelector()
+        self.codec = Codec()
 
         self.context = zmq.Context()
-        self.work_pull = self.context.socket(zmq.PULL)
-        self.work_pull.ipv6 = ipv6
-        self.work_pull.connect(work_endpoint)
+        self.work_dealer = self.context.socket(zmq.DEALER)
+        self.work_dealer.ipv6 = ipv6
+        self.work_dealer.identity = 'ssbench-worker-%d-%d' % (worker_id,
+                                                              os.getpid())
+        self.work_dealer.connect(work_endpoint)
         self.results_push = self.context.socket(zmq.PUSH)
         self.results_push.ipv6 = ipv6
         self.results_push.connect(results_endpoint)
@@ -103,31 +249,36 @@ class Worker(object):
         self.result_queue = gevent.queue.Queue()
 
     @contextmanager
-    def connection(self, storage_url):
+    def connection(self, storage_url, counts=None):
         pool = self.conn_pools[storage_url]
+        hc = pool.get(counts)
+        broken = False
         try:
-            hc = pool.get()
-            try:
-                yield hc
-            except (CannotSendRequest, HTTPConnectionClosed,
-                    socket.timeout, socket.error) as e:
-                logging.debug("@connection hit %r...", e)
-                try:
-                    hc[1].close()
-                except Exception:
-                    pass
-                hc = pool.create()
+            yield hc
+        except (CannotSendRequest, HTTPConnectionClosed,
+                socket.timeout, socket.error) as e:
+            logging.debug("@connection hit %r...", e)
+            broken = True
         finally:
-            if hc and hc[1] and not hc[1].sock.closed:
-                pool.put(hc)
+            if broken or not hc[1].sock or hc[1].sock.closed:
+                pool.discard(hc)
             else:
-                pool.put(pool.create())
+                pool.put(hc)
+
+    def send_hello(self):
+        self.work_dealer.send(msgpack.dumps(self.hello()))
+
+    def _recv_jobs(self):
+        while not self.work_dealer.poll(self.HELLO_INTERVAL * 1000):
+            self.send_hello()
+        return self.work_dealer.recv()
 
     def go(self):
         logging.debug('Worker %s starting...', self.worker_id)
         gevent.spawn(self._result_writer)
         pool = gevent.pool.Pool(self.concurrency)
-        jobs = self.work_pull.recv()
+        self.send_hello()
+        jobs = self._recv_jobs()
         if self.profile_count:
             import cProfile
             prof = cProfile.Profile()
@@ -135,14 +286,14 @@ class Worker(object):
         gotten = 1
         self.spawned = 0
         while jobs:
-            job_data = msgpack.loads(jobs, use_list=False)
+            job_data = self.codec.decode(jobs)
             for job_datum in job_data:
                 try:
                     if 'container' in job_datum:
                         logging.debug('WORK: %13s %s/%-17s',
                                       job_datum['type'],
                                       job_datum['container'],
-                                      job_datum['name'])
+                                      job_datum.get('name', ''))
                     else:
                         logging.debug('CMD: %13s', job_datum['type'])
                 except Exception as e:
@@ -151,11 +302,14 @@ class Worker(object):
                     self.put_exception_results({'job_datum': job_datum}, e)
                     continue
 
+                if job_datum['type'] == 'SESSION':
+                    self.start_session(job_datum['session'])
+                    continue
                 if job_datum['type'] == 'SUICIDE':
-                    logging.info('Got SUICIDE; closing sockets and exiting.')
-                    self.work_pull.close()
-                    self.results_push.close()
-                    os._exit(88)
+                    self.suicide()
+                if job_datum['type'] == 'FLUSH':
+                    self.flush_summary()
+                    continue
                 pool.spawn(self.handle_job, job_datum)
                 self.spawned += 1
                 if self.profile_count and gotten >= self.profile_count:
@@ -166,7 +320,7 @@ class Worker(object):
                                  prof_output_path)
                     self.profile_count = None
                 gotten += 1
-            jobs = self.work_pull.recv()
+            jobs = self._recv_jobs()
 
     def _result_writer(self):
         while True:
@@ -186,7 +340,7 @@ class Worker(object):
                                 'socket!')
                 break
             self.spawned -= len(result_q)
-            self.results_push.send(msgpack.dumps(result_q))
+            self.results_push.send(self.codec.encode(result_q))
 
     def handle_job(self, job_data):
         # Dispatch type to a handler, if possible
@@ -212,58 +366,54 @@ class Worker(object):
         self.conn_pools_lock.acquire()
         try:
             if storage_url not in self.conn_pools:
-                self.conn_pools[storage_url] = ConnectionPool(
+                pool = ConnectionPool(
                     client.http_connection,
                     dict(url=storage_url, connect_timeout=connect_timeout),
                     self.concurrency,
                     network_timeout=network_timeout)
+                pool.warm_up(self.concurrency)
+                self.conn_pools[storage_url] = pool
         finally:
             self.conn_pools_lock.release()
 
     def _token_key(self, auth_kwargs):
-        parts = []
-        for key in sorted(auth_kwargs.keys()):
-            value = auth_kwargs.get(key, '') or ''
-            if isinstance(value, dict):
-                parts.append(self._token_key(value))
-            elif isinstance(value, list):
-                parts.extend(value)
-            else:
-                parts.append(value)
-        return '\x01'.join(map(str, parts))
+        return token_key(auth_kwargs)
 
     def ignoring_http_responses(self, statuses, fn, call_info, **extra_keys):
         if 401 not in statuses:
             statuses += (401,)
         args = dict(
             container=call_info['container'],
-            name=call_info['name'],
+            name=call_info.get('name'),
         )
         args.update(extra_keys)
 
-        if 'auth_kwargs' not in call_info:
-            raise ValueError('Got benchmark job without "auth_kwargs" key!')
+        auth_kwargs = self.session.get('auth_kwargs')
+        if auth_kwargs is None:
+            raise ValueError('Got benchmark job without a session with '
+                             '"auth_kwargs"!')
 
         tries = 0
+        counts = {}  # of the ConnectionPool's hits, misses and reconnects
         while True:
             # Make sure we've got a current storage_url/token
-            if call_info['auth_kwargs'].get('token', None):
+            if auth_kwargs.get('token', None):
                 token_key = None
-                args['url'] = random.choice(
-                    call_info['auth_kwargs']['storage_urls'])
-                args['token'] = call_info['auth_kwargs']['token']
+                args['url'] = self.url_selector.choose(
+                    auth_kwargs['storage_urls'])
+                args['token'] = auth_kwargs['token']
             else:
-                token_key = self._token_key(call_info['auth_kwargs'])
+                token_key = self._token_key(auth_kwargs)
                 if token_key not in self.token_data:
                     self.token_data_lock.acquire()
                     collided = False
                     try:
                         if token_key not in self.token_data:
                             logging.debug('Authenticating with %r',
-                                          call_info['auth_kwargs'])
+                                          auth_kwargs)
                             storage_url, token = client.get_auth(
-                                **call_info['auth_kwargs'])
-                            override_urls = call_info['auth_kwargs'].get(
+                                **auth_kwargs)
+                            override_urls = auth_kwargs.get(
                                 'storage_urls', None)
                             if override_urls:
                                 logging.debug(
@@ -283,22 +433,28 @@ class Worker(object):
                         logging.debug('Collided on re-auth; sleeping 0.005')
                         gevent.sleep(0.005)
                 storage_urls, args['token'] = self.token_data[token_key]
-                args['url'] = random.choice(storage_urls)
+                args['url'] = self.url_selector.choose(storage_urls)
 
             # Check for connection pool initialization (protected by a
             # semaphore)
             if args['url'] not in self.conn_pools:
                 self._create_connection_pool(
                     args['url'],
-                    call_info.get('connect_timeout',
-                                  client.DEFAULT_CONNECT_TIMEOUT),
-                    call_info.get('network_timeout',
-                                  client.DEFAULT_NETWORK_TIMEOUT))
+                    self.session.get('connect_timeout',
+                                     client.DEFAULT_CONNECT_TIMEOUT),
+                    self.session.get('network_timeout',
+                                     client.DEFAULT_NETWORK_TIMEOUT))
 
             try:
                 fn_results = None
-                with self.connection(args['url']) as conn:
-                    fn_results = fn(http_conn=conn, **args)
+                self.url_selector.started(args['url'])
+                started_at = time.time()
+                try:
+                    with self.connection(args['url'], counts) as conn:
+                        fn_results = fn(http_conn=conn, **args)
+                finally:
+                    self.url_selector.finished(args['url'],
+                                               time.time() - started_at)
                 if fn_results:
                     if tries != 0:
                         logging.info('%r succeeded after %d tries',
@@ -309,6 +465,7 @@ class Worker(object):
                     e = Exception('No fn_results for %r after %d retires' % (
                         fn, self.max_retries))
                     e.retries = tries - 1
+                    e.storage_url = args['url']
                     raise e
             # XXX The name of this method does not suggest that it
             # will also retry on socket-level errors. Regardless,
@@ -325,6 +482,7 @@ class Worker(object):
                 tries += 1
                 if tries > self.max_retries:
                     error.retries = tries - 1
+                    error.storage_url = args['url']
                     raise error
             except client.ClientException as error:
                 tries += 1
@@ -347,57 +505,15 @@ class Worker(object):
                     logging.debug("Retrying an error: %r", error)
                 else:
                     error.retries = tries - 1
+                    error.storage_url = args['url']
                     raise error
         fn_results['retries'] = tries
+        fn_results['storage_url'] = args['url']
+        fn_results.update(counts)
         return fn_results
 
-    def put_results(self, *args, **kwargs):
-        """
-        Put work result into stats queue.  Given *args and **kwargs are
-        combined per add_dicts().  This worker's "ID" and the time of
-        completion are included in the results.
-
-        :*args: An optional list of dicts (to be combined via add_dicts())
-        :**kwargs: An optional set of key/value pairs (to be combined via
-                   add_dicts())
-        :returns: (nothing)
-        """
-        self.result_queue.put(add_dicts(*args,
-                                        completed_at=time.time(),
-                                        worker_id=self.worker_id,
-                                        **kwargs))
-
-    def put_exception_results(self, job_data, e):
-        # last arg is assumed as the # of retries
-        self.put_results(job_data,
-                         exception=repr(e),
-                         retries=getattr(e, 'retries', 0),
-                         traceback=traceback.format_exc())
-
-    def _put_results_from_response(self, object_info, resp_headers):
-        # Strip some keys the job had that results don't need:
-        object_info.pop('network_timeout', None)
-        object_info.pop('connect_timeout', None)
-        object_info.pop('auth_kwargs', None)
-        object_info.pop('head_first', None)
-        object_info.pop('block_size', None)
-        self.put_results(
-            object_info,
-            first_byte_latency=resp_headers.get(
-                'x-swiftstack-first-byte-latency', None),
-            last_byte_latency=resp_headers.get(
-                'x-swiftstack-last-byte-latency', None),
-            trans_id=resp_headers.get('x-trans-id', None),
-            retries=resp_headers.get('retries', 0))
-
-    def handle_noop(self, object_info):
-        self.put_results(
-            object_info,
-            first_byte_latency=0.0,
-            last_byte_latency=0.0,
-            trans_id=None,
-            retries=0)
-    handle_PING = handle_noop
+    def queue_result(self, result):
+        self.result_queue.put(result)
 
     def handle_upload_object(self, object_info, letter='A'):
         if object_info.get('head_first'):
@@ -412,19 +528,26 @@ class Worker(object):
                 self._put_results_from_response(object_info, headers)
                 return
         object_info['size'] = int(object_info['size'])
-        block_size = object_info.get('block_size') or DEFAULT_BLOCK_SIZE
-        contents = letter * block_size
-        send_headers = {}
-        if object_info.get('delete_after'):
-            send_headers.update(
-                {'x-delete-after': object_info.get('delete_after')})
+        contents, offset = self._contents(object_info.get('size_str'),
+                                          letter)
+        send_headers = self._upload_headers(object_info, letter, offset)
+        put_kwargs = {'offset': offset} if offset else {}
         headers = self.ignoring_http_responses(
             (503,), client.put_object, object_info,
             content_length=object_info['size'],
-            chunk_size=block_size, contents=contents,
-            headers=send_headers)
+            chunk_size=self._block_size(), contents=contents,
+            headers=send_headers, **put_kwargs)
         self._put_results_from_response(object_info, headers)
 
+    def handle_extract_archive(self, archive_info):
+        # Creates archive_info's "objects", [size_str, name, size] each, with
+        # one tar archive
+        headers = self.ignoring_http_responses(
+            (503,), client.extract_archive, archive_info,
+            members=self._archive_members(archive_info),
+            chunk_size=self._block_size())
+        self._put_archive_results(archive_info, headers)
+
     # By the time a job gets to the worker, an object create and update look
     # the same: it's just a PUT.  We use a different letter for the contents
     # for testability.
@@ -437,7 +560,8 @@ class Worker(object):
         self._put_results_from_response(object_info, headers)
 
     def handle_get_object(self, object_info):
+        get_kwargs = {'verify': True} if self.session.get('verify') else {}
         headers = self.ignoring_http_responses(
             (404, 503), client.get_object, object_info,
-            resp_chunk_size=object_info.get('block_size', DEFAULT_BLOCK_SIZE))
+            resp_chunk_size=self._block_size(), **get_kwargs)
         self._put_results_from_response(object_info, headers)